@@ -4,6 +4,11 @@ import signal
 import sys
 import os
 
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
+
 logging.basicConfig(
     level=logging.INFO,
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
@@ -11,9 +16,6 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 from src.config import BOT_TOKEN, TELEGRAM_API_ID, TELEGRAM_API_HASH
-from src.bot.driver_bot import DriverBot
-from src.parser.multi_user_monitor import MultiUserMonitor
-from src.matcher import OrderMatcher
 
 
 class TaxiOrderSystem:
@@ -31,6 +33,10 @@ class TaxiOrderSystem:
         
         self._check_config()
         
+        from src.bot.driver_bot import DriverBot
+        from src.parser.multi_user_monitor import MultiUserMonitor
+        from src.matcher import OrderMatcher
+        
         self.driver_bot = DriverBot()
         await self.driver_bot.start_async()
         logger.info("Driver bot started")
@@ -107,8 +113,9 @@ async def run_full_system():
 
 
 if __name__ == "__main__":
+    run = uvloop.run if uvloop else asyncio.run
     try:
-        asyncio.run(run_full_system())
+        run(run_full_system())
     except KeyboardInterrupt:
         logger.info("Interrupted by user")
     except Exception as e:
@@ -1,5 +1,5 @@
 import asyncio
-import json
+import orjson
 import re
 from collections import Counter
 from datetime import datetime, timedelta
@@ -16,6 +16,49 @@ from src.utils.geo import get_coordinates, KNOWN_COORDINATES
 
 GROUP_ID = -1002290679743
 MESSAGES_LIMIT = 500
+ORDER_EXAMPLES_LIMIT = 20
+
+_CITY = r'[А-Яа-яЁё][А-Яа-яЁё\s\-]'
+
+# Separator runs are possessive: what follows them is always a letter, so
+# giving characters back can never produce a match, only extra backtracking
+# behind the lazy city group on long non-matching messages.
+ROUTE_UNION = re.compile(
+    r'(?P<arrow>(?P<a1>' + _CITY + r'+?)\s*+[-–—→>]++\s*+(?P<b1>' + _CITY + r'++))'
+    r'|(?P<verb>(?:откуда|из|от|с)[:\s]*+(?P<a2>' + _CITY + r'+?)[\s,\-–—]++(?:куда|в|до|на)[:\s]*+(?P<b2>' + _CITY + r'++))'
+    r'|(?P<ab>(?:А|а)[:\s]*+(?P<a3>' + _CITY + r'+?)[\s,\-–—]++(?:Б|б)[:\s]*+(?P<b3>' + _CITY + r'++))',
+    re.IGNORECASE,
+)
+
+ROUTE_BRANCHES = {'arrow': ('a1', 'b1'), 'verb': ('a2', 'b2'), 'ab': ('a3', 'b3')}
+
+PRICE_PATTERNS = [(re.compile(p, re.IGNORECASE), tag) for p, tag in (
+    (r'(\d{1,3})[,](\d{3})\s*(?:руб|₽|р\.?)?', 'comma'),
+    (r'(\d{3,5})\s*(?:руб|₽|р\.?\b)', 'direct'),
+    (r'(\d{1,2})\s*(?:к|тыс|т)\.?', 'thousands'),
+)]
+
+# Every price pattern needs a digit; one scan for it spares the price
+# patterns on the many messages that carry none.
+HAS_DIGIT = re.compile(r'\d')
+
+PUNCT_STRIP = re.compile(r'[^\w\s\-]')
+
+KNOWN_CITIES_LOWER = {c.lower(): c for c in KNOWN_CITIES}
+ALIASES_LOWER = {a.lower(): v for a, v in CITY_ALIASES.items()}
+KNOWN_COORDS_LOWER = frozenset(KNOWN_COORDINATES)
+
+ORDER_KEYWORDS = ['заказ', 'пассажир', 'чел', 'человек', 'поездка', 'трансфер', 
+                  'межгород', 'такси', 'водитель', 'минивен', 'седан', 'комфорт',
+                  'бизнес', 'эконом', 'багаж', 'чемодан', 'детское кресло']
+
+# Longest keywords first so 'человек' wins over 'чел'; KEYWORD_IMPLIES then
+# credits the shorter keywords contained in each match.
+KEYWORDS_RE = re.compile(
+    '|'.join(re.escape(kw) for kw in sorted(ORDER_KEYWORDS, key=len, reverse=True)),
+    re.IGNORECASE,
+)
+KEYWORD_IMPLIES = {kw: [k for k in ORDER_KEYWORDS if k in kw] for kw in ORDER_KEYWORDS}
 
 async def analyze_group():
     print(f"=" * 60)
@@ -80,68 +123,52 @@ async def analyze_group():
     unknown_locations = Counter()
     price_patterns = Counter()
     order_examples = []
+    examples_full = False
     keywords_found = Counter()
     
-    known_cities_lower = {c.lower(): c for c in KNOWN_CITIES}
-    aliases_lower = {a.lower(): v for a, v in CITY_ALIASES.items()}
-    known_coords_lower = set(KNOWN_COORDINATES.keys())
-    
-    route_patterns = [
-        r'([А-Яа-яЁё][А-Яа-яЁё\s\-]+?)\s*[-–—→>]+\s*([А-Яа-яЁё][А-Яа-яЁё\s\-]+)',
-        r'(?:откуда|из|от|с)[:\s]*([А-Яа-яЁё][А-Яа-яЁё\s\-]+?)[\s,\-–—]+(?:куда|в|до|на)[:\s]*([А-Яа-яЁё][А-Яа-яЁё\s\-]+)',
-        r'(?:А|а)[:\s]*([А-Яа-яЁё][А-Яа-яЁё\s\-]+?)[\s,\-–—]+(?:Б|б)[:\s]*([А-Яа-яЁё][А-Яа-яЁё\s\-]+)',
-    ]
-    
-    price_regex = [
-        (r'(\d{1,3})[,](\d{3})\s*(?:руб|₽|р\.?)?', 'comma'),
-        (r'(\d{3,5})\s*(?:руб|₽|р\.?\b)', 'direct'),
-        (r'(\d{1,2})\s*(?:к|тыс|т)\.?', 'thousands'),
-    ]
-    
-    order_keywords = ['заказ', 'пассажир', 'чел', 'человек', 'поездка', 'трансфер', 
-                      'межгород', 'такси', 'водитель', 'минивен', 'седан', 'комфорт',
-                      'бизнес', 'эконом', 'багаж', 'чемодан', 'детское кресло']
-    
     for msg in messages:
         text = msg['text']
-        text_lower = text.lower()
         
-        for kw in order_keywords:
-            if kw in text_lower:
-                keywords_found[kw] += 1
+        found = set()
+        for kw in KEYWORDS_RE.findall(text):
+            found.update(KEYWORD_IMPLIES[kw.lower()])
+        keywords_found.update(found)
         
-        for pattern in route_patterns:
-            matches = re.findall(pattern, text, re.IGNORECASE)
-            for match in matches:
-                point_a = match[0].strip()
-                point_b = match[1].strip()
+        for m in ROUTE_UNION.finditer(text):
+            group_a, group_b = ROUTE_BRANCHES[m.lastgroup]
+            point_a = m.group(group_a).strip()
+            point_b = m.group(group_b).strip()
+            
+            for point in [point_a, point_b]:
+                point_clean = PUNCT_STRIP.sub('', point).strip()
+                point_lower = point_clean.lower()
                 
-                for point in [point_a, point_b]:
-                    point_clean = re.sub(r'[^\w\s\-]', '', point).strip()
-                    point_lower = point_clean.lower()
-                    
-                    if len(point_clean) < 3:
-                        continue
-                    
-                    if point_lower in known_cities_lower:
-                        cities_found[known_cities_lower[point_lower]] += 1
-                    elif point_lower in aliases_lower:
-                        cities_found[aliases_lower[point_lower]] += 1
-                    elif point_lower in known_coords_lower:
-                        cities_found[point_clean] += 1
-                    else:
-                        if len(point_clean) >= 4 and point_clean[0].isupper():
-                            unknown_locations[point_clean] += 1
+                if len(point_clean) < 3:
+                    continue
                 
-                if point_a and point_b and len(order_examples) < 50:
-                    order_examples.append({
-                        'text': text[:300],
-                        'point_a': point_a,
-                        'point_b': point_b
-                    })
+                if point_lower in KNOWN_CITIES_LOWER:
+                    cities_found[KNOWN_CITIES_LOWER[point_lower]] += 1
+                elif point_lower in ALIASES_LOWER:
+                    cities_found[ALIASES_LOWER[point_lower]] += 1
+                elif point_lower in KNOWN_COORDS_LOWER:
+                    cities_found[point_clean] += 1
+                else:
+                    if len(point_clean) >= 4 and point_clean[0].isupper():
+                        unknown_locations[point_clean] += 1
+            
+            if not examples_full and point_a and point_b:
+                order_examples.append({
+                    'text': text[:300],
+                    'point_a': point_a,
+                    'point_b': point_b
+                })
+                examples_full = len(order_examples) >= ORDER_EXAMPLES_LIMIT
+        
+        if not HAS_DIGIT.search(text):
+            continue
         
-        for regex, pattern_type in price_regex:
-            if re.search(regex, text, re.IGNORECASE):
+        for regex, pattern_type in PRICE_PATTERNS:
+            if regex.search(text):
                 price_patterns[pattern_type] += 1
     
     print("\n" + "=" * 60)
@@ -157,8 +184,10 @@ async def analyze_group():
         print(f"   {city}: {count}")
     
     print(f"\n❓ НЕИЗВЕСТНЫЕ ЛОКАЦИИ (топ-30):")
+    unknown_coords = {}
     for loc, count in unknown_locations.most_common(30):
         coords = get_coordinates(loc)
+        unknown_coords[loc] = coords
         status = "✅" if coords else "❌"
         print(f"   {status} {loc}: {count} (coords: {coords})")
     
@@ -178,11 +207,11 @@ async def analyze_group():
         'unknown_locations': dict(unknown_locations.most_common(50)),
         'price_patterns': dict(price_patterns),
         'keywords': dict(keywords_found),
-        'order_examples': order_examples[:20]
+        'order_examples': order_examples
     }
     
-    with open('scripts/group_analysis.json', 'w', encoding='utf-8') as f:
-        json.dump(results, f, ensure_ascii=False, indent=2)
+    with open('scripts/group_analysis.json', 'wb') as f:
+        f.write(orjson.dumps(results, option=orjson.OPT_INDENT_2))
     
     print(f"\n✅ Результаты сохранены в scripts/group_analysis.json")
     
@@ -191,7 +220,7 @@ async def analyze_group():
         needs_coords = []
         for loc, count in unknown_locations.most_common(20):
             if count >= 2:
-                coords = get_coordinates(loc)
+                coords = unknown_coords[loc]
                 if coords:
                     needs_coords.append(f"    '{loc.lower()}': {coords},")
         
@@ -1,8 +1,11 @@
 import asyncio
-import json
+import concurrent.futures
+import functools
+import orjson
 import re
-from collections import Counter
-from datetime import datetime, timedelta
+import statistics
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta, timezone
 import sys
 import os
 
@@ -16,6 +19,109 @@ from src.utils.geo import get_coordinates, KNOWN_COORDINATES
 
 GROUP_ID = -1002290679743
 DAYS_BACK = 14
+BATCH_SIZE = 1000
+
+_CITY = r'[А-Яа-яЁё][А-Яа-яЁё\s\-]'
+
+# Separator runs are possessive: what follows them is always a letter, so
+# giving characters back can never produce a match, only extra backtracking
+# behind the lazy city group on long non-matching messages.
+ROUTE_UNION = re.compile(
+    r'(?P<arrow>(?P<a1>' + _CITY + r'+?)\s*+[-–—→>]++\s*+(?P<b1>' + _CITY + r'++))'
+    r'|(?P<verb>(?:откуда|из|от|с)[:\s]*+(?P<a2>' + _CITY + r'+?)[\s,\-–—]++(?:куда|в|до|на)[:\s]*+(?P<b2>' + _CITY + r'++))'
+    r'|(?P<ab>(?:А|а)[:\s]*+(?P<a3>' + _CITY + r'+?)[\s,\-–—]++(?:Б|б)[:\s]*+(?P<b3>' + _CITY + r'++))',
+    re.IGNORECASE,
+)
+
+ROUTE_BRANCHES = {'arrow': ('a1', 'b1'), 'verb': ('a2', 'b2'), 'ab': ('a3', 'b3')}
+
+PRICE_PATTERNS = [re.compile(p, re.IGNORECASE) for p in (
+    r'(\d{1,3})[,](\d{3})\s*(?:руб|₽|р\.?)?',
+    r'(\d{3,5})\s*(?:руб|₽|р\.?\b)',
+    r'(\d{1,2})\s*(?:к|тыс|т)\.?',
+)]
+
+# Every price pattern needs a digit; one scan for it spares the price
+# patterns on the many messages that carry none.
+HAS_DIGIT = re.compile(r'\d')
+
+PUNCT_STRIP = re.compile(r'[^\w\s\-]')
+
+KNOWN_CITIES_LOWER = {c.lower(): c for c in KNOWN_CITIES}
+ALIASES_LOWER = {a.lower(): v for a, v in CITY_ALIASES.items()}
+KNOWN_COORDS_LOWER = frozenset(KNOWN_COORDINATES)
+
+SKIP_WORDS = frozenset((
+    'трансфер', 'империя', 'премьер', 'междугороднее',
+    'заказ', 'минивен', 'такси', 'срочно', 'сегодня',
+    'завтра', 'платная', 'бесплатная', 'отель', 'санкт',
+))
+
+# Route endpoints repeat heavily across messages, so each distinct raw
+# string is normalized only once per process.
+@functools.lru_cache(maxsize=None)
+def normalize_city(name):
+    name_clean = PUNCT_STRIP.sub('', name).strip()
+    name_lower = name_clean.lower()
+    
+    if len(name_clean) < 3:
+        return None
+    
+    if name_lower in SKIP_WORDS:
+        return None
+    
+    if name_lower in ALIASES_LOWER:
+        return ALIASES_LOWER[name_lower]
+    if name_lower in KNOWN_CITIES_LOWER:
+        return KNOWN_CITIES_LOWER[name_lower]
+    if name_lower in KNOWN_COORDS_LOWER:
+        return name_clean.title()
+    
+    if name_clean[0].isupper() and len(name_clean) >= 4:
+        return name_clean
+    
+    return None
+
+
+def _analyze_batch(batch):
+    route_pairs = []
+    routes_by_day = defaultdict(int)
+    price_stats = []
+    
+    for msg_date, text in batch:
+        for m in ROUTE_UNION.finditer(text):
+            group_a, group_b = ROUTE_BRANCHES[m.lastgroup]
+            point_a = normalize_city(m.group(group_a))
+            point_b = normalize_city(m.group(group_b))
+            
+            if point_a and point_b and point_a != point_b:
+                route_pairs.append((point_a, point_b))
+                
+                routes_by_day[msg_date] += 1
+        
+        if not HAS_DIGIT.search(text):
+            continue
+        
+        for pattern in PRICE_PATTERNS:
+            match = pattern.search(text)
+            if match:
+                try:
+                    if ',' in match.group(0):
+                        price = int(match.group(1) + match.group(2))
+                    elif 'к' in match.group(0).lower() or 'тыс' in match.group(0).lower():
+                        price = int(match.group(1)) * 1000
+                    else:
+                        price = int(match.group(1))
+                    if 500 <= price <= 100000:
+                        price_stats.append(price)
+                except:
+                    pass
+    
+    departures = Counter(point_a for point_a, _ in route_pairs)
+    arrivals = Counter(point_b for _, point_b in route_pairs)
+    routes = Counter(f"{point_a} → {point_b}" for point_a, point_b in route_pairs)
+    return departures, arrivals, routes, dict(routes_by_day), price_stats
+
 
 async def analyze_group_full():
     print(f"=" * 70)
@@ -62,107 +168,48 @@ async def analyze_group_full():
         print("\nНи одна сессия не имеет доступа к группе.")
         return
     
-    cutoff_date = datetime.now() - timedelta(days=DAYS_BACK)
+    cutoff_date = datetime.now(timezone.utc) - timedelta(days=DAYS_BACK)
     print(f"\nСобираем сообщения за последние {DAYS_BACK} дней (с {cutoff_date.strftime('%Y-%m-%d')})...")
     
-    messages = []
-    count = 0
-    async for message in client.iter_messages(entity, offset_date=datetime.now(), reverse=False):
-        if message.date.replace(tzinfo=None) < cutoff_date:
-            break
-        if message.text:
-            messages.append({
-                'id': message.id,
-                'date': message.date.isoformat(),
-                'text': message.text
-            })
-        count += 1
-        if count % 2000 == 0:
-            print(f"  Обработано {count} сообщений...")
-    
-    print(f"✅ Получено {len(messages)} сообщений с текстом")
-    
     departures = Counter()
     arrivals = Counter()
     routes = Counter()
-    routes_by_day = {}
+    routes_by_day = Counter()
     price_stats = []
     
-    known_cities_lower = {c.lower(): c for c in KNOWN_CITIES}
-    aliases_lower = {a.lower(): v for a, v in CITY_ALIASES.items()}
-    known_coords_lower = set(KNOWN_COORDINATES.keys())
-    
-    route_patterns = [
-        r'([А-Яа-яЁё][А-Яа-яЁё\s\-]+?)\s*[-–—→>]+\s*([А-Яа-яЁё][А-Яа-яЁё\s\-]+)',
-        r'(?:откуда|из|от|с)[:\s]*([А-Яа-яЁё][А-Яа-яЁё\s\-]+?)[\s,\-–—]+(?:куда|в|до|на)[:\s]*([А-Яа-яЁё][А-Яа-яЁё\s\-]+)',
-        r'(?:А|а)[:\s]*([А-Яа-яЁё][А-Яа-яЁё\s\-]+?)[\s,\-–—]+(?:Б|б)[:\s]*([А-Яа-яЁё][А-Яа-яЁё\s\-]+)',
-    ]
-    
-    price_patterns = [
-        r'(\d{1,3})[,](\d{3})\s*(?:руб|₽|р\.?)?',
-        r'(\d{3,5})\s*(?:руб|₽|р\.?\b)',
-        r'(\d{1,2})\s*(?:к|тыс|т)\.?',
-    ]
-    
-    def normalize_city(name):
-        name_clean = re.sub(r'[^\w\s\-]', '', name).strip()
-        name_lower = name_clean.lower()
-        
-        if len(name_clean) < 3:
-            return None
-        
-        skip_words = ['трансфер', 'империя', 'премьер', 'междугороднее', 
-                      'заказ', 'минивен', 'такси', 'срочно', 'сегодня',
-                      'завтра', 'платная', 'бесплатная', 'отель', 'санкт']
-        if name_lower in skip_words:
-            return None
-        
-        if name_lower in aliases_lower:
-            return aliases_lower[name_lower]
-        if name_lower in known_cities_lower:
-            return known_cities_lower[name_lower]
-        if name_lower in known_coords_lower:
-            return name_clean.title()
-        
-        if name_clean[0].isupper() and len(name_clean) >= 4:
-            return name_clean
+    loop = asyncio.get_running_loop()
+    pending = []
+    batch = []
+    total_messages = 0
+    count = 0
+    with concurrent.futures.ProcessPoolExecutor(max_workers=os.cpu_count()) as executor:
+        async for message in client.iter_messages(entity, offset_date=datetime.now(), reverse=False, wait_time=0):
+            if message.date < cutoff_date:
+                break
+            count += 1
+            if count % 2000 == 0:
+                print(f"  Обработано {count} сообщений...")
+            if not message.text:
+                continue
+            
+            total_messages += 1
+            batch.append((message.date.strftime('%Y-%m-%d'), message.text))
+            if len(batch) == BATCH_SIZE:
+                pending.append(loop.run_in_executor(executor, _analyze_batch, batch))
+                batch = []
         
-        return None
+        if batch:
+            pending.append(loop.run_in_executor(executor, _analyze_batch, batch))
+        partials = await asyncio.gather(*pending)
     
-    for msg in messages:
-        text = msg['text']
-        msg_date = msg['date'][:10]
-        
-        for pattern in route_patterns:
-            matches = re.findall(pattern, text, re.IGNORECASE)
-            for match in matches:
-                point_a = normalize_city(match[0])
-                point_b = normalize_city(match[1])
-                
-                if point_a and point_b and point_a != point_b:
-                    departures[point_a] += 1
-                    arrivals[point_b] += 1
-                    route_key = f"{point_a} → {point_b}"
-                    routes[route_key] += 1
-                    
-                    if msg_date not in routes_by_day:
-                        routes_by_day[msg_date] = 0
-                    routes_by_day[msg_date] += 1
-        
-        for pattern in price_patterns:
-            match = re.search(pattern, text, re.IGNORECASE)
-            if match:
-                try:
-                    if ',' in match.group(0):
-                        price = int(match.group(1) + match.group(2))
-                    elif 'к' in match.group(0).lower() or 'тыс' in match.group(0).lower():
-                        price = int(match.group(1)) * 1000
-                    else:
-                        price = int(match.group(1))
-                    if 500 <= price <= 100000:
-                        price_stats.append(price)
-                except:
-                    pass
+    for part_departures, part_arrivals, part_routes, part_by_day, part_prices in partials:
+        departures.update(part_departures)
+        arrivals.update(part_arrivals)
+        routes.update(part_routes)
+        routes_by_day.update(part_by_day)
+        price_stats.extend(part_prices)
+    
+    print(f"✅ Получено {total_messages} сообщений с текстом")
     
     print("\n")
     print("=" * 70)
@@ -170,7 +217,7 @@ async def analyze_group_full():
     print("=" * 70)
     
     print(f"\n📈 ОБЩАЯ ИНФОРМАЦИЯ:")
-    print(f"   Всего сообщений: {len(messages)}")
+    print(f"   Всего сообщений: {total_messages}")
     print(f"   Найдено маршрутов: {sum(routes.values())}")
     print(f"   Уникальных маршрутов: {len(routes)}")
     print(f"   Период: {DAYS_BACK} дней")
@@ -194,10 +241,10 @@ async def analyze_group_full():
         print(f"   {i:2}. {route:40} {count:3} {bar}")
     
     if price_stats:
-        avg_price = sum(price_stats) / len(price_stats)
+        avg_price = statistics.fmean(price_stats)
         min_price = min(price_stats)
         max_price = max(price_stats)
-        median_price = sorted(price_stats)[len(price_stats) // 2]
+        median_price = statistics.median_high(price_stats)
         print(f"\n💰 СТАТИСТИКА ЦЕН:")
         print("-" * 50)
         print(f"   Средняя цена:    {avg_price:,.0f} ₽")
@@ -217,7 +264,7 @@ async def analyze_group_full():
         'group_id': GROUP_ID,
         'analyzed_at': datetime.now().isoformat(),
         'period_days': DAYS_BACK,
-        'total_messages': len(messages),
+        'total_messages': total_messages,
         'total_routes': sum(routes.values()),
         'unique_routes': len(routes),
         'departures_top50': dict(departures.most_common(50)),
@@ -230,11 +277,11 @@ async def analyze_group_full():
             'max': max_price if price_stats else 0,
             'count': len(price_stats)
         },
-        'routes_by_day': routes_by_day
+        'routes_by_day': dict(routes_by_day)
     }
     
-    with open('scripts/group_full_analysis.json', 'w', encoding='utf-8') as f:
-        json.dump(results, f, ensure_ascii=False, indent=2)
+    with open('scripts/group_full_analysis.json', 'wb') as f:
+        f.write(orjson.dumps(results, option=orjson.OPT_INDENT_2))
     
     print(f"\n✅ Полные результаты сохранены в scripts/group_full_analysis.json")
     
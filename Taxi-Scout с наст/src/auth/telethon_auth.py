@@ -4,17 +4,69 @@ import time
 import qrcode
 import io
 import base64
-from typing import Optional, Tuple
+import importlib.util
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Optional, Tuple
+from cachetools import TTLCache
 from telethon import TelegramClient, utils
 from telethon.sessions import StringSession
 from telethon.errors import SessionPasswordNeededError
 
 from src.config import TELEGRAM_API_ID, TELEGRAM_API_HASH
 from src.utils.database import save_user_session, get_user_session
+from src.utils.db_async import run_db
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+CLIENT_IDLE_TTL = 300
+CLIENT_SWEEP_INTERVAL = 60
+PENDING_QR_TTL = 180
+PENDING_QR_MAXSIZE = 10000
+
+
+class PendingQrCache(TTLCache):
+    """Pending QR logins that disconnect their Telethon client once expired or evicted."""
+    
+    def expire(self, time=None):
+        expired = super().expire(time)
+        for _, pending in expired:
+            self._disconnect(pending)
+        return expired
+    
+    def popitem(self):
+        key, pending = super().popitem()
+        self._disconnect(pending)
+        return key, pending
+    
+    # strong references to in-flight disconnects so they aren't garbage-collected mid-way
+    _disconnect_tasks: set = set()
+    
+    @classmethod
+    def _disconnect(cls, pending):
+        client = pending.get('client')
+        if not client:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            logger.warning("Pending QR login evicted outside the event loop, client left to be collected")
+            return
+        task = loop.create_task(client.disconnect())
+        cls._disconnect_tasks.add(task)
+        task.add_done_callback(cls._disconnect_tasks.discard)
+
+
+def _render_qr(url: str) -> bytes:
+    qr = qrcode.QRCode(version=1, box_size=10, border=2)
+    qr.add_data(url)
+    qr.make(fit=True)
+    
+    img = qr.make_image(fill_color="black", back_color="white")
+    img_buffer = io.BytesIO()
+    img.save(img_buffer, format='PNG')
+    return img_buffer.getvalue()
+
 
 class TelethonAuthManager:
     def __init__(self):
@@ -23,19 +75,31 @@ class TelethonAuthManager:
         
         self.api_id = int(TELEGRAM_API_ID)
         self.api_hash = TELEGRAM_API_HASH
-        self.pending_qr = {}
+        self.pending_qr = PendingQrCache(maxsize=PENDING_QR_MAXSIZE, ttl=PENDING_QR_TTL)
+        self._client_cache = {}
+        # user_db_id -> lock serializing client lookup/creation, so concurrent callers share one connection
+        self._client_locks: dict[int, asyncio.Lock] = {}
+        # user_db_id -> number of callers currently using the cached client; the sweep leaves these alone
+        self._client_in_use: dict[int, int] = {}
+        # users whose client failed while shared; disconnected once the last holder releases it
+        self._stale_clients: set[int] = set()
+        self._sweep_task: Optional[asyncio.Task] = None
+        
+        if importlib.util.find_spec("cryptg") is None:
+            logger.warning("cryptg is not installed: Telethon will fall back to slow pure-Python AES")
+        else:
+            logger.info("cryptg found: Telethon will use native AES")
     
     async def start_qr_login(self, user_db_id: int) -> Tuple[bool, str, Optional[bytes]]:
         try:
-            if user_db_id in self.pending_qr:
-                old_data = self.pending_qr[user_db_id]
+            old_data = self.pending_qr.pop(user_db_id, None)
+            if old_data:
                 old_client = old_data.get('client')
                 if old_client:
                     try:
                         await old_client.disconnect()
                     except:
                         pass
-                del self.pending_qr[user_db_id]
             
             client = TelegramClient(
                 StringSession(),
@@ -60,14 +124,7 @@ class TelethonAuthManager:
             login_url = qr_login.url
             logger.info(f"QR login started for user {user_db_id}, url: {login_url[:50]}...")
             
-            qr = qrcode.QRCode(version=1, box_size=10, border=2)
-            qr.add_data(login_url)
-            qr.make(fit=True)
-            
-            img = qr.make_image(fill_color="black", back_color="white")
-            img_buffer = io.BytesIO()
-            img.save(img_buffer, format='PNG')
-            img_bytes = img_buffer.getvalue()
+            img_bytes = await asyncio.get_running_loop().run_in_executor(None, _render_qr, login_url)
             
             self.pending_qr[user_db_id] = {
                 'client': client,
@@ -83,10 +140,10 @@ class TelethonAuthManager:
             return False, f"Ошибка: {str(e)}", None
     
     async def wait_for_qr_confirm(self, user_db_id: int, timeout: int = 60) -> Tuple[bool, str, Optional[str]]:
-        if user_db_id not in self.pending_qr:
+        pending = self.pending_qr.get(user_db_id)
+        if pending is None:
             return False, "Сначала запросите QR-код через /auth", None
         
-        pending = self.pending_qr[user_db_id]
         client = pending['client']
         qr_login = pending['qr_login']
         
@@ -102,7 +159,7 @@ class TelethonAuthManager:
             session_string = client.session.save()
             save_user_session(user_db_id, session_string, "qr_login")
             
-            del self.pending_qr[user_db_id]
+            self.pending_qr.pop(user_db_id, None)
             
             logger.info(f"User {user_db_id} authorized via QR successfully")
             return True, "Авторизация успешна!", session_string
@@ -113,19 +170,18 @@ class TelethonAuthManager:
             return False, "Требуется пароль двухфакторной аутентификации.\nВведите ваш облачный пароль:", None
         except Exception as e:
             logger.error(f"Error waiting for QR confirm: {type(e).__name__}: {e}")
-            if user_db_id in self.pending_qr:
+            if self.pending_qr.pop(user_db_id, None) is not None:
                 try:
                     await client.disconnect()
                 except:
                     pass
-                del self.pending_qr[user_db_id]
             return False, f"Ошибка: {str(e)}", None
     
     async def verify_2fa(self, user_db_id: int, password: str) -> Tuple[bool, str, Optional[str]]:
-        if user_db_id not in self.pending_qr:
+        pending = self.pending_qr.get(user_db_id)
+        if pending is None:
             return False, "Сессия истекла. Начните заново с /auth", None
         
-        pending = self.pending_qr[user_db_id]
         if not pending.get('needs_2fa'):
             return False, "2FA не требуется", None
         
@@ -140,7 +196,7 @@ class TelethonAuthManager:
             session_string = client.session.save()
             save_user_session(user_db_id, session_string, "qr_login_2fa")
             
-            del self.pending_qr[user_db_id]
+            self.pending_qr.pop(user_db_id, None)
             
             logger.info(f"User {user_db_id} authorized with 2FA successfully")
             return True, "Авторизация успешна!", session_string
@@ -150,21 +206,61 @@ class TelethonAuthManager:
             return False, f"Неверный пароль: {str(e)}", None
     
     async def cancel_auth(self, user_db_id: int):
-        if user_db_id in self.pending_qr:
-            pending = self.pending_qr[user_db_id]
+        pending = self.pending_qr.pop(user_db_id, None)
+        if pending:
             client = pending.get('client')
             if client:
                 try:
                     await client.disconnect()
                 except:
                     pass
-            del self.pending_qr[user_db_id]
     
     async def get_user_client(self, user_db_id: int) -> Optional[TelegramClient]:
-        user_session = get_user_session(user_db_id)
+        lock = self._client_locks.get(user_db_id)
+        if lock is None:
+            lock = self._client_locks[user_db_id] = asyncio.Lock()
+        async with lock:
+            return await self._get_or_create_client(user_db_id)
+    
+    @asynccontextmanager
+    async def user_client(self, user_db_id: int) -> AsyncIterator[Optional[TelegramClient]]:
+        """Pooled client marked busy for the duration of the block, so the idle sweep can't disconnect it"""
+        client = await self.get_user_client(user_db_id)
+        if client is None:
+            yield None
+            return
+        self._client_in_use[user_db_id] = self._client_in_use.get(user_db_id, 0) + 1
+        try:
+            yield client
+        finally:
+            remaining = self._client_in_use[user_db_id] - 1
+            if remaining:
+                self._client_in_use[user_db_id] = remaining
+            else:
+                del self._client_in_use[user_db_id]
+            cached = self._client_cache.get(user_db_id)
+            if cached and cached[0] is client:
+                if not remaining and user_db_id in self._stale_clients:
+                    await self.drop_client(user_db_id)
+                else:
+                    self._client_cache[user_db_id] = (client, cached[1], time.time())
+    
+    async def _get_or_create_client(self, user_db_id: int) -> Optional[TelegramClient]:
+        user_session = await run_db(get_user_session, user_db_id)
         if not user_session or not user_session.session_string:
+            await self._drop_cached_client(user_db_id)
             return None
         
+        cached = self._client_cache.get(user_db_id)
+        if cached:
+            client, session_string, last_used = cached
+            if (session_string == user_session.session_string
+                    and client.is_connected()
+                    and (user_db_id in self._client_in_use or time.time() - last_used < CLIENT_IDLE_TTL)):
+                self._client_cache[user_db_id] = (client, session_string, time.time())
+                return client
+            await self._drop_cached_client(user_db_id)
+        
         try:
             client = TelegramClient(
                 StringSession(user_session.session_string),
@@ -174,22 +270,55 @@ class TelethonAuthManager:
             await client.connect()
             
             if await client.is_user_authorized():
+                self._client_cache[user_db_id] = (client, user_session.session_string, time.time())
+                self._ensure_sweep_task()
                 return client
             else:
                 logger.warning(f"User {user_db_id} session is no longer valid")
+                await client.disconnect()
                 return None
         except Exception as e:
             logger.error(f"Error getting user client: {e}")
             return None
     
+    async def drop_client(self, user_db_id: int):
+        """Disconnect and forget the pooled client of the user, e.g. after logout"""
+        await self._drop_cached_client(user_db_id)
+    
+    async def _drop_cached_client(self, user_db_id: int):
+        self._stale_clients.discard(user_db_id)
+        cached = self._client_cache.pop(user_db_id, None)
+        if cached:
+            try:
+                await cached[0].disconnect()
+            except:
+                pass
+    
+    def _ensure_sweep_task(self):
+        if self._sweep_task is None or self._sweep_task.done():
+            self._sweep_task = asyncio.create_task(self._sweep_idle_clients())
+    
+    async def _sweep_idle_clients(self):
+        while self._client_cache:
+            await asyncio.sleep(CLIENT_SWEEP_INTERVAL)
+            now = time.time()
+            for user_db_id, (_, _, last_used) in list(self._client_cache.items()):
+                if user_db_id in self._client_in_use:
+                    continue
+                if now - last_used >= CLIENT_IDLE_TTL:
+                    logger.info(f"Disconnecting idle client for user {user_db_id}")
+                    await self._drop_cached_client(user_db_id)
+    
     async def get_user_groups(self, user_db_id: int) -> list:
-        client = await self.get_user_client(user_db_id)
-        if not client:
-            return []
-        
+        async with self.user_client(user_db_id) as client:
+            if not client:
+                return []
+            return await self._fetch_groups(user_db_id, client)
+    
+    async def _fetch_groups(self, user_db_id: int, client: TelegramClient) -> list:
         try:
             groups = []
-            async for dialog in client.iter_dialogs():
+            async for dialog in client.iter_dialogs(ignore_migrated=True):
                 entity = dialog.entity
                 if hasattr(entity, 'megagroup') and entity.megagroup:
                     peer_id = utils.get_peer_id(entity)
@@ -206,14 +335,11 @@ class TelethonAuthManager:
                         'username': getattr(entity, 'username', None)
                     })
             
-            await client.disconnect()
             return groups
         except Exception as e:
             logger.error(f"Error getting user groups: {e}")
-            try:
-                await client.disconnect()
-            except:
-                pass
+            # other user_client() holders may still be mid-request on it; the last release disconnects it
+            self._stale_clients.add(user_db_id)
             return []
 
 
@@ -1,27 +1,42 @@
 import logging
 import asyncio
-import io
+import contextlib
+import functools
+import itertools
 import re
+import time
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
 from typing import Optional
+from zoneinfo import ZoneInfo
+from cachetools import TTLCache
+from telegram.error import BadRequest
 from telegram import Update, ReplyKeyboardMarkup, KeyboardButton, ReplyKeyboardRemove, BotCommand, InlineKeyboardButton, InlineKeyboardMarkup, InputFile
 from telegram.ext import (
+    AIORateLimiter,
     Application, 
     CommandHandler, 
     MessageHandler, 
     ConversationHandler,
     CallbackQueryHandler,
+    TypeHandler,
     filters,
     ContextTypes
 )
 
-from src.config import BOT_TOKEN, ADMIN_TELEGRAM_ID
+from src.config import BOT_TOKEN, ADMIN_TELEGRAM_ID, WEBHOOK_URL, WEBHOOK_PORT
 from src.utils.database import (
     get_user_by_telegram_id, 
+    user_exists,
+    load_registered_telegram_ids,
     create_or_update_user, 
     get_active_users,
     get_user_session,
+    get_status_bundle,
     delete_user_session,
     get_user_groups,
+    get_user_groups_partitioned,
+    get_user_group_counts,
     add_user_group,
     toggle_user_group,
     init_db,
@@ -32,6 +47,7 @@ from src.utils.database import (
     get_system_stats,
     get_user_by_id,
     get_all_unique_groups,
+    get_unique_groups_page,
     sync_all_groups_to_admin,
     get_notification_by_message_id,
     get_order_group_links,
@@ -43,34 +59,48 @@ from src.utils.database import (
     is_service_group,
     search_service_groups,
     search_all_groups,
-    get_driver_settings,
+    get_user_with_settings,
     update_driver_settings,
     is_user_in_quiet_hours,
     is_user_busy,
     set_user_busy,
     clear_user_busy,
     get_favorite_routes,
+    get_favorite_routes_count,
     add_favorite_route,
     remove_favorite_route,
+    toggle_favorite_route_priority,
     get_blacklist,
+    find_blacklist_entry,
+    get_blacklist_count,
     add_to_blacklist,
     remove_from_blacklist,
     is_blacklisted,
     get_driver_profile,
     update_driver_profile,
     get_quick_replies,
+    get_quick_reply_text,
     add_quick_reply,
     remove_quick_reply,
     toggle_quick_reply
 )
+from src.utils.db_async import run_db as _db
+from src.utils.cache import (
+    driver_cache, settings_cache, profile_cache, user_exists_cache, favorite_routes_cache, blacklist_cache,
+    favorite_count_cache, blacklist_count_cache, cache_lock, invalidate, DRIVER_CACHE_MAXSIZE
+)
 from src.utils.geo import is_within_radius, get_coordinates_async, get_city_by_coordinates_async
 from src.auth.telethon_auth import auth_manager
+from src.bot.markup import StaticInlineKeyboardMarkup
+from src.bot.update_processor import PerChatUpdateProcessor
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 LOCATION, RADIUS, MIN_PRICE = range(3)
 AUTH_2FA = 10
+CONVERSATION_TIMEOUT = 1800
+SEND_MAX_RETRIES = 3
 
 MENU_STATUS = "📊 Мой статус"
 MENU_GROUPS = "📢 Мои группы"  
@@ -81,24 +111,333 @@ MENU_SETTINGS = "⚙️ Настройки"
 MENU_HELP = "❓ Помощь"
 MENU_ADMIN = "👑 Админ"
 
+MENU_BUTTONS = frozenset({
+    MENU_STATUS, MENU_GROUPS, MENU_AUTH, MENU_LOCATION,
+    MENU_NOTIFICATIONS, MENU_SETTINGS, MENU_HELP, MENU_ADMIN,
+})
+
+
+class _MenuButtonFilter(filters.MessageFilter):
+    """Matches messages whose text is exactly one of the main menu buttons."""
+    
+    def filter(self, message) -> bool:
+        return message.text in MENU_BUTTONS
+
+
+MENU_BUTTON_FILTER = _MenuButtonFilter()
+
+CALLBACK_ID_RE = re.compile(r':(-?\d+)$')
+# "to:<group_id>:<message_id>:#<quick_reply_id>" or "to:<group_id>:<message_id>:<default reply>";
+# buttons sent before the short form still carry "take_order:<group_id>:<message_id>:<reply text>"
+ORDER_CALLBACK_PREFIX = "to"
+ORDER_CALLBACK_RE = re.compile(r'^(?:take_order|to):(-?\d+):(\d+)(?::(.*))?$', re.S)
+# answerCallbackQuery text is capped at 200 characters
+ORDER_ANSWER_PREVIEW_MAX = 150
+COORD_RE = re.compile(r'(?<![^\s,;])[-+]?(?:\d+\.?\d*|\.\d+)(?![^\s,;])')
+# whitespace-separated year (1901-2099) or seat count (1-9) after "brand model"
+CAR_NUMBER_RE = re.compile(r'(?<!\S)0*(?:(190[1-9]|19[1-9]\d|20\d\d)|([1-9]))(?!\S)')
+
+LOCATION_PROMPT_OPTIONS = (
+    "• Отправьте геолокацию\n"
+    "• Напишите название города (например: Екатеринбург)\n"
+    "• Или введите координаты (например: 56.8389 60.6057)"
+)
+
+QR_CAPTION = (
+    "Отсканируйте QR-код в приложении Telegram:\n\n"
+    "1. Откройте Telegram на другом устройстве\n"
+    "2. Настройки → Устройства → Подключить устройство\n"
+    "3. Отсканируйте этот QR-код\n\n"
+    "Ожидаю подтверждение (60 сек)..."
+)
+QR_CAPTION_WITH_CANCEL = QR_CAPTION + "\nДля отмены отправьте /cancel"
+
+REFRESH_QR_KEYBOARD = StaticInlineKeyboardMarkup([[InlineKeyboardButton("Обновить QR-код", callback_data="refresh_qr")]])
+LOGOUT_KEYBOARD = StaticInlineKeyboardMarkup([[InlineKeyboardButton("🚪 Выйти из авторизации", callback_data="logout_session")]])
+
+GROUPS_PER_PAGE = 10
+GROUP_TITLE_MAX = 30
+GROUPS_EDIT_DEBOUNCE = 0.25
+# clients swallow re-taps of the same toggle button for this many seconds
+TOGGLE_ANSWER_CACHE_TIME = 1
+
+STATE_TTL = 900
+STATE_MAXSIZE = 10000
+STATE_SWEEP_INTERVAL = 60
+
+MENU_CACHE_TTL = 60
+
+QUIET_START_HOURS = ("20:00", "21:00", "22:00", "23:00", "00:00", "01:00")
+QUIET_END_HOURS = ("05:00", "06:00", "07:00", "08:00", "09:00", "10:00")
+
+MSK = ZoneInfo('Europe/Moscow')
+UTC = timezone.utc
+NOW_CACHE_TTL = 0.1
+
+SEPARATOR = "━━━━━━━━━━━━━━━━━━━━"
+
+QUIET_HOURS_TEMPLATE = (
+    "<b>🌙 Тихие часы</b>\n" + SEPARATOR + "\n\n"
+    "Статус: <b>%s</b>\n"
+    "Время: %s - %s\n\n"
+    "В тихие часы уведомления о заказах не приходят.\n"
+    "Часовой пояс: Москва (МСК)"
+)
+BUSY_MODE_TEMPLATE = (
+    "<b>⏳ Режим занят</b>\n" + SEPARATOR + "\n\n"
+    "Статус: <b>%s</b>%s\n\n"
+    "В режиме «занят» уведомления о заказах не приходят.\n"
+    "Выберите на сколько установить:"
+)
+FAVORITES_HEADER = "<b>⭐ Любимые направления</b>\n" + SEPARATOR + "\n\n"
+BLACKLIST_HEADER = "<b>🚫 Чёрный список</b>\n" + SEPARATOR + "\n\n"
+GROUPS_PICKER_TEMPLATE = (
+    "Выберите группы для парсинга заказов:\n\n"
+    "Найдено групп: %d\n"
+    "Выбрано: %d\n"
+    "Страница: %d/%d\n\n"
+    "Нажмите на группу чтобы выбрать/убрать"
+)
+QUICK_REPLIES_HEADER = (
+    "<b>💬 Быстрые ответы</b>\n" + SEPARATOR + "\n\n"
+    "Настройте кнопки для быстрого отклика на заказы.\n"
+    "Эти кнопки появятся под каждым уведомлением о заказе.\n\n"
+)
+
+BUSY_DURATIONS = {
+    "1": (timedelta(hours=1), "на 1 ч."),
+    "2": (timedelta(hours=2), "на 2 ч."),
+}
+
+_now_cache = {'t': 0.0, 'v': None}
+
+MAX_CONCURRENT_UPDATES = 256
+
+_is_admin_cache = TTLCache(maxsize=DRIVER_CACHE_MAXSIZE, ttl=MENU_CACHE_TTL)
+
+
+_MISSING = object()
+
+
+async def _cached_db(cache, key, fn, *args, **kwargs):
+    """Serve a cache hit inline; on a miss run the (self-caching) DB reader in a worker thread"""
+    with cache_lock:
+        value = cache.get(key, _MISSING)
+    if value is not _MISSING:
+        return value
+    return await _db(fn, *args, **kwargs)
+
+
+async def _get_driver_cached(telegram_id: int):
+    with cache_lock:
+        driver = driver_cache.get(telegram_id)
+    if driver is None:
+        driver = await _db(get_user_by_telegram_id, telegram_id)
+        if driver is not None:
+            with cache_lock:
+                driver_cache[telegram_id] = driver
+    return driver
+
+
+def now_msk() -> datetime:
+    t = time.monotonic()
+    if _now_cache['v'] is None or t - _now_cache['t'] > NOW_CACHE_TTL:
+        _now_cache['v'] = datetime.now(MSK)
+        _now_cache['t'] = t
+    return _now_cache['v']
+
+
+async def _get_driver_with_settings(telegram_id: int):
+    with cache_lock:
+        driver = driver_cache.get(telegram_id)
+        settings = settings_cache.get(driver.id) if driver else None
+    if driver and settings:
+        return driver, settings
+    driver, settings = await _db(get_user_with_settings, telegram_id)
+    if driver:
+        with cache_lock:
+            driver_cache[telegram_id] = driver
+    return driver, settings
+
+
+async def _get_driver_with_profile(telegram_id: int):
+    driver = await _get_driver_cached(telegram_id)
+    if not driver:
+        return None, None
+    return driver, await _cached_db(profile_cache, driver.id, get_driver_profile, driver.id)
+
+
+async def _update_driver(telegram_id: int, **kwargs):
+    user = await _db(create_or_update_user, telegram_id=telegram_id, **kwargs)
+    invalidate(driver_cache, telegram_id)
+    return user
+
+
+@functools.lru_cache(maxsize=4096)
+def _render_settings_text(quiet_enabled: bool, quiet_start: str, quiet_end: str,
+                          busy_until_epoch: int, fav_count: int, bl_count: int) -> str:
+    quiet_status = "Включены" if quiet_enabled else "Выключены"
+    busy_status = "Нет"
+    if busy_until_epoch:
+        busy_status = f"До {datetime.fromtimestamp(busy_until_epoch, MSK).strftime('%H:%M')}"
+    
+    return (
+        "<b>⚙️ Настройки</b>\n" + SEPARATOR + "\n\n"
+        f"<b>🌙 Тихие часы:</b> {quiet_status}\n"
+        f"   Время: {quiet_start} - {quiet_end}\n\n"
+        f"<b>⏳ Режим занят:</b> {busy_status}\n\n"
+        f"<b>⭐ Любимые направления:</b> {fav_count}\n\n"
+        f"<b>🚫 Чёрный список:</b> {bl_count}\n\n"
+        "Выберите настройку для изменения:"
+    )
+
+
+@functools.lru_cache(maxsize=2)
+def _render_settings_keyboard(quiet_enabled: bool) -> InlineKeyboardMarkup:
+    quiet_icon = "🌙" if quiet_enabled else "🔕"
+    quiet_text = f"{quiet_icon} Тихие часы: {'ВКЛ' if quiet_enabled else 'ВЫКЛ'}"
+    
+    keyboard = [
+        [InlineKeyboardButton("👤 Мой профиль", callback_data="settings:profile")],
+        [InlineKeyboardButton("💬 Быстрые ответы", callback_data="settings:quick_replies")],
+        [InlineKeyboardButton(quiet_text, callback_data="settings:quiet_hours")],
+        [InlineKeyboardButton("⏳ Режим занят", callback_data="settings:busy_mode")],
+        [InlineKeyboardButton("⭐ Любимые направления", callback_data="settings:favorite_routes")],
+        [InlineKeyboardButton("🚫 Чёрный список", callback_data="settings:blacklist")],
+    ]
+    return StaticInlineKeyboardMarkup(keyboard)
+
+
+@dataclass(slots=True)
+class _InputMode:
+    mode: str
+    payload: Optional[dict] = None
+
+
+@dataclass(slots=True)
+class _GroupPicker:
+    groups: list
+    by_id: dict
+    pages: list
+    saved_map: Optional[dict] = None
+    selected_count: int = 0
+    page: int = 0
+    
+    def set_saved_groups(self, saved_groups: list):
+        self.saved_map = {g.group_id: g.is_active for g in saved_groups}
+        self.selected_count = sum(1 for group_id in self.by_id if self.saved_map.get(group_id, False))
+    
+    def set_selected(self, group_id: int, is_active: bool):
+        was_active = self.saved_map.get(group_id, False)
+        self.saved_map[group_id] = is_active
+        if group_id in self.by_id and was_active != is_active:
+            self.selected_count += 1 if is_active else -1
+
+
+def _callback_id(query) -> Optional[int]:
+    match = CALLBACK_ID_RE.search(query.data or '')
+    return int(match[1]) if match else None
+
+
+@functools.lru_cache(maxsize=1024)
+def _render_group_links(groups: tuple) -> str:
+    """HTML bullet list for a page of (title, username, group_id); keyed by content, so edits never go stale"""
+    lines = []
+    for title, username, group_id in groups:
+        if username:
+            link = f'<a href="https://t.me/{username}">{title}</a>'
+        elif group_id:
+            chat_id = str(group_id).replace("-100", "")
+            link = f'<a href="https://t.me/c/{chat_id}">{title}</a>'
+        else:
+            link = title
+        lines.append(f"• {link}")
+    return "\n".join(lines)
+
+
+@functools.lru_cache(maxsize=1024)
+def _qr_remove_button(qr_id: int) -> InlineKeyboardButton:
+    return InlineKeyboardButton("🗑", callback_data=f"settings:qr_remove:{qr_id}")
+
+
 class DriverBot:
     def __init__(self):
         if not BOT_TOKEN:
             raise ValueError("BOT_TOKEN must be set")
         
         init_db()
+        load_registered_telegram_ids()
+        
+        # telegram_id -> _InputMode for the single text input a user is in the middle of
+        self._text_input_modes = TTLCache(maxsize=STATE_MAXSIZE, ttl=STATE_TTL)
+        self._text_input_handlers = {
+            '2fa': self._verify_2fa_input,
+            'admin_search': self._admin_search_input,
+            'admin_group_search': self._admin_group_search_input,
+            'favorite_route': self.handle_favorite_route_input,
+            'blacklist': self.handle_blacklist_input,
+            'profile': self.handle_profile_input,
+            'quick_reply': self.handle_quick_reply_input,
+        }
+        # per-user locks serializing multi-step writes (profile photo uploads)
+        self._user_locks = TTLCache(maxsize=STATE_MAXSIZE, ttl=STATE_TTL)
+        # telegram_id -> _GroupPicker with the dialog list of an open group picker
+        self._group_pickers = TTLCache(maxsize=STATE_MAXSIZE, ttl=STATE_TTL)
+        self._state_caches = (
+            self._text_input_modes,
+            self._user_locks,
+            self._group_pickers,
+        )
+        self._state_sweep_task: Optional[asyncio.Task] = None
+        self._qr_tasks: dict[int, asyncio.Task] = {}
+        # (chat_id, message_id) -> pending debounced redraw of the group picker
+        self._groups_edit_tasks: dict[tuple[int, int], asyncio.Task] = {}
         
-        self.pending_2fa = {}
-        self.admin_search_mode = {}
-        self.admin_group_search_mode = {}
-        self.favorite_route_input = {}
-        self.blacklist_input = {}
-        self.profile_input = {}
-        self.quick_reply_input = {}
+        self._loc_kb = ReplyKeyboardMarkup(
+            [[KeyboardButton("Отправить геолокацию", request_location=True)]],
+            resize_keyboard=True,
+            one_time_keyboard=True
+        )
+        self._menu_kb_user = self._build_main_menu_keyboard(False)
+        self._menu_kb_admin = self._build_main_menu_keyboard(True)
         
-        self.application = Application.builder().token(BOT_TOKEN).build()
+        self._busy_mode_keyboard = StaticInlineKeyboardMarkup([
+            [InlineKeyboardButton("1 час", callback_data="settings:busy_set:1")],
+            [InlineKeyboardButton("2 часа", callback_data="settings:busy_set:2")],
+            [InlineKeyboardButton("До утра (до 08:00)", callback_data="settings:busy_set:morning")],
+            [InlineKeyboardButton("🔔 Снять режим занят", callback_data="settings:busy_clear")],
+            [InlineKeyboardButton("« Назад", callback_data="settings:main")]
+        ])
+        self._fav_cancel_keyboard = StaticInlineKeyboardMarkup([[InlineKeyboardButton("❌ Отмена", callback_data="settings:fav_cancel")]])
+        self._bl_cancel_keyboard = StaticInlineKeyboardMarkup([[InlineKeyboardButton("❌ Отмена", callback_data="settings:bl_cancel")]])
+        self._profile_cancel_keyboard = StaticInlineKeyboardMarkup([[InlineKeyboardButton("❌ Отмена", callback_data="settings:profile_cancel")]])
+        self._qr_cancel_keyboard = StaticInlineKeyboardMarkup([[InlineKeyboardButton("❌ Отмена", callback_data="settings:qr_cancel")]])
+        self._profile_kbs = {
+            flags: self._build_profile_keyboard(*flags)
+            for flags in itertools.product((False, True), repeat=3)
+        }
+        self._quiet_start_kbs = self._build_hour_keyboards(QUIET_START_HOURS, "settings:quiet_start_set")
+        self._quiet_end_kbs = self._build_hour_keyboards(QUIET_END_HOURS, "settings:quiet_end_set")
+        
+        self.application = (
+            Application.builder()
+            .token(BOT_TOKEN)
+            .rate_limiter(AIORateLimiter(max_retries=SEND_MAX_RETRIES))
+            .concurrent_updates(PerChatUpdateProcessor(MAX_CONCURRENT_UPDATES))
+            .build()
+        )
         self._setup_handlers()
     
+    async def dispatch_callback(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        data = update.callback_query.data or ''
+        head, _, rest = data.partition(':')
+        handler = self._cb_routes.get(head)
+        if handler is None and rest:
+            handler = self._cb_routes.get(f"{head}:{rest.partition(':')[0]}")
+        if handler is None:
+            return
+        await handler(update, context)
+    
     def _setup_handlers(self):
         conv_handler = ConversationHandler(
             entry_points=[CommandHandler('start', self.start_command)],
@@ -109,16 +448,22 @@ class DriverBot:
                 ],
                 RADIUS: [MessageHandler(filters.TEXT & ~filters.COMMAND, self.receive_radius)],
                 MIN_PRICE: [MessageHandler(filters.TEXT & ~filters.COMMAND, self.receive_min_price)],
+                ConversationHandler.TIMEOUT: [TypeHandler(Update, self.conversation_timeout)],
             },
             fallbacks=[CommandHandler('cancel', self.cancel_command)],
+            per_chat=False,
+            conversation_timeout=CONVERSATION_TIMEOUT,
         )
         
         auth_conv_handler = ConversationHandler(
             entry_points=[CommandHandler('auth', self.auth_command)],
             states={
                 AUTH_2FA: [MessageHandler(filters.TEXT & ~filters.COMMAND, self.receive_2fa_password)],
+                ConversationHandler.TIMEOUT: [TypeHandler(Update, self.conversation_timeout)],
             },
             fallbacks=[CommandHandler('cancel', self.cancel_auth_command)],
+            per_chat=False,
+            conversation_timeout=CONVERSATION_TIMEOUT,
         )
         
         self.application.add_handler(conv_handler)
@@ -131,78 +476,81 @@ class DriverBot:
         self.application.add_handler(CommandHandler('groups', self.groups_command))
         self.application.add_handler(CommandHandler('admin', self.admin_command))
         
-        self.application.add_handler(CallbackQueryHandler(self.handle_group_toggle, pattern=r'^toggle_group:'))
-        self.application.add_handler(CallbackQueryHandler(self.handle_groups_done, pattern=r'^groups_done$'))
-        self.application.add_handler(CallbackQueryHandler(self.handle_groups_refresh, pattern=r'^groups_refresh$'))
-        self.application.add_handler(CallbackQueryHandler(self.handle_groups_page, pattern=r'^groups_page:'))
-        self.application.add_handler(CallbackQueryHandler(self.handle_selected_page, pattern=r'^selected_page:'))
-        self.application.add_handler(CallbackQueryHandler(self.handle_change_groups, pattern=r'^change_groups$'))
-        self.application.add_handler(CallbackQueryHandler(self.handle_start_groups_selection, pattern=r'^start_groups_selection$'))
-        self.application.add_handler(CallbackQueryHandler(self.handle_refresh_qr, pattern=r'^refresh_qr$'))
-        self.application.add_handler(CallbackQueryHandler(self.handle_logout_session, pattern=r'^logout_session$'))
-        self.application.add_handler(CallbackQueryHandler(self.handle_take_order, pattern=r'^take_order:'))
-        
-        self.application.add_handler(CallbackQueryHandler(self.handle_admin_main, pattern=r'^admin:main$'))
-        self.application.add_handler(CallbackQueryHandler(self.handle_admin_users, pattern=r'^admin:users:'))
-        self.application.add_handler(CallbackQueryHandler(self.handle_admin_user_detail, pattern=r'^admin:user:'))
-        self.application.add_handler(CallbackQueryHandler(self.handle_admin_stats, pattern=r'^admin:stats$'))
-        self.application.add_handler(CallbackQueryHandler(self.handle_admin_all_groups, pattern=r'^admin:all_groups:'))
-        self.application.add_handler(CallbackQueryHandler(self.handle_admin_sync_groups, pattern=r'^admin:sync_groups$'))
-        self.application.add_handler(CallbackQueryHandler(self.handle_admin_search, pattern=r'^admin:search$'))
-        self.application.add_handler(CallbackQueryHandler(self.handle_admin_search_cancel, pattern=r'^admin:search_cancel$'))
-        
-        self.application.add_handler(CallbackQueryHandler(self.handle_admin_service_groups, pattern=r'^admin:service_groups:'))
-        self.application.add_handler(CallbackQueryHandler(self.handle_admin_service_group_toggle, pattern=r'^admin:sg_toggle:'))
-        self.application.add_handler(CallbackQueryHandler(self.handle_admin_service_group_remove, pattern=r'^admin:sg_remove:'))
-        self.application.add_handler(CallbackQueryHandler(self.handle_admin_service_group_add, pattern=r'^admin:sg_add$'))
-        self.application.add_handler(CallbackQueryHandler(self.handle_admin_service_group_search, pattern=r'^admin:sg_search$'))
-        self.application.add_handler(CallbackQueryHandler(self.handle_admin_service_group_add_confirm, pattern=r'^admin:sg_add_confirm:'))
-        
-        self.application.add_handler(CallbackQueryHandler(self.handle_settings_main, pattern=r'^settings:main$'))
-        self.application.add_handler(CallbackQueryHandler(self.handle_quiet_hours_menu, pattern=r'^settings:quiet_hours$'))
-        self.application.add_handler(CallbackQueryHandler(self.handle_quiet_hours_toggle, pattern=r'^settings:quiet_toggle$'))
-        self.application.add_handler(CallbackQueryHandler(self.handle_quiet_hours_start, pattern=r'^settings:quiet_start$'))
-        self.application.add_handler(CallbackQueryHandler(self.handle_quiet_hours_end, pattern=r'^settings:quiet_end$'))
-        self.application.add_handler(CallbackQueryHandler(self.handle_quiet_hours_start_set, pattern=r'^settings:quiet_start_set:'))
-        self.application.add_handler(CallbackQueryHandler(self.handle_quiet_hours_end_set, pattern=r'^settings:quiet_end_set:'))
-        self.application.add_handler(CallbackQueryHandler(self.handle_busy_mode_menu, pattern=r'^settings:busy_mode$'))
-        self.application.add_handler(CallbackQueryHandler(self.handle_busy_mode_set, pattern=r'^settings:busy_set:'))
-        self.application.add_handler(CallbackQueryHandler(self.handle_busy_mode_clear, pattern=r'^settings:busy_clear$'))
-        self.application.add_handler(CallbackQueryHandler(self.handle_favorite_routes_menu, pattern=r'^settings:favorite_routes$'))
-        self.application.add_handler(CallbackQueryHandler(self.handle_favorite_route_add, pattern=r'^settings:fav_add$'))
-        self.application.add_handler(CallbackQueryHandler(self.handle_favorite_route_remove, pattern=r'^settings:fav_remove:'))
-        self.application.add_handler(CallbackQueryHandler(self.handle_favorite_route_toggle, pattern=r'^settings:fav_toggle:'))
-        self.application.add_handler(CallbackQueryHandler(self.handle_favorite_route_cancel, pattern=r'^settings:fav_cancel$'))
-        
-        self.application.add_handler(CallbackQueryHandler(self.handle_blacklist_menu, pattern=r'^settings:blacklist$'))
-        self.application.add_handler(CallbackQueryHandler(self.handle_blacklist_add_author, pattern=r'^settings:bl_add_author$'))
-        self.application.add_handler(CallbackQueryHandler(self.handle_blacklist_add_group, pattern=r'^settings:bl_add_group$'))
-        self.application.add_handler(CallbackQueryHandler(self.handle_blacklist_remove, pattern=r'^settings:bl_remove:'))
-        self.application.add_handler(CallbackQueryHandler(self.handle_blacklist_cancel, pattern=r'^settings:bl_cancel$'))
-        
-        self.application.add_handler(CallbackQueryHandler(self.handle_profile_menu, pattern=r'^settings:profile$'))
-        self.application.add_handler(CallbackQueryHandler(self.handle_profile_name, pattern=r'^settings:profile_name$'))
-        self.application.add_handler(CallbackQueryHandler(self.handle_profile_car, pattern=r'^settings:profile_car$'))
-        self.application.add_handler(CallbackQueryHandler(self.handle_profile_license, pattern=r'^settings:profile_license$'))
-        self.application.add_handler(CallbackQueryHandler(self.handle_profile_sts, pattern=r'^settings:profile_sts$'))
-        self.application.add_handler(CallbackQueryHandler(self.handle_profile_child_seat, pattern=r'^settings:profile_child_seat$'))
-        self.application.add_handler(CallbackQueryHandler(self.handle_profile_cancel, pattern=r'^settings:profile_cancel$'))
-        
-        self.application.add_handler(CallbackQueryHandler(self.handle_quick_replies_menu, pattern=r'^settings:quick_replies$'))
-        self.application.add_handler(CallbackQueryHandler(self.handle_quick_reply_add, pattern=r'^settings:qr_add$'))
-        self.application.add_handler(CallbackQueryHandler(self.handle_quick_reply_remove, pattern=r'^settings:qr_remove:'))
-        self.application.add_handler(CallbackQueryHandler(self.handle_quick_reply_toggle, pattern=r'^settings:qr_toggle:'))
-        self.application.add_handler(CallbackQueryHandler(self.handle_quick_reply_cancel, pattern=r'^settings:qr_cancel$'))
+        self._cb_routes = {
+            'toggle_group': self.handle_group_toggle,
+            'groups_done': self.handle_groups_done,
+            'groups_refresh': self.handle_groups_refresh,
+            'groups_page': self.handle_groups_page,
+            'selected_page': self.handle_selected_page,
+            'change_groups': self.handle_change_groups,
+            'start_groups_selection': self.handle_start_groups_selection,
+            'refresh_qr': self.handle_refresh_qr,
+            'logout_session': self.handle_logout_session,
+            'take_order': self.handle_take_order,
+            ORDER_CALLBACK_PREFIX: self.handle_take_order,
+            
+            'admin:main': self.handle_admin_main,
+            'admin:users': self.handle_admin_users,
+            'admin:user': self.handle_admin_user_detail,
+            'admin:stats': self.handle_admin_stats,
+            'admin:all_groups': self.handle_admin_all_groups,
+            'admin:sync_groups': self.handle_admin_sync_groups,
+            'admin:search': self.handle_admin_search,
+            'admin:search_cancel': self.handle_admin_search_cancel,
+            
+            'admin:service_groups': self.handle_admin_service_groups,
+            'admin:sg_toggle': self.handle_admin_service_group_toggle,
+            'admin:sg_remove': self.handle_admin_service_group_remove,
+            'admin:sg_add': self.handle_admin_service_group_add,
+            'admin:sg_search': self.handle_admin_service_group_search,
+            'admin:sg_add_confirm': self.handle_admin_service_group_add_confirm,
+            
+            'settings:main': self.handle_settings_main,
+            'settings:quiet_hours': self.handle_quiet_hours_menu,
+            'settings:quiet_toggle': self.handle_quiet_hours_toggle,
+            'settings:quiet_start': self.handle_quiet_hours_start,
+            'settings:quiet_end': self.handle_quiet_hours_end,
+            'settings:quiet_start_set': self.handle_quiet_hours_start_set,
+            'settings:quiet_end_set': self.handle_quiet_hours_end_set,
+            'settings:busy_mode': self.handle_busy_mode_menu,
+            'settings:busy_set': self.handle_busy_mode_set,
+            'settings:busy_clear': self.handle_busy_mode_clear,
+            'settings:favorite_routes': self.handle_favorite_routes_menu,
+            'settings:fav_add': self.handle_favorite_route_add,
+            'settings:fav_remove': self.handle_favorite_route_remove,
+            'settings:fav_toggle': self.handle_favorite_route_toggle,
+            'settings:fav_cancel': self.handle_favorite_route_cancel,
+            
+            'settings:blacklist': self.handle_blacklist_menu,
+            'settings:bl_add_author': self.handle_blacklist_add_author,
+            'settings:bl_add_group': self.handle_blacklist_add_group,
+            'settings:bl_remove': self.handle_blacklist_remove,
+            'settings:bl_cancel': self.handle_blacklist_cancel,
+            
+            'settings:profile': self.handle_profile_menu,
+            'settings:profile_name': self.handle_profile_name,
+            'settings:profile_car': self.handle_profile_car,
+            'settings:profile_license': self.handle_profile_license,
+            'settings:profile_sts': self.handle_profile_sts,
+            'settings:profile_child_seat': self.handle_profile_child_seat,
+            'settings:profile_cancel': self.handle_profile_cancel,
+            
+            'settings:quick_replies': self.handle_quick_replies_menu,
+            'settings:qr_add': self.handle_quick_reply_add,
+            'settings:qr_remove': self.handle_quick_reply_remove,
+            'settings:qr_toggle': self.handle_quick_reply_toggle,
+            'settings:qr_cancel': self.handle_quick_reply_cancel,
+        }
+        self.application.add_handler(CallbackQueryHandler(self.dispatch_callback))
         
         self.application.add_handler(MessageHandler(filters.PHOTO, self.handle_photo_upload))
         self.application.add_handler(MessageHandler(filters.LOCATION, self.quick_location_update))
-        menu_pattern = f'^({re.escape(MENU_STATUS)}|{re.escape(MENU_GROUPS)}|{re.escape(MENU_AUTH)}|{re.escape(MENU_LOCATION)}|{re.escape(MENU_NOTIFICATIONS)}|{re.escape(MENU_SETTINGS)}|{re.escape(MENU_HELP)}|{re.escape(MENU_ADMIN)})$'
-        self.application.add_handler(MessageHandler(filters.Regex(menu_pattern), self.handle_menu_button))
+        self.application.add_handler(MessageHandler(MENU_BUTTON_FILTER, self.handle_menu_button))
         self.application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, self.handle_2fa_text))
     
     async def start_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
         user = update.effective_user
-        driver = get_user_by_telegram_id(user.id)
+        driver = await _get_driver_cached(user.id)
         
         if driver:
             await update.message.reply_text(
@@ -220,10 +568,7 @@ class DriverBot:
                 f"Добро пожаловать, {user.first_name}!\n\n"
                 "Я помогу вам получать заказы межгород такси "
                 "в вашем районе.\n\n"
-                "Укажите ваше местоположение:\n"
-                "• Отправьте геолокацию\n"
-                "• Напишите название города (например: Екатеринбург)\n"
-                "• Или введите координаты (например: 56.8389 60.6057)",
+                "Укажите ваше местоположение:\n" + LOCATION_PROMPT_OPTIONS,
                 reply_markup=self._location_keyboard()
             )
         
@@ -250,19 +595,10 @@ class DriverBot:
         return RADIUS
     
     def _parse_coordinates(self, text: str):
-        text = text.replace(',', ' ').replace(';', ' ')
-        parts = text.split()
-        
-        numbers = []
-        for part in parts:
-            try:
-                num = float(part)
-                numbers.append(num)
-            except ValueError:
-                continue
+        numbers = COORD_RE.findall(text)
         
         if len(numbers) >= 2:
-            lat, lon = numbers[0], numbers[1]
+            lat, lon = float(numbers[0]), float(numbers[1])
             if -90 <= lat <= 90 and -180 <= lon <= 180:
                 return (lat, lon)
         return None
@@ -354,7 +690,7 @@ class DriverBot:
             user = update.effective_user
             city_name = context.user_data.get('city_name')
             
-            create_or_update_user(
+            driver = await _update_driver(
                 telegram_id=user.id,
                 username=user.username,
                 first_name=user.first_name,
@@ -368,7 +704,6 @@ class DriverBot:
             
             location_display = city_name if city_name else "по геолокации"
             
-            driver = get_user_by_telegram_id(user.id)
             is_admin = driver.is_admin if driver else False
             
             await update.message.reply_text(
@@ -394,13 +729,23 @@ class DriverBot:
         user = update.effective_user
         await update.message.reply_text(
             "Регистрация отменена.",
-            reply_markup=self._get_menu_for_user(user.id)
+            reply_markup=await self._get_menu_for_user(user.id)
         )
         return ConversationHandler.END
     
+    async def conversation_timeout(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        for key in ('latitude', 'longitude', 'city_name', 'radius_km'):
+            context.user_data.pop(key, None)
+        
+        if update.effective_message:
+            await update.effective_message.reply_text(
+                "Сессия истекла. Начните заново через /start",
+                reply_markup=await self._get_menu_for_user(update.effective_user.id)
+            )
+    
     async def auth_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
         user = update.effective_user
-        driver = get_user_by_telegram_id(user.id)
+        driver = await _get_driver_cached(user.id)
         
         if not driver:
             await update.message.reply_text(
@@ -408,15 +753,14 @@ class DriverBot:
             )
             return ConversationHandler.END
         
-        user_session = get_user_session(driver.id)
+        user_session = await _db(get_user_session, driver.id)
         if user_session and user_session.is_authorized:
-            keyboard = [[InlineKeyboardButton("🚪 Выйти из авторизации", callback_data="logout_session")]]
             await update.message.reply_text(
                 "✅ Вы уже авторизованы в Telegram.\n"
                 "Ваш аккаунт подключен к боту.\n\n"
                 "Используйте /groups для выбора групп.\n\n"
                 "Если хотите сменить аккаунт или возникли проблемы — выйдите и авторизуйтесь заново:",
-                reply_markup=InlineKeyboardMarkup(keyboard)
+                reply_markup=LOGOUT_KEYBOARD
             )
             return ConversationHandler.END
         
@@ -424,59 +768,56 @@ class DriverBot:
             "Генерирую QR-код для авторизации..."
         )
         
-        success, url_or_error, qr_image = await auth_manager.start_qr_login(driver.id)
+        await self._issue_qr(update.message, driver.id, user.id, QR_CAPTION_WITH_CANCEL)
+        return ConversationHandler.END
+    
+    async def _issue_qr(self, message, driver_db_id: int, telegram_id: int, caption: str):
+        success, url_or_error, qr_image = await auth_manager.start_qr_login(driver_db_id)
         
         if not success:
-            await update.message.reply_text(
+            await message.reply_text(
                 f"{url_or_error}\n\n"
                 "Используйте /auth для повторной попытки."
             )
-            return ConversationHandler.END
+            return
         
         if qr_image:
-            qr_file = InputFile(io.BytesIO(qr_image), filename="qr_auth.png")
-            await update.message.reply_photo(
-                photo=qr_file,
-                caption=(
-                    "Отсканируйте QR-код в приложении Telegram:\n\n"
-                    "1. Откройте Telegram на другом устройстве\n"
-                    "2. Настройки → Устройства → Подключить устройство\n"
-                    "3. Отсканируйте этот QR-код\n\n"
-                    "Ожидаю подтверждение (60 сек)...\n"
-                    "Для отмены отправьте /cancel"
-                )
-            )
+            qr_file = InputFile(qr_image, filename="qr_auth.png")
+            await message.reply_photo(photo=qr_file, caption=caption)
         
-        asyncio.create_task(self._wait_for_qr_auth(update, context, driver.id, user.id))
+        old_task = self._qr_tasks.pop(driver_db_id, None)
+        if old_task and not old_task.done():
+            old_task.cancel()
         
-        return ConversationHandler.END
+        task = asyncio.create_task(self._wait_for_qr_auth(message, driver_db_id, telegram_id))
+        self._qr_tasks[driver_db_id] = task
+        task.add_done_callback(lambda t: self._qr_tasks.pop(driver_db_id, None) if self._qr_tasks.get(driver_db_id) is t else None)
     
-    async def _wait_for_qr_auth(self, update: Update, context: ContextTypes.DEFAULT_TYPE, driver_db_id: int, telegram_id: int):
+    async def _wait_for_qr_auth(self, message, driver_db_id: int, telegram_id: int):
         try:
-            success, message, session_string = await auth_manager.wait_for_qr_confirm(driver_db_id, timeout=60)
+            success, result, session_string = await auth_manager.wait_for_qr_confirm(driver_db_id, timeout=60)
             
             if success:
-                create_or_update_user(telegram_id=telegram_id, is_authorized=True)
-                await update.message.reply_text(
+                await _update_driver(telegram_id=telegram_id, is_authorized=True)
+                await message.reply_text(
                     "Авторизация успешна!\n\n"
                     "Теперь вы можете выбрать группы для парсинга.\n"
                     "Используйте /groups для выбора групп."
                 )
-            elif "пароль" in message.lower() or "2fa" in message.lower():
-                self.pending_2fa[telegram_id] = driver_db_id
-                await update.message.reply_text(
+            elif "пароль" in result.lower() or "2fa" in result.lower():
+                self._set_input_mode(telegram_id, '2fa', driver_db_id)
+                await message.reply_text(
                     "Требуется пароль двухфакторной аутентификации.\n\n"
                     "Введите ваш облачный пароль:"
                 )
             else:
-                keyboard = [[InlineKeyboardButton("Обновить QR-код", callback_data="refresh_qr")]]
-                await update.message.reply_text(
-                    f"{message}",
-                    reply_markup=InlineKeyboardMarkup(keyboard)
+                await message.reply_text(
+                    f"{result}",
+                    reply_markup=REFRESH_QR_KEYBOARD
                 )
         except Exception as e:
             logger.error(f"Error waiting for QR auth: {e}")
-            await update.message.reply_text(
+            await message.reply_text(
                 "Ошибка авторизации.\n"
                 "Используйте /auth для повторной попытки."
             )
@@ -485,75 +826,77 @@ class DriverBot:
         user = update.effective_user
         telegram_id = user.id
         
-        if telegram_id in self.admin_search_mode:
-            del self.admin_search_mode[telegram_id]
-            search_query = update.message.text.strip()
-            await self.handle_admin_search_query(telegram_id, search_query, update.message)
-            return
-        
-        if telegram_id in self.admin_group_search_mode:
-            del self.admin_group_search_mode[telegram_id]
-            search_query = update.message.text.strip()
-            await self.handle_admin_group_search_query(telegram_id, search_query, update.message)
+        current = self._text_input_modes.get(telegram_id)
+        if not current:
             return
         
-        if telegram_id in self.favorite_route_input:
-            handled = await self.handle_favorite_route_input(telegram_id, update.message.text, update.message)
-            if handled:
-                return
-        
-        if telegram_id in self.blacklist_input:
-            handled = await self.handle_blacklist_input(telegram_id, update.message.text, update.message)
-            if handled:
-                return
-        
-        if telegram_id in self.profile_input:
-            handled = await self.handle_profile_input(telegram_id, update.message.text, update.message)
-            if handled:
-                return
-        
-        if telegram_id in self.quick_reply_input:
-            handled = await self.handle_quick_reply_input(telegram_id, update.message.text, update.message)
-            if handled:
-                return
-        
-        if telegram_id not in self.pending_2fa:
-            return
-        
-        password = update.message.text.strip()
-        driver = get_user_by_telegram_id(telegram_id)
+        await self._text_input_handlers[current.mode](telegram_id, update.message.text, update.message)
+    
+    async def _verify_2fa_input(self, telegram_id: int, text: str, message) -> bool:
+        password = text.strip()
         
-        if not driver:
-            await update.message.reply_text("Ошибка. Попробуйте /start")
-            del self.pending_2fa[telegram_id]
-            return
+        if not await _cached_db(user_exists_cache, telegram_id, user_exists, telegram_id):
+            await message.reply_text("Ошибка. Попробуйте /start")
+            self._clear_input_mode(telegram_id, '2fa')
+            return True
         
-        driver_db_id = self.pending_2fa[telegram_id]
+        driver_db_id = self._get_input_mode(telegram_id, '2fa')
         
-        await update.message.reply_text("Проверяю пароль...")
+        await message.reply_text("Проверяю пароль...")
         
-        success, message, session_string = await auth_manager.verify_2fa(driver_db_id, password)
+        success, result, session_string = await auth_manager.verify_2fa(driver_db_id, password)
         
         if success:
-            del self.pending_2fa[telegram_id]
-            create_or_update_user(telegram_id=telegram_id, is_authorized=True)
-            await update.message.reply_text(
+            self._clear_input_mode(telegram_id, '2fa')
+            await _update_driver(telegram_id=telegram_id, is_authorized=True)
+            await message.reply_text(
                 "Авторизация успешна!\n\n"
                 "Теперь вы можете выбрать группы для парсинга.\n"
                 "Используйте /groups для выбора групп."
             )
         else:
-            await update.message.reply_text(
-                f"{message}\n\n"
+            await message.reply_text(
+                f"{result}\n\n"
                 "Попробуйте ещё раз или /cancel для отмены"
             )
+        return True
+    
+    def _user_lock(self, telegram_id: int) -> asyncio.Lock:
+        lock = self._user_locks.get(telegram_id)
+        if lock is None:
+            lock = self._user_locks[telegram_id] = asyncio.Lock()
+        return lock
+    
+    def _set_input_mode(self, telegram_id: int, mode: str, payload=None):
+        self._text_input_modes[telegram_id] = _InputMode(mode, payload)
+    
+    def _get_input_mode(self, telegram_id: int, mode: str):
+        current = self._text_input_modes.get(telegram_id)
+        if current and current.mode == mode:
+            return current.payload
+        return None
+    
+    def _clear_input_mode(self, telegram_id: int, mode: str):
+        current = self._text_input_modes.get(telegram_id)
+        if current and current.mode == mode:
+            self._text_input_modes.pop(telegram_id, None)
+    
+    async def _admin_search_input(self, telegram_id: int, text: str, message) -> bool:
+        self._text_input_modes.pop(telegram_id, None)
+        await self.handle_admin_search_query(telegram_id, text.strip(), message)
+        return True
+    
+    async def _admin_group_search_input(self, telegram_id: int, text: str, message) -> bool:
+        self._text_input_modes.pop(telegram_id, None)
+        await self.handle_admin_group_search_query(telegram_id, text.strip(), message)
+        return True
     
     async def handle_refresh_qr(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         query = update.callback_query
         await query.answer()
         
         user = query.from_user
-        driver = get_user_by_telegram_id(user.id)
+        driver = await _get_driver_cached(user.id)
         
         if not driver:
             await query.edit_message_text("Сначала зарегистрируйтесь через /start")
@@ -561,43 +904,22 @@ class DriverBot:
         
         await query.edit_message_text("Генерирую новый QR-код...")
         
-        success, url_or_error, qr_image = await auth_manager.start_qr_login(driver.id)
-        
-        if not success:
-            await query.message.reply_text(
-                f"{url_or_error}\n\n"
-                "Используйте /auth для повторной попытки."
-            )
-            return
-        
-        if qr_image:
-            qr_file = InputFile(io.BytesIO(qr_image), filename="qr_auth.png")
-            await query.message.reply_photo(
-                photo=qr_file,
-                caption=(
-                    "Отсканируйте QR-код в приложении Telegram:\n\n"
-                    "1. Откройте Telegram на другом устройстве\n"
-                    "2. Настройки → Устройства → Подключить устройство\n"
-                    "3. Отсканируйте этот QR-код\n\n"
-                    "Ожидаю подтверждение (60 сек)..."
-                )
-            )
-        
-        asyncio.create_task(self._wait_for_qr_auth(update, context, driver.id, user.id))
+        await self._issue_qr(query.message, driver.id, user.id, QR_CAPTION)
     
     async def handle_logout_session(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         query = update.callback_query
         await query.answer()
         
         user = query.from_user
-        driver = get_user_by_telegram_id(user.id)
+        driver = await _get_driver_cached(user.id)
         
         if not driver:
             await query.edit_message_text("Вы не зарегистрированы.")
             return
         
-        delete_user_session(driver.id)
-        create_or_update_user(telegram_id=user.id, is_authorized=False)
+        await _db(delete_user_session, driver.id)
+        await auth_manager.drop_client(driver.id)
+        await _update_driver(telegram_id=user.id, is_authorized=False)
         
         await query.edit_message_text(
             "✅ Вы вышли из авторизации.\n\n"
@@ -611,31 +933,31 @@ class DriverBot:
     async def cancel_auth_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
         user = update.effective_user
         telegram_id = user.id
-        driver = get_user_by_telegram_id(telegram_id)
+        driver = await _get_driver_cached(telegram_id)
         
-        if telegram_id in self.pending_2fa:
-            del self.pending_2fa[telegram_id]
+        self._clear_input_mode(telegram_id, '2fa')
         
         if driver:
             await auth_manager.cancel_auth(driver.id)
         
         await update.message.reply_text(
             "Авторизация отменена.",
-            reply_markup=self._get_menu_for_user(user.id)
+            reply_markup=await self._get_menu_for_user(user.id)
         )
         return ConversationHandler.END
     
     async def status_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         user = update.effective_user
-        driver = get_user_by_telegram_id(user.id)
+        bundle = await _db(get_status_bundle, user.id)
         
-        if not driver:
+        if not bundle:
             await update.message.reply_text(
                 "Вы не зарегистрированы.\n"
                 "Используйте /start для регистрации."
             )
             return
         
+        driver, is_authorized, groups_count = bundle
         status_emoji = "✅" if driver.active else "⏸"
         status_text = "Активен" if driver.active else "Приостановлен"
         
@@ -647,11 +969,7 @@ class DriverBot:
         else:
             location_display = "не указано"
         
-        user_session = get_user_session(driver.id)
-        auth_status = "Подключён" if (user_session and user_session.is_authorized) else "Не подключён"
-        
-        active_groups = get_user_groups(driver.id, active_only=True)
-        groups_count = len(active_groups) if active_groups else 0
+        auth_status = "Подключён" if is_authorized else "Не подключён"
         
         await update.message.reply_text(
             f"Ваш статус: <u>{status_emoji} {status_text}</u>\n"
@@ -660,24 +978,20 @@ class DriverBot:
             f"💰 Мин. сумма: <u>{driver.min_price or 0} руб.</u>\n"
             f"📱 Telegram-аккаунт: <u>{auth_status}</u>\n"
             f"👥 Групп подключено: <u>{groups_count}</u>",
-            reply_markup=self._get_menu_for_user(user.id),
+            reply_markup=await self._get_menu_for_user(user.id),
             parse_mode='HTML'
         )
     
     async def update_location_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text(
-            "Укажите новое местоположение:\n"
-            "• Отправьте геолокацию\n"
-            "• Напишите название города\n"
-            "• Или введите координаты (например: 56.8389 60.6057)",
+            "Укажите новое местоположение:\n" + LOCATION_PROMPT_OPTIONS,
             reply_markup=self._location_keyboard()
         )
     
     async def quick_location_update(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         user = update.effective_user
-        driver = get_user_by_telegram_id(user.id)
         
-        if not driver:
+        if not await _cached_db(user_exists_cache, user.id, user_exists, user.id):
             await update.message.reply_text(
                 "Вы не зарегистрированы. Используйте /start"
             )
@@ -686,7 +1000,7 @@ class DriverBot:
         location = update.message.location
         city_name = await get_city_by_coordinates_async(location.latitude, location.longitude)
         
-        create_or_update_user(
+        await _update_driver(
             telegram_id=user.id,
             latitude=location.latitude,
             longitude=location.longitude,
@@ -697,12 +1011,12 @@ class DriverBot:
         
         await update.message.reply_text(
             f"✅ Геолокация обновлена!\n📍 {location_info}",
-            reply_markup=self._get_menu_for_user(user.id)
+            reply_markup=await self._get_menu_for_user(user.id)
         )
     
     async def settings_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         user = update.effective_user
-        driver = get_user_by_telegram_id(user.id)
+        driver, settings = await _get_driver_with_settings(user.id)
         
         if not driver:
             await update.message.reply_text(
@@ -710,84 +1024,55 @@ class DriverBot:
             )
             return
         
-        settings = get_driver_settings(driver.id)
         keyboard = self._build_settings_keyboard(settings)
         
         await update.message.reply_text(
-            self._format_settings_text(settings, driver.id),
+            await self._format_settings_text(settings, driver.id),
             reply_markup=keyboard,
             parse_mode='HTML'
         )
     
-    def _format_settings_text(self, settings, driver_id: int = None) -> str:
-        quiet_status = "Включены" if settings and settings.quiet_hours_enabled else "Выключены"
+    async def _format_settings_text(self, settings, driver_id: int = None) -> str:
+        quiet_enabled = bool(settings and settings.quiet_hours_enabled)
         quiet_start = settings.quiet_hours_start if settings else "23:00"
         quiet_end = settings.quiet_hours_end if settings else "07:00"
         
-        busy_status = "Нет"
+        busy_until_epoch = 0
         if settings and settings.busy_until:
-            from datetime import datetime
-            import pytz
-            now = datetime.now(pytz.timezone('Europe/Moscow'))
             busy_utc = settings.busy_until
             if busy_utc.tzinfo is None:
-                busy_utc = pytz.UTC.localize(busy_utc)
-            busy_msk = busy_utc.astimezone(pytz.timezone('Europe/Moscow'))
-            if busy_msk > now:
-                busy_status = f"До {busy_msk.strftime('%H:%M')}"
-            else:
-                busy_status = "Нет"
+                busy_utc = busy_utc.replace(tzinfo=UTC)
+            if busy_utc > now_msk():
+                busy_until_epoch = int(busy_utc.timestamp())
         
         fav_count = 0
         bl_count = 0
         if driver_id:
-            routes = get_favorite_routes(driver_id)
-            fav_count = len(routes)
-            blacklist = get_blacklist(driver_id)
-            bl_count = len(blacklist)
+            fav_count, bl_count = await asyncio.gather(
+                _cached_db(favorite_count_cache, driver_id, get_favorite_routes_count, driver_id),
+                _cached_db(blacklist_count_cache, driver_id, get_blacklist_count, driver_id)
+            )
         
-        return (
-            "<b>⚙️ Настройки</b>\n"
-            "━━━━━━━━━━━━━━━━━━━━\n\n"
-            f"<b>🌙 Тихие часы:</b> {quiet_status}\n"
-            f"   Время: {quiet_start} - {quiet_end}\n\n"
-            f"<b>⏳ Режим занят:</b> {busy_status}\n\n"
-            f"<b>⭐ Любимые направления:</b> {fav_count}\n\n"
-            f"<b>🚫 Чёрный список:</b> {bl_count}\n\n"
-            "Выберите настройку для изменения:"
-        )
+        return _render_settings_text(quiet_enabled, quiet_start, quiet_end, busy_until_epoch, fav_count, bl_count)
     
     def _build_settings_keyboard(self, settings, driver_id: int = None) -> InlineKeyboardMarkup:
-        quiet_enabled = settings and settings.quiet_hours_enabled
-        quiet_icon = "🌙" if quiet_enabled else "🔕"
-        quiet_text = f"{quiet_icon} Тихие часы: {'ВКЛ' if quiet_enabled else 'ВЫКЛ'}"
-        
-        keyboard = [
-            [InlineKeyboardButton("👤 Мой профиль", callback_data="settings:profile")],
-            [InlineKeyboardButton("💬 Быстрые ответы", callback_data="settings:quick_replies")],
-            [InlineKeyboardButton(quiet_text, callback_data="settings:quiet_hours")],
-            [InlineKeyboardButton("⏳ Режим занят", callback_data="settings:busy_mode")],
-            [InlineKeyboardButton("⭐ Любимые направления", callback_data="settings:favorite_routes")],
-            [InlineKeyboardButton("🚫 Чёрный список", callback_data="settings:blacklist")],
-        ]
-        return InlineKeyboardMarkup(keyboard)
+        return _render_settings_keyboard(bool(settings and settings.quiet_hours_enabled))
     
     async def handle_settings_main(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         query = update.callback_query
         await query.answer()
         
         user = query.from_user
-        driver = get_user_by_telegram_id(user.id)
+        driver, settings = await _get_driver_with_settings(user.id)
         
         if not driver:
             await query.answer("Вы не зарегистрированы", show_alert=True)
             return
         
-        settings = get_driver_settings(driver.id)
         keyboard = self._build_settings_keyboard(settings)
         
         await query.edit_message_text(
-            self._format_settings_text(settings, driver.id),
+            await self._format_settings_text(settings, driver.id),
             reply_markup=keyboard,
             parse_mode='HTML'
         )
@@ -797,13 +1082,27 @@ class DriverBot:
         await query.answer()
         
         user = query.from_user
-        driver = get_user_by_telegram_id(user.id)
+        driver, settings = await _get_driver_with_settings(user.id)
         
         if not driver:
             await query.answer("Вы не зарегистрированы", show_alert=True)
             return
         
-        settings = get_driver_settings(driver.id)
+        text, markup = self._render_quiet_hours(settings)
+        await self._edit_if_changed(query, text, markup)
+    
+    async def _edit_if_changed(self, query, text: str, markup: InlineKeyboardMarkup, parse_mode: str = 'HTML'):
+        message = query.message
+        current = getattr(message, 'text_html' if parse_mode == 'HTML' else 'text', None)
+        if current == text and message.reply_markup == markup:
+            return
+        try:
+            await query.edit_message_text(text, reply_markup=markup, parse_mode=parse_mode)
+        except BadRequest as e:
+            if "message is not modified" not in str(e).lower():
+                raise
+    
+    def _render_quiet_hours(self, settings):
         quiet_enabled = settings and settings.quiet_hours_enabled
         quiet_start = settings.quiet_hours_start if settings else "23:00"
         quiet_end = settings.quiet_hours_end if settings else "07:00"
@@ -821,67 +1120,46 @@ class DriverBot:
         
         status_text = "включены" if quiet_enabled else "выключены"
         
-        await query.edit_message_text(
-            f"<b>🌙 Тихие часы</b>\n"
-            f"━━━━━━━━━━━━━━━━━━━━\n\n"
-            f"Статус: <b>{status_text}</b>\n"
-            f"Время: {quiet_start} - {quiet_end}\n\n"
-            f"В тихие часы уведомления о заказах не приходят.\n"
-            f"Часовой пояс: Москва (МСК)",
-            reply_markup=InlineKeyboardMarkup(keyboard),
-            parse_mode='HTML'
-        )
+        text = QUIET_HOURS_TEMPLATE % (status_text, quiet_start, quiet_end)
+        return text, InlineKeyboardMarkup(keyboard)
     
     async def handle_quiet_hours_toggle(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         query = update.callback_query
         
         user = query.from_user
-        driver = get_user_by_telegram_id(user.id)
+        driver, settings = await _get_driver_with_settings(user.id)
         
         if not driver:
             await query.answer("Вы не зарегистрированы", show_alert=True)
             return
         
-        settings = get_driver_settings(driver.id)
         new_value = not (settings and settings.quiet_hours_enabled)
-        update_driver_settings(driver.id, quiet_hours_enabled=new_value)
+        settings = await _db(update_driver_settings, driver.id, quiet_hours_enabled=new_value)
         
         status = "включены" if new_value else "выключены"
-        await query.answer(f"Тихие часы {status}")
-        
-        await self.handle_quiet_hours_menu(update, context)
+        text, markup = self._render_quiet_hours(settings)
+        await asyncio.gather(
+            query.answer(f"Тихие часы {status}"),
+            self._edit_if_changed(query, text, markup),
+        )
     
     async def handle_quiet_hours_start(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         query = update.callback_query
         await query.answer()
         
         user = query.from_user
-        driver = get_user_by_telegram_id(user.id)
+        driver, settings = await _get_driver_with_settings(user.id)
         
         if not driver:
             return
         
-        settings = get_driver_settings(driver.id)
         current_start = settings.quiet_hours_start if settings else "23:00"
         
-        hours = ["20:00", "21:00", "22:00", "23:00", "00:00", "01:00"]
-        keyboard = []
-        row = []
-        for hour in hours:
-            icon = "✓ " if hour == current_start else ""
-            row.append(InlineKeyboardButton(f"{icon}{hour}", callback_data=f"settings:quiet_start_set:{hour}"))
-            if len(row) == 3:
-                keyboard.append(row)
-                row = []
-        if row:
-            keyboard.append(row)
-        keyboard.append([InlineKeyboardButton("« Назад", callback_data="settings:quiet_hours")])
-        
         await query.edit_message_text(
             "<b>🌙 Начало тихих часов</b>\n\n"
             f"Текущее: {current_start}\n\n"
             "Выберите время начала:",
-            reply_markup=InlineKeyboardMarkup(keyboard),
+            reply_markup=self._quiet_start_kbs.get(current_start, self._quiet_start_kbs[None]),
             parse_mode='HTML'
         )
     
@@ -890,32 +1168,18 @@ class DriverBot:
         await query.answer()
         
         user = query.from_user
-        driver = get_user_by_telegram_id(user.id)
+        driver, settings = await _get_driver_with_settings(user.id)
         
         if not driver:
             return
         
-        settings = get_driver_settings(driver.id)
         current_end = settings.quiet_hours_end if settings else "07:00"
         
-        hours = ["05:00", "06:00", "07:00", "08:00", "09:00", "10:00"]
-        keyboard = []
-        row = []
-        for hour in hours:
-            icon = "✓ " if hour == current_end else ""
-            row.append(InlineKeyboardButton(f"{icon}{hour}", callback_data=f"settings:quiet_end_set:{hour}"))
-            if len(row) == 3:
-                keyboard.append(row)
-                row = []
-        if row:
-            keyboard.append(row)
-        keyboard.append([InlineKeyboardButton("« Назад", callback_data="settings:quiet_hours")])
-        
         await query.edit_message_text(
             "<b>🌙 Конец тихих часов</b>\n\n"
             f"Текущее: {current_end}\n\n"
             "Выберите время окончания:",
-            reply_markup=InlineKeyboardMarkup(keyboard),
+            reply_markup=self._quiet_end_kbs.get(current_end, self._quiet_end_kbs[None]),
             parse_mode='HTML'
         )
     
@@ -923,233 +1187,214 @@ class DriverBot:
         query = update.callback_query
         
         user = query.from_user
-        driver = get_user_by_telegram_id(user.id)
+        driver = await _get_driver_cached(user.id)
         
         if not driver:
             await query.answer("Вы не зарегистрированы", show_alert=True)
             return
         
-        try:
-            new_time = query.data.split(":")[3]
-        except (IndexError, ValueError):
+        new_time = query.data.partition("quiet_start_set:")[2]
+        if new_time not in QUIET_START_HOURS:
             await query.answer("Ошибка", show_alert=True)
             return
         
-        update_driver_settings(driver.id, quiet_hours_start=new_time)
-        await query.answer(f"Начало тихих часов: {new_time}")
-        
-        await self.handle_quiet_hours_menu(update, context)
+        settings = await _db(update_driver_settings, driver.id, quiet_hours_start=new_time)
+        text, markup = self._render_quiet_hours(settings)
+        await asyncio.gather(
+            query.answer(f"Начало тихих часов: {new_time}"),
+            self._edit_if_changed(query, text, markup),
+        )
     
     async def handle_quiet_hours_end_set(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         query = update.callback_query
         
         user = query.from_user
-        driver = get_user_by_telegram_id(user.id)
+        driver = await _get_driver_cached(user.id)
         
         if not driver:
             await query.answer("Вы не зарегистрированы", show_alert=True)
             return
         
-        try:
-            new_time = query.data.split(":")[3]
-        except (IndexError, ValueError):
+        new_time = query.data.partition("quiet_end_set:")[2]
+        if new_time not in QUIET_END_HOURS:
             await query.answer("Ошибка", show_alert=True)
             return
         
-        update_driver_settings(driver.id, quiet_hours_end=new_time)
-        await query.answer(f"Конец тихих часов: {new_time}")
-        
-        await self.handle_quiet_hours_menu(update, context)
+        settings = await _db(update_driver_settings, driver.id, quiet_hours_end=new_time)
+        text, markup = self._render_quiet_hours(settings)
+        await asyncio.gather(
+            query.answer(f"Конец тихих часов: {new_time}"),
+            self._edit_if_changed(query, text, markup),
+        )
     
     async def handle_busy_mode_menu(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         query = update.callback_query
         await query.answer()
         
         user = query.from_user
-        driver = get_user_by_telegram_id(user.id)
+        driver, settings = await _get_driver_with_settings(user.id)
         
         if not driver:
             await query.answer("Вы не зарегистрированы", show_alert=True)
             return
         
-        settings = get_driver_settings(driver.id)
-        
+        text, markup = self._render_busy_mode(settings)
+        await self._edit_if_changed(query, text, markup)
+    
+    def _render_busy_mode(self, settings):
         busy_status = "Не активен"
         busy_until_text = ""
         if settings and settings.busy_until:
-            from datetime import datetime
-            import pytz
-            now = datetime.now(pytz.timezone('Europe/Moscow'))
+            now = now_msk()
             busy_utc = settings.busy_until
             if busy_utc.tzinfo is None:
-                busy_utc = pytz.UTC.localize(busy_utc)
-            busy_msk = busy_utc.astimezone(pytz.timezone('Europe/Moscow'))
+                busy_utc = busy_utc.replace(tzinfo=UTC)
+            busy_msk = busy_utc.astimezone(MSK)
             if busy_msk > now:
                 busy_status = "Активен"
                 busy_until_text = f"\nДо: {busy_msk.strftime('%H:%M')} МСК"
         
-        keyboard = [
-            [InlineKeyboardButton("1 час", callback_data="settings:busy_set:1")],
-            [InlineKeyboardButton("2 часа", callback_data="settings:busy_set:2")],
-            [InlineKeyboardButton("До утра (до 08:00)", callback_data="settings:busy_set:morning")],
-            [InlineKeyboardButton("🔔 Снять режим занят", callback_data="settings:busy_clear")],
-            [InlineKeyboardButton("« Назад", callback_data="settings:main")]
-        ]
-        
-        await query.edit_message_text(
-            f"<b>⏳ Режим занят</b>\n"
-            f"━━━━━━━━━━━━━━━━━━━━\n\n"
-            f"Статус: <b>{busy_status}</b>{busy_until_text}\n\n"
-            f"В режиме «занят» уведомления о заказах не приходят.\n"
-            f"Выберите на сколько установить:",
-            reply_markup=InlineKeyboardMarkup(keyboard),
-            parse_mode='HTML'
-        )
+        text = BUSY_MODE_TEMPLATE % (busy_status, busy_until_text)
+        return text, self._busy_mode_keyboard
     
     async def handle_busy_mode_set(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         query = update.callback_query
         
         user = query.from_user
-        driver = get_user_by_telegram_id(user.id)
+        driver = await _get_driver_cached(user.id)
         
         if not driver:
             await query.answer("Вы не зарегистрированы", show_alert=True)
             return
         
-        try:
-            duration = query.data.split(":")[2]
-        except (IndexError, ValueError):
-            await query.answer("Ошибка", show_alert=True)
-            return
-        
-        from datetime import datetime, timedelta
-        import pytz
-        
-        now = datetime.now(pytz.timezone('Europe/Moscow'))
+        duration = query.data.rpartition(":")[2]
+        now = now_msk()
         
-        if duration == "morning":
+        entry = BUSY_DURATIONS.get(duration)
+        if entry:
+            delta, duration_text = entry
+            until = now + delta
+        elif duration == "morning":
             morning_today = now.replace(hour=8, minute=0, second=0, microsecond=0)
-            if now >= morning_today:
-                until = morning_today + timedelta(days=1)
-            else:
-                until = morning_today
+            until = morning_today if now < morning_today else morning_today + timedelta(days=1)
             duration_text = "до утра (08:00)"
         else:
-            hours = int(duration)
-            until = now + timedelta(hours=hours)
-            duration_text = f"на {hours} ч."
-        
-        until_utc = until.astimezone(pytz.UTC).replace(tzinfo=None)
-        set_user_busy(driver.id, until_utc)
+            await query.answer("Ошибка", show_alert=True)
+            return
         
-        await query.answer(f"Режим занят установлен {duration_text}")
+        until_utc = until.astimezone(UTC).replace(tzinfo=None)
+        settings = await _db(set_user_busy, driver.id, until_utc)
         
-        await self.handle_busy_mode_menu(update, context)
+        text, markup = self._render_busy_mode(settings)
+        await asyncio.gather(
+            query.answer(f"Режим занят установлен {duration_text}"),
+            self._edit_if_changed(query, text, markup),
+        )
     
     async def handle_busy_mode_clear(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         query = update.callback_query
         
         user = query.from_user
-        driver = get_user_by_telegram_id(user.id)
+        driver = await _get_driver_cached(user.id)
         
         if not driver:
             await query.answer("Вы не зарегистрированы", show_alert=True)
             return
         
-        clear_user_busy(driver.id)
-        await query.answer("Режим занят снят")
-        
-        await self.handle_busy_mode_menu(update, context)
+        settings = await _db(clear_user_busy, driver.id)
+        text, markup = self._render_busy_mode(settings)
+        await asyncio.gather(
+            query.answer("Режим занят снят"),
+            self._edit_if_changed(query, text, markup),
+        )
     
-    async def handle_favorite_routes_menu(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+    async def handle_favorite_routes_menu(self, update: Update, context: ContextTypes.DEFAULT_TYPE, answered: bool = False):
         query = update.callback_query
-        await query.answer()
+        if not answered:
+            await query.answer()
         
         user = query.from_user
-        driver = get_user_by_telegram_id(user.id)
+        driver = await _get_driver_cached(user.id)
         
         if not driver:
             await query.answer("Вы не зарегистрированы", show_alert=True)
             return
         
-        routes = get_favorite_routes(driver.id)
-        
+        routes = await _cached_db(favorite_routes_cache, (driver.id, True), get_favorite_routes, driver.id)
+        text, markup = self._render_favorite_routes(routes)
+        await self._edit_if_changed(query, text, markup)
+    
+    def _favorite_routes_keyboard(self, routes):
         keyboard = []
-        
-        if routes:
-            for route in routes:
-                priority_icon = "⭐" if route.priority_notify else "☆"
-                route_text = f"{priority_icon} {route.point_a} → {route.point_b}"
-                keyboard.append([
-                    InlineKeyboardButton(route_text, callback_data=f"settings:fav_toggle:{route.id}"),
-                    InlineKeyboardButton("❌", callback_data=f"settings:fav_remove:{route.id}")
-                ])
+        for route in routes:
+            priority_icon = "⭐" if route.priority_notify else "☆"
+            route_text = f"{priority_icon} {route.point_a} → {route.point_b}"
+            keyboard.append([
+                InlineKeyboardButton(route_text, callback_data=f"settings:fav_toggle:{route.id}"),
+                InlineKeyboardButton("❌", callback_data=f"settings:fav_remove:{route.id}")
+            ])
         
         keyboard.append([InlineKeyboardButton("➕ Добавить маршрут", callback_data="settings:fav_add")])
         keyboard.append([InlineKeyboardButton("« Назад", callback_data="settings:main")])
-        
-        routes_text = ""
+        return InlineKeyboardMarkup(keyboard)
+    
+    def _render_favorite_routes(self, routes):
         if routes:
-            routes_text = "Ваши любимые направления:\n\n"
-            for route in routes:
-                priority = "⭐ приоритет" if route.priority_notify else "☆ обычный"
-                routes_text += f"• {route.point_a} → {route.point_b} ({priority})\n"
-            routes_text += "\nНажмите на маршрут чтобы переключить приоритет.\n❌ — удалить маршрут"
+            lines = [
+                f"• {route.point_a} → {route.point_b} ({'⭐ приоритет' if route.priority_notify else '☆ обычный'})"
+                for route in routes
+            ]
+            routes_text = (
+                "Ваши любимые направления:\n\n"
+                + "\n".join(lines)
+                + "\n\nНажмите на маршрут чтобы переключить приоритет.\n❌ — удалить маршрут"
+            )
         else:
             routes_text = "У вас пока нет любимых направлений.\n\nДобавьте маршруты, по которым ездите чаще всего — заказы по ним будут отмечены ⭐"
         
-        await query.edit_message_text(
-            f"<b>⭐ Любимые направления</b>\n"
-            f"━━━━━━━━━━━━━━━━━━━━\n\n"
-            f"{routes_text}",
-            reply_markup=InlineKeyboardMarkup(keyboard),
-            parse_mode='HTML'
-        )
+        return FAVORITES_HEADER + routes_text, self._favorite_routes_keyboard(routes)
     
     async def handle_favorite_route_add(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         query = update.callback_query
         await query.answer()
         
         user = query.from_user
-        driver = get_user_by_telegram_id(user.id)
+        driver = await _get_driver_cached(user.id)
         
         if not driver:
             await query.answer("Вы не зарегистрированы", show_alert=True)
             return
         
-        self.favorite_route_input[user.id] = {'stage': 'point_a', 'driver_id': driver.id}
-        
-        keyboard = [[InlineKeyboardButton("❌ Отмена", callback_data="settings:fav_cancel")]]
+        self._set_input_mode(user.id, 'favorite_route', {'stage': 'point_a', 'driver_id': driver.id})
         
         await query.edit_message_text(
             "<b>➕ Добавить маршрут</b>\n"
             "━━━━━━━━━━━━━━━━━━━━\n\n"
             "Введите <b>точку отправления (А)</b>:\n\n"
             "Например: Екатеринбург, Челябинск, Тюмень",
-            reply_markup=InlineKeyboardMarkup(keyboard),
+            reply_markup=self._fav_cancel_keyboard,
             parse_mode='HTML'
         )
     
     async def handle_favorite_route_input(self, telegram_id: int, text: str, message):
-        if telegram_id not in self.favorite_route_input:
+        data = self._get_input_mode(telegram_id, 'favorite_route')
+        if data is None:
             return False
         
-        data = self.favorite_route_input[telegram_id]
         stage = data.get('stage')
         driver_id = data.get('driver_id')
         
         if stage == 'point_a':
             data['point_a'] = text.strip()
             data['stage'] = 'point_b'
-            
-            keyboard = [[InlineKeyboardButton("❌ Отмена", callback_data="settings:fav_cancel")]]
+            self._set_input_mode(telegram_id, 'favorite_route', data)
             
             await message.reply_text(
                 f"<b>➕ Добавить маршрут</b>\n"
                 f"━━━━━━━━━━━━━━━━━━━━\n\n"
                 f"Точка А: <b>{data['point_a']}</b>\n\n"
                 f"Теперь введите <b>точку назначения (Б)</b>:",
-                reply_markup=InlineKeyboardMarkup(keyboard),
+                reply_markup=self._fav_cancel_keyboard,
                 parse_mode='HTML'
             )
             return True
@@ -1158,31 +1403,17 @@ class DriverBot:
             point_a = data['point_a']
             point_b = text.strip()
             
-            del self.favorite_route_input[telegram_id]
+            self._clear_input_mode(telegram_id, 'favorite_route')
             
-            route = add_favorite_route(driver_id, point_a, point_b)
+            routes = await _db(add_favorite_route, driver_id, point_a, point_b)
             
-            if route:
-                driver = get_user_by_telegram_id(telegram_id)
-                routes = get_favorite_routes(driver.id)
-                
-                keyboard = []
-                for r in routes:
-                    priority_icon = "⭐" if r.priority_notify else "☆"
-                    route_text = f"{priority_icon} {r.point_a} → {r.point_b}"
-                    keyboard.append([
-                        InlineKeyboardButton(route_text, callback_data=f"settings:fav_toggle:{r.id}"),
-                        InlineKeyboardButton("❌", callback_data=f"settings:fav_remove:{r.id}")
-                    ])
-                keyboard.append([InlineKeyboardButton("➕ Добавить маршрут", callback_data="settings:fav_add")])
-                keyboard.append([InlineKeyboardButton("« Назад", callback_data="settings:main")])
-                
+            if routes is not None:
                 await message.reply_text(
                     f"<b>⭐ Любимые направления</b>\n"
                     f"━━━━━━━━━━━━━━━━━━━━\n\n"
                     f"✅ Маршрут <b>{point_a} → {point_b}</b> добавлен!\n\n"
                     f"Заказы по этому маршруту будут отмечены ⭐",
-                    reply_markup=InlineKeyboardMarkup(keyboard),
+                    reply_markup=self._favorite_routes_keyboard(routes),
                     parse_mode='HTML'
                 )
             else:
@@ -1198,145 +1429,128 @@ class DriverBot:
         query = update.callback_query
         
         user = query.from_user
-        driver = get_user_by_telegram_id(user.id)
+        driver = await _get_driver_cached(user.id)
         
         if not driver:
             await query.answer("Вы не зарегистрированы", show_alert=True)
             return
         
-        try:
-            route_id = int(query.data.split(":")[2])
-        except (IndexError, ValueError):
+        route_id = _callback_id(query)
+        if route_id is None:
             await query.answer("Ошибка", show_alert=True)
             return
         
-        success = remove_favorite_route(route_id, driver.id)
+        success = await _db(remove_favorite_route, route_id, driver.id)
         
         if success:
-            await query.answer("Маршрут удалён")
+            answer = query.answer("Маршрут удалён")
         else:
-            await query.answer("Ошибка удаления", show_alert=True)
+            answer = query.answer("Ошибка удаления", show_alert=True)
         
-        await self.handle_favorite_routes_menu(update, context)
+        text, markup = self._render_favorite_routes(await _db(get_favorite_routes, driver.id))
+        await asyncio.gather(answer, self._edit_if_changed(query, text, markup))
     
     async def handle_favorite_route_toggle(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         query = update.callback_query
         
         user = query.from_user
-        driver = get_user_by_telegram_id(user.id)
+        driver = await _get_driver_cached(user.id)
         
         if not driver:
             await query.answer("Вы не зарегистрированы", show_alert=True)
             return
         
-        try:
-            route_id = int(query.data.split(":")[2])
-        except (IndexError, ValueError):
+        route_id = _callback_id(query)
+        if route_id is None:
             await query.answer("Ошибка", show_alert=True)
             return
         
-        from src.utils.database import get_session, FavoriteRoute
-        session = get_session()
-        if session:
-            try:
-                route = session.query(FavoriteRoute).filter(
-                    FavoriteRoute.id == route_id,
-                    FavoriteRoute.user_id == driver.id
-                ).first()
-                if route:
-                    route.priority_notify = not route.priority_notify
-                    session.commit()
-                    status = "включен" if route.priority_notify else "выключен"
-                    await query.answer(f"Приоритет {status}")
-                else:
-                    await query.answer("Маршрут не найден", show_alert=True)
-            finally:
-                session.close()
+        priority = await _db(toggle_favorite_route_priority, route_id, driver.id)
+        if priority is None:
+            answer = query.answer("Маршрут не найден", show_alert=True)
+        else:
+            status = "включен" if priority else "выключен"
+            answer = query.answer(f"Приоритет {status}")
         
-        await self.handle_favorite_routes_menu(update, context)
+        text, markup = self._render_favorite_routes(await _db(get_favorite_routes, driver.id))
+        await asyncio.gather(answer, self._edit_if_changed(query, text, markup))
     
     async def handle_favorite_route_cancel(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         query = update.callback_query
-        await query.answer()
         
         user = query.from_user
         
-        if user.id in self.favorite_route_input:
-            del self.favorite_route_input[user.id]
+        self._clear_input_mode(user.id, 'favorite_route')
         
         await self.handle_favorite_routes_menu(update, context)
     
-    async def handle_blacklist_menu(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+    async def handle_blacklist_menu(self, update: Update, context: ContextTypes.DEFAULT_TYPE, answered: bool = False):
         query = update.callback_query
-        await query.answer()
+        if not answered:
+            await query.answer()
         
         user = query.from_user
-        driver = get_user_by_telegram_id(user.id)
+        driver = await _get_driver_cached(user.id)
         
         if not driver:
             await query.answer("Вы не зарегистрированы", show_alert=True)
             return
         
-        blacklist = get_blacklist(driver.id)
-        
+        blacklist = await _cached_db(blacklist_cache, driver.id, get_blacklist, driver.id)
+        text, markup = self._render_blacklist(blacklist)
+        await self._edit_if_changed(query, text, markup)
+    
+    def _blacklist_keyboard(self, blacklist):
         keyboard = []
-        
-        if blacklist:
-            for entry in blacklist:
-                if entry.block_type == 'author':
-                    icon = "👤"
-                    name = entry.blocked_name or entry.blocked_username or f"ID: {entry.blocked_id}"
-                else:
-                    icon = "📢"
-                    name = entry.blocked_name or f"ID: {entry.blocked_id}"
-                entry_text = f"{icon} {name}"
-                keyboard.append([
-                    InlineKeyboardButton(entry_text, callback_data=f"settings:bl_info:{entry.id}"),
-                    InlineKeyboardButton("❌", callback_data=f"settings:bl_remove:{entry.id}")
-                ])
+        for entry in blacklist:
+            if entry.block_type == 'author':
+                icon = "👤"
+                name = entry.blocked_name or entry.blocked_username or f"ID: {entry.blocked_id}"
+            else:
+                icon = "📢"
+                name = entry.blocked_name or f"ID: {entry.blocked_id}"
+            entry_text = f"{icon} {name}"
+            keyboard.append([
+                InlineKeyboardButton(entry_text, callback_data=f"settings:bl_info:{entry.id}"),
+                InlineKeyboardButton("❌", callback_data=f"settings:bl_remove:{entry.id}")
+            ])
         
         keyboard.append([
             InlineKeyboardButton("👤 Заблокировать автора", callback_data="settings:bl_add_author"),
             InlineKeyboardButton("📢 Группу", callback_data="settings:bl_add_group")
         ])
         keyboard.append([InlineKeyboardButton("« Назад", callback_data="settings:main")])
-        
+        return InlineKeyboardMarkup(keyboard)
+    
+    def _render_blacklist(self, blacklist):
         if blacklist:
-            authors = [e for e in blacklist if e.block_type == 'author']
-            groups = [e for e in blacklist if e.block_type == 'group']
-            list_text = f"В чёрном списке:\n• Авторов: {len(authors)}\n• Групп: {len(groups)}\n\n❌ — удалить из списка"
+            authors_n = sum(1 for e in blacklist if e.block_type == 'author')
+            groups_n = len(blacklist) - authors_n
+            list_text = f"В чёрном списке:\n• Авторов: {authors_n}\n• Групп: {groups_n}\n\n❌ — удалить из списка"
         else:
             list_text = "Чёрный список пуст.\n\nДобавьте авторов или группы, заказы от которых вы не хотите получать."
         
-        await query.edit_message_text(
-            f"<b>🚫 Чёрный список</b>\n"
-            f"━━━━━━━━━━━━━━━━━━━━\n\n"
-            f"{list_text}",
-            reply_markup=InlineKeyboardMarkup(keyboard),
-            parse_mode='HTML'
-        )
+        return BLACKLIST_HEADER + list_text, self._blacklist_keyboard(blacklist)
     
     async def handle_blacklist_add_author(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         query = update.callback_query
         await query.answer()
         
         user = query.from_user
-        driver = get_user_by_telegram_id(user.id)
+        driver = await _get_driver_cached(user.id)
         
         if not driver:
             await query.answer("Вы не зарегистрированы", show_alert=True)
             return
         
-        self.blacklist_input[user.id] = {'type': 'author', 'driver_id': driver.id}
-        
-        keyboard = [[InlineKeyboardButton("❌ Отмена", callback_data="settings:bl_cancel")]]
+        self._set_input_mode(user.id, 'blacklist', {'type': 'author', 'driver_id': driver.id})
         
         await query.edit_message_text(
             "<b>👤 Заблокировать автора</b>\n"
             "━━━━━━━━━━━━━━━━━━━━\n\n"
             "Введите <b>@username</b> или <b>ID</b> автора:\n\n"
             "Пример: @username или 123456789",
-            reply_markup=InlineKeyboardMarkup(keyboard),
+            reply_markup=self._bl_cancel_keyboard,
             parse_mode='HTML'
         )
     
@@ -1345,34 +1559,32 @@ class DriverBot:
         await query.answer()
         
         user = query.from_user
-        driver = get_user_by_telegram_id(user.id)
+        driver = await _get_driver_cached(user.id)
         
         if not driver:
             await query.answer("Вы не зарегистрированы", show_alert=True)
             return
         
-        self.blacklist_input[user.id] = {'type': 'group', 'driver_id': driver.id}
-        
-        keyboard = [[InlineKeyboardButton("❌ Отмена", callback_data="settings:bl_cancel")]]
+        self._set_input_mode(user.id, 'blacklist', {'type': 'group', 'driver_id': driver.id})
         
         await query.edit_message_text(
             "<b>📢 Заблокировать группу</b>\n"
             "━━━━━━━━━━━━━━━━━━━━\n\n"
             "Введите <b>название группы</b> или <b>ID</b>:\n\n"
             "Пример: Межгород Екб или -1001234567890",
-            reply_markup=InlineKeyboardMarkup(keyboard),
+            reply_markup=self._bl_cancel_keyboard,
             parse_mode='HTML'
         )
     
     async def handle_blacklist_input(self, telegram_id: int, text: str, message):
-        if telegram_id not in self.blacklist_input:
+        data = self._get_input_mode(telegram_id, 'blacklist')
+        if data is None:
             return False
         
-        data = self.blacklist_input[telegram_id]
         block_type = data.get('type')
         driver_id = data.get('driver_id')
         
-        del self.blacklist_input[telegram_id]
+        self._clear_input_mode(telegram_id, 'blacklist')
         
         text = text.strip()
         blocked_id = None
@@ -1397,7 +1609,16 @@ class DriverBot:
             except ValueError:
                 blocked_name = text
         
-        entry = add_to_blacklist(
+        current = await _cached_db(blacklist_cache, driver_id, get_blacklist, driver_id)
+        if find_blacklist_entry(current, block_type, blocked_id, blocked_username, blocked_name):
+            await message.reply_text(
+                BLACKLIST_HEADER + f"<b>{blocked_name}</b> уже в чёрном списке.",
+                reply_markup=self._blacklist_keyboard(current),
+                parse_mode='HTML'
+            )
+            return True
+        
+        blacklist = await _db(add_to_blacklist,
             user_id=driver_id,
             block_type=block_type,
             blocked_id=blocked_id,
@@ -1405,29 +1626,7 @@ class DriverBot:
             blocked_name=blocked_name
         )
         
-        if entry:
-            driver = get_user_by_telegram_id(telegram_id)
-            blacklist = get_blacklist(driver.id)
-            
-            keyboard = []
-            for e in blacklist:
-                if e.block_type == 'author':
-                    icon = "👤"
-                    name = e.blocked_name or e.blocked_username or f"ID: {e.blocked_id}"
-                else:
-                    icon = "📢"
-                    name = e.blocked_name or f"ID: {e.blocked_id}"
-                entry_text = f"{icon} {name}"
-                keyboard.append([
-                    InlineKeyboardButton(entry_text, callback_data=f"settings:bl_info:{e.id}"),
-                    InlineKeyboardButton("❌", callback_data=f"settings:bl_remove:{e.id}")
-                ])
-            keyboard.append([
-                InlineKeyboardButton("👤 Заблокировать автора", callback_data="settings:bl_add_author"),
-                InlineKeyboardButton("📢 Группу", callback_data="settings:bl_add_group")
-            ])
-            keyboard.append([InlineKeyboardButton("« Назад", callback_data="settings:main")])
-            
+        if blacklist is not None:
             type_text = "Автор" if block_type == 'author' else "Группа"
             
             await message.reply_text(
@@ -1435,7 +1634,7 @@ class DriverBot:
                 f"━━━━━━━━━━━━━━━━━━━━\n\n"
                 f"✅ {type_text} <b>{blocked_name}</b> добавлен в чёрный список!\n\n"
                 f"Заказы от этого источника больше не будут приходить.",
-                reply_markup=InlineKeyboardMarkup(keyboard),
+                reply_markup=self._blacklist_keyboard(blacklist),
                 parse_mode='HTML'
             )
         else:
@@ -1449,76 +1648,79 @@ class DriverBot:
         query = update.callback_query
         
         user = query.from_user
-        driver = get_user_by_telegram_id(user.id)
+        driver = await _get_driver_cached(user.id)
         
         if not driver:
             await query.answer("Вы не зарегистрированы", show_alert=True)
             return
         
-        try:
-            entry_id = int(query.data.split(":")[2])
-        except (IndexError, ValueError):
+        entry_id = _callback_id(query)
+        if entry_id is None:
             await query.answer("Ошибка", show_alert=True)
             return
         
-        success = remove_from_blacklist(entry_id, driver.id)
+        success = await _db(remove_from_blacklist, entry_id, driver.id)
         
         if success:
-            await query.answer("Удалено из чёрного списка")
+            answer = query.answer("Удалено из чёрного списка")
         else:
-            await query.answer("Ошибка удаления", show_alert=True)
+            answer = query.answer("Ошибка удаления", show_alert=True)
         
-        await self.handle_blacklist_menu(update, context)
+        text, markup = self._render_blacklist(await _db(get_blacklist, driver.id))
+        await asyncio.gather(answer, self._edit_if_changed(query, text, markup))
     
     async def handle_blacklist_cancel(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         query = update.callback_query
-        await query.answer()
         
         user = query.from_user
         
-        if user.id in self.blacklist_input:
-            del self.blacklist_input[user.id]
+        self._clear_input_mode(user.id, 'blacklist')
         
         await self.handle_blacklist_menu(update, context)
     
     async def handle_profile_menu(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         query = update.callback_query
-        await query.answer()
         
         user = query.from_user
-        driver = get_user_by_telegram_id(user.id)
+        driver, profile = await _get_driver_with_profile(user.id)
         
         if not driver:
             await query.answer("Вы не зарегистрированы", show_alert=True)
             return
         
-        profile = get_driver_profile(driver.id)
+        text, keyboard = self._render_profile(profile)
+        await asyncio.gather(
+            query.answer(),
+            self._edit_if_changed(query, text, keyboard),
+        )
+    
+    def _render_profile(self, profile):
+        full_name = getattr(profile, 'full_name', None) or "Не указано"
+        car_brand = getattr(profile, 'car_brand', None)
+        has_child_seat = bool(getattr(profile, 'has_child_seat', False))
+        has_license = bool(getattr(profile, 'license_front_file_id', None))
+        has_sts = bool(getattr(profile, 'sts_front_file_id', None))
         
-        full_name = profile.full_name if profile and profile.full_name else "Не указано"
         car_info = "Не указано"
-        if profile and profile.car_brand:
-            car_info = f"{profile.car_brand}"
-            if profile.car_model:
-                car_info += f" {profile.car_model}"
-            if profile.car_year:
-                car_info += f" ({profile.car_year})"
-            if profile.car_capacity:
-                car_info += f", {profile.car_capacity} мест"
-        
-        child_seat = "Да" if profile and profile.has_child_seat else "Нет"
-        license_status = "✅ Загружено" if profile and profile.license_front_file_id else "❌ Нет"
-        sts_status = "✅ Загружено" if profile and profile.sts_front_file_id else "❌ Нет"
-        
-        keyboard = [
-            [InlineKeyboardButton("✏️ ФИО", callback_data="settings:profile_name")],
-            [InlineKeyboardButton("🚗 Авто", callback_data="settings:profile_car")],
-            [InlineKeyboardButton(f"🪪 Права: {license_status}", callback_data="settings:profile_license")],
-            [InlineKeyboardButton(f"📄 СТС: {sts_status}", callback_data="settings:profile_sts")],
-            [InlineKeyboardButton(f"👶 Детское кресло: {child_seat}", callback_data="settings:profile_child_seat")],
-            [InlineKeyboardButton("« Назад", callback_data="settings:main")]
-        ]
+        if car_brand:
+            car_info = f"{car_brand}"
+            car_model = profile.car_model
+            car_year = profile.car_year
+            car_capacity = profile.car_capacity
+            if car_model:
+                car_info += f" {car_model}"
+            if car_year:
+                car_info += f" ({car_year})"
+            if car_capacity:
+                car_info += f", {car_capacity} мест"
+        
+        child_seat = "Да" if has_child_seat else "Нет"
+        license_status = "✅ Загружено" if has_license else "❌ Нет"
+        sts_status = "✅ Загружено" if has_sts else "❌ Нет"
+        
+        keyboard = self._profile_kbs[(has_license, has_sts, has_child_seat)]
         
-        await query.edit_message_text(
+        text = (
             f"<b>👤 Мой профиль</b>\n"
             f"━━━━━━━━━━━━━━━━━━━━\n\n"
             f"<b>ФИО:</b> {full_name}\n"
@@ -1526,32 +1728,29 @@ class DriverBot:
             f"<b>Детское кресло:</b> {child_seat}\n"
             f"<b>Права:</b> {license_status}\n"
             f"<b>СТС:</b> {sts_status}\n\n"
-            f"Нажмите на кнопку для редактирования:",
-            reply_markup=InlineKeyboardMarkup(keyboard),
-            parse_mode='HTML'
+            f"Нажмите на кнопку для редактирования:"
         )
+        return text, keyboard
     
     async def handle_profile_name(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         query = update.callback_query
         await query.answer()
         
         user = query.from_user
-        driver = get_user_by_telegram_id(user.id)
+        driver = await _get_driver_cached(user.id)
         
         if not driver:
             await query.answer("Вы не зарегистрированы", show_alert=True)
             return
         
-        self.profile_input[user.id] = {'type': 'name', 'driver_id': driver.id}
-        
-        keyboard = [[InlineKeyboardButton("❌ Отмена", callback_data="settings:profile_cancel")]]
+        self._set_input_mode(user.id, 'profile', {'type': 'name', 'driver_id': driver.id})
         
         await query.edit_message_text(
             "<b>✏️ Редактирование ФИО</b>\n"
             "━━━━━━━━━━━━━━━━━━━━\n\n"
             "Введите ваше полное ФИО:\n"
             "<i>Например: Иванов Иван Иванович</i>",
-            reply_markup=InlineKeyboardMarkup(keyboard),
+            reply_markup=self._profile_cancel_keyboard,
             parse_mode='HTML'
         )
     
@@ -1560,15 +1759,13 @@ class DriverBot:
         await query.answer()
         
         user = query.from_user
-        driver = get_user_by_telegram_id(user.id)
+        driver = await _get_driver_cached(user.id)
         
         if not driver:
             await query.answer("Вы не зарегистрированы", show_alert=True)
             return
         
-        self.profile_input[user.id] = {'type': 'car', 'driver_id': driver.id}
-        
-        keyboard = [[InlineKeyboardButton("❌ Отмена", callback_data="settings:profile_cancel")]]
+        self._set_input_mode(user.id, 'profile', {'type': 'car', 'driver_id': driver.id})
         
         await query.edit_message_text(
             "<b>🚗 Редактирование авто</b>\n"
@@ -1579,7 +1776,7 @@ class DriverBot:
             "<code>Kia K5 2022 4</code>\n"
             "<code>Toyota Camry 2020 4</code>\n"
             "<code>Mercedes E200 2021 4</code>",
-            reply_markup=InlineKeyboardMarkup(keyboard),
+            reply_markup=self._profile_cancel_keyboard,
             parse_mode='HTML'
         )
     
@@ -1588,19 +1785,16 @@ class DriverBot:
         await query.answer()
         
         user = query.from_user
-        driver = get_user_by_telegram_id(user.id)
+        driver, profile = await _get_driver_with_profile(user.id)
         
         if not driver:
             await query.answer("Вы не зарегистрированы", show_alert=True)
             return
         
-        profile = get_driver_profile(driver.id)
-        has_front = profile and profile.license_front_file_id
-        has_back = profile and profile.license_back_file_id
-        
-        self.profile_input[user.id] = {'type': 'license_front', 'driver_id': driver.id}
+        has_front = getattr(profile, 'license_front_file_id', None)
+        has_back = getattr(profile, 'license_back_file_id', None)
         
-        keyboard = [[InlineKeyboardButton("❌ Отмена", callback_data="settings:profile_cancel")]]
+        self._set_input_mode(user.id, 'profile', {'type': 'license_front', 'driver_id': driver.id})
         
         status_text = ""
         if has_front and has_back:
@@ -1616,7 +1810,7 @@ class DriverBot:
             f"{status_text}"
             "Отправьте фото <b>лицевой стороны</b> ВУ.\n"
             "После этого будет запрошена обратная сторона.",
-            reply_markup=InlineKeyboardMarkup(keyboard),
+            reply_markup=self._profile_cancel_keyboard,
             parse_mode='HTML'
         )
     
@@ -1625,19 +1819,16 @@ class DriverBot:
         await query.answer()
         
         user = query.from_user
-        driver = get_user_by_telegram_id(user.id)
+        driver, profile = await _get_driver_with_profile(user.id)
         
         if not driver:
             await query.answer("Вы не зарегистрированы", show_alert=True)
             return
         
-        profile = get_driver_profile(driver.id)
-        has_front = profile and profile.sts_front_file_id
-        has_back = profile and profile.sts_back_file_id
-        
-        self.profile_input[user.id] = {'type': 'sts_front', 'driver_id': driver.id}
+        has_front = getattr(profile, 'sts_front_file_id', None)
+        has_back = getattr(profile, 'sts_back_file_id', None)
         
-        keyboard = [[InlineKeyboardButton("❌ Отмена", callback_data="settings:profile_cancel")]]
+        self._set_input_mode(user.id, 'profile', {'type': 'sts_front', 'driver_id': driver.id})
         
         status_text = ""
         if has_front and has_back:
@@ -1653,7 +1844,7 @@ class DriverBot:
             f"{status_text}"
             "Отправьте фото <b>лицевой стороны</b> СТС.\n"
             "После этого будет запрошена обратная сторона.",
-            reply_markup=InlineKeyboardMarkup(keyboard),
+            reply_markup=self._profile_cancel_keyboard,
             parse_mode='HTML'
         )
     
@@ -1661,48 +1852,49 @@ class DriverBot:
         query = update.callback_query
         
         user = query.from_user
-        driver = get_user_by_telegram_id(user.id)
+        driver, profile = await _get_driver_with_profile(user.id)
         
         if not driver:
             await query.answer("Вы не зарегистрированы", show_alert=True)
             return
         
-        profile = get_driver_profile(driver.id)
         current = profile.has_child_seat if profile else False
         
-        update_driver_profile(driver.id, has_child_seat=not current)
+        updated = await _db(update_driver_profile, driver.id, has_child_seat=not current)
+        if not updated:
+            await query.answer("Ошибка сохранения", show_alert=True)
+            return
         
         new_status = "включено" if not current else "выключено"
-        await query.answer(f"Детское кресло: {new_status}")
-        
-        await self.handle_profile_menu(update, context)
+        text, keyboard = self._render_profile(updated)
+        await asyncio.gather(
+            query.answer(f"Детское кресло: {new_status}", cache_time=TOGGLE_ANSWER_CACHE_TIME),
+            self._edit_if_changed(query, text, keyboard),
+        )
     
     async def handle_profile_cancel(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         query = update.callback_query
-        await query.answer()
         
         user = query.from_user
         
-        if user.id in self.profile_input:
-            del self.profile_input[user.id]
+        self._clear_input_mode(user.id, 'profile')
         
         await self.handle_profile_menu(update, context)
     
     async def handle_profile_input(self, telegram_id: int, text: str, message) -> bool:
-        if telegram_id not in self.profile_input:
+        input_data = self._get_input_mode(telegram_id, 'profile')
+        if input_data is None:
             return False
         
-        input_data = self.profile_input[telegram_id]
         input_type = input_data.get('type')
         driver_id = input_data.get('driver_id')
         
         if input_type == 'name':
-            del self.profile_input[telegram_id]
+            self._clear_input_mode(telegram_id, 'profile')
             
-            update_driver_profile(driver_id, full_name=text.strip())
+            await _db(update_driver_profile, driver_id, full_name=text.strip())
             
-            driver = get_user_by_telegram_id(telegram_id)
-            settings = get_driver_settings(driver.id) if driver else None
+            driver, settings = await _get_driver_with_settings(telegram_id)
             keyboard = self._build_settings_keyboard(settings, driver.id if driver else None)
             
             await message.reply_text(
@@ -1713,23 +1905,23 @@ class DriverBot:
             return True
         
         elif input_type == 'car':
-            del self.profile_input[telegram_id]
+            self._clear_input_mode(telegram_id, 'profile')
             
-            parts = text.strip().split()
+            parts = text.split(maxsplit=2)
             brand = parts[0] if len(parts) > 0 else None
             model = parts[1] if len(parts) > 1 else None
             year = None
             capacity = 4
             
-            for part in parts[2:]:
-                if part.isdigit():
-                    num = int(part)
-                    if num > 1900 and num < 2100:
-                        year = num
-                    elif num >= 1 and num <= 9:
-                        capacity = num
+            if len(parts) > 2:
+                for year_str, capacity_str in CAR_NUMBER_RE.findall(parts[2]):
+                    if year_str:
+                        year = int(year_str)
+                    else:
+                        capacity = int(capacity_str)
             
-            update_driver_profile(
+            await _db(
+                update_driver_profile,
                 driver_id,
                 car_brand=brand,
                 car_model=model,
@@ -1737,8 +1929,7 @@ class DriverBot:
                 car_capacity=capacity
             )
             
-            driver = get_user_by_telegram_id(telegram_id)
-            settings = get_driver_settings(driver.id) if driver else None
+            driver, settings = await _get_driver_with_settings(telegram_id)
             keyboard = self._build_settings_keyboard(settings, driver.id if driver else None)
             
             car_text = f"{brand}"
@@ -1761,106 +1952,107 @@ class DriverBot:
         user = update.effective_user
         telegram_id = user.id
         
-        if telegram_id not in self.profile_input:
-            return
-        
-        input_data = self.profile_input[telegram_id]
-        input_type = input_data.get('type')
-        driver_id = input_data.get('driver_id')
-        
-        photo = update.message.photo[-1]
-        file_id = photo.file_id
-        
-        keyboard = [[InlineKeyboardButton("❌ Отмена", callback_data="settings:profile_cancel")]]
-        
-        if input_type == 'license_front':
-            update_driver_profile(driver_id, license_front_file_id=file_id)
-            self.profile_input[telegram_id]['type'] = 'license_back'
+        async with self._user_lock(telegram_id):
+            input_data = self._get_input_mode(telegram_id, 'profile')
+            if input_data is None:
+                return
             
-            await update.message.reply_text(
-                "✅ Лицевая сторона ВУ сохранена!\n\n"
-                "Теперь отправьте фото <b>обратной стороны</b> ВУ.",
-                reply_markup=InlineKeyboardMarkup(keyboard),
-                parse_mode='HTML'
-            )
-        
-        elif input_type == 'license_back':
-            update_driver_profile(driver_id, license_back_file_id=file_id)
-            del self.profile_input[telegram_id]
+            input_type = input_data.get('type')
+            driver_id = input_data.get('driver_id')
             
-            driver = get_user_by_telegram_id(telegram_id)
-            settings = get_driver_settings(driver.id) if driver else None
-            keyboard = self._build_settings_keyboard(settings, driver.id if driver else None)
+            photo = update.message.photo[-1]
+            file_id = photo.file_id
             
-            await update.message.reply_text(
-                "✅ Обратная сторона ВУ сохранена!\n"
-                "Водительское удостоверение полностью загружено.",
-                reply_markup=keyboard
-            )
-        
-        elif input_type == 'sts_front':
-            update_driver_profile(driver_id, sts_front_file_id=file_id)
-            self.profile_input[telegram_id]['type'] = 'sts_back'
+            if input_type == 'license_front':
+                # front is written together with the back side in one UPDATE
+                input_data['front_file_id'] = file_id
+                input_data['type'] = 'license_back'
+                self._set_input_mode(telegram_id, 'profile', input_data)
+                
+                await update.message.reply_text(
+                    "✅ Лицевая сторона ВУ получена!\n\n"
+                    "Теперь отправьте фото <b>обратной стороны</b> ВУ.",
+                    reply_markup=self._profile_cancel_keyboard,
+                    parse_mode='HTML'
+                )
             
-            await update.message.reply_text(
-                "✅ Лицевая сторона СТС сохранена!\n\n"
-                "Теперь отправьте фото <b>обратной стороны</b> СТС.",
-                reply_markup=InlineKeyboardMarkup(keyboard),
-                parse_mode='HTML'
-            )
-        
-        elif input_type == 'sts_back':
-            update_driver_profile(driver_id, sts_back_file_id=file_id)
-            del self.profile_input[telegram_id]
+            elif input_type == 'license_back':
+                await _db(
+                    update_driver_profile,
+                    driver_id,
+                    license_front_file_id=input_data.get('front_file_id'),
+                    license_back_file_id=file_id
+                )
+                self._clear_input_mode(telegram_id, 'profile')
+                
+                driver, settings = await _get_driver_with_settings(telegram_id)
+                keyboard = self._build_settings_keyboard(settings, driver.id if driver else None)
+                
+                await update.message.reply_text(
+                    "✅ Обратная сторона ВУ сохранена!\n"
+                    "Водительское удостоверение полностью загружено.",
+                    reply_markup=keyboard
+                )
             
-            driver = get_user_by_telegram_id(telegram_id)
-            settings = get_driver_settings(driver.id) if driver else None
-            keyboard = self._build_settings_keyboard(settings, driver.id if driver else None)
+            elif input_type == 'sts_front':
+                # front is written together with the back side in one UPDATE
+                input_data['front_file_id'] = file_id
+                input_data['type'] = 'sts_back'
+                self._set_input_mode(telegram_id, 'profile', input_data)
+                
+                await update.message.reply_text(
+                    "✅ Лицевая сторона СТС получена!\n\n"
+                    "Теперь отправьте фото <b>обратной стороны</b> СТС.",
+                    reply_markup=self._profile_cancel_keyboard,
+                    parse_mode='HTML'
+                )
             
-            await update.message.reply_text(
-                "✅ Обратная сторона СТС сохранена!\n"
-                "Свидетельство о регистрации ТС полностью загружено.",
-                reply_markup=keyboard
-            )
+            elif input_type == 'sts_back':
+                await _db(
+                    update_driver_profile,
+                    driver_id,
+                    sts_front_file_id=input_data.get('front_file_id'),
+                    sts_back_file_id=file_id
+                )
+                self._clear_input_mode(telegram_id, 'profile')
+                
+                driver, settings = await _get_driver_with_settings(telegram_id)
+                keyboard = self._build_settings_keyboard(settings, driver.id if driver else None)
+                
+                await update.message.reply_text(
+                    "✅ Обратная сторона СТС сохранена!\n"
+                    "Свидетельство о регистрации ТС полностью загружено.",
+                    reply_markup=keyboard
+                )
     
-    async def handle_quick_replies_menu(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+    async def handle_quick_replies_menu(self, update: Update, context: ContextTypes.DEFAULT_TYPE, answered: bool = False):
         query = update.callback_query
-        await query.answer()
+        if not answered:
+            await query.answer()
         
         user = query.from_user
-        driver = get_user_by_telegram_id(user.id)
+        driver = await _get_driver_cached(user.id)
         
         if not driver:
             await query.answer("Вы не зарегистрированы", show_alert=True)
             return
         
-        quick_replies = get_quick_replies(driver.id)
-        
-        text = "<b>💬 Быстрые ответы</b>\n"
-        text += "━━━━━━━━━━━━━━━━━━━━\n\n"
-        text += "Настройте кнопки для быстрого отклика на заказы.\n"
-        text += "Эти кнопки появятся под каждым уведомлением о заказе.\n\n"
+        quick_replies = await _db(get_quick_replies, driver.id)
         
         keyboard = []
         
         if quick_replies:
-            text += "<b>Ваши кнопки:</b>\n"
+            lines = ["<b>Ваши кнопки:</b>"]
             for qr in quick_replies:
                 status = "✅" if qr.is_active else "❌"
-                text += f"{status} [{qr.button_text}] → \"{qr.reply_text}\"\n"
-                
+                lines.append(f"{status} [{qr.button_text}] → \"{qr.reply_text}\"")
                 keyboard.append([
-                    InlineKeyboardButton(
-                        f"{'✅' if qr.is_active else '❌'} {qr.button_text}",
-                        callback_data=f"settings:qr_toggle:{qr.id}"
-                    ),
-                    InlineKeyboardButton(
-                        "🗑",
-                        callback_data=f"settings:qr_remove:{qr.id}"
-                    )
+                    InlineKeyboardButton(f"{status} {qr.button_text}", callback_data=f"settings:qr_toggle:{qr.id}"),
+                    _qr_remove_button(qr.id)
                 ])
+            text = QUICK_REPLIES_HEADER + "\n".join(lines) + "\n"
         else:
-            text += "<i>Кнопки не настроены. По умолчанию: \"я\" и \"не себе\"</i>\n"
+            text = QUICK_REPLIES_HEADER + "<i>Кнопки не настроены. По умолчанию: \"я\" и \"не себе\"</i>\n"
         
         if len(quick_replies) < 5:
             keyboard.append([InlineKeyboardButton("➕ Добавить кнопку", callback_data="settings:qr_add")])
@@ -1878,18 +2070,16 @@ class DriverBot:
         await query.answer()
         
         user = query.from_user
-        driver = get_user_by_telegram_id(user.id)
+        driver = await _get_driver_cached(user.id)
         
         if not driver:
             await query.answer("Вы не зарегистрированы", show_alert=True)
             return
         
-        self.quick_reply_input[user.id] = {
+        self._set_input_mode(user.id, 'quick_reply', {
             'driver_id': driver.id,
             'step': 'button_text'
-        }
-        
-        keyboard = [[InlineKeyboardButton("❌ Отмена", callback_data="settings:qr_cancel")]]
+        })
         
         await query.edit_message_text(
             "<b>➕ Новая кнопка быстрого ответа</b>\n"
@@ -1897,7 +2087,7 @@ class DriverBot:
             "Шаг 1/2: Введите <b>текст кнопки</b>\n"
             "(короткий текст, до 20 символов)\n\n"
             "Примеры: \"Беру\", \"Еду\", \"Звоню\"",
-            reply_markup=InlineKeyboardMarkup(keyboard),
+            reply_markup=self._qr_cancel_keyboard,
             parse_mode='HTML'
         )
     
@@ -1905,71 +2095,66 @@ class DriverBot:
         query = update.callback_query
         
         user = query.from_user
-        driver = get_user_by_telegram_id(user.id)
+        driver = await _get_driver_cached(user.id)
         
         if not driver:
             await query.answer("Вы не зарегистрированы", show_alert=True)
             return
         
-        try:
-            qr_id = int(query.data.split(":")[-1])
-        except (ValueError, IndexError):
+        qr_id = _callback_id(query)
+        if qr_id is None:
             await query.answer("Ошибка", show_alert=True)
             return
         
-        remove_quick_reply(qr_id, driver.id)
+        await _db(remove_quick_reply, qr_id, driver.id)
         await query.answer("Кнопка удалена")
         
-        await self.handle_quick_replies_menu(update, context)
+        await self.handle_quick_replies_menu(update, context, answered=True)
     
     async def handle_quick_reply_toggle(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         query = update.callback_query
         
         user = query.from_user
-        driver = get_user_by_telegram_id(user.id)
+        driver = await _get_driver_cached(user.id)
         
         if not driver:
             await query.answer("Вы не зарегистрированы", show_alert=True)
             return
         
-        try:
-            qr_id = int(query.data.split(":")[-1])
-        except (ValueError, IndexError):
+        qr_id = _callback_id(query)
+        if qr_id is None:
             await query.answer("Ошибка", show_alert=True)
             return
         
-        new_state = toggle_quick_reply(qr_id, driver.id)
+        new_state = await _db(toggle_quick_reply, qr_id, driver.id)
         status = "включена" if new_state else "выключена"
-        await query.answer(f"Кнопка {status}")
+        await query.answer(f"Кнопка {status}", cache_time=TOGGLE_ANSWER_CACHE_TIME)
         
-        await self.handle_quick_replies_menu(update, context)
+        await self.handle_quick_replies_menu(update, context, answered=True)
     
     async def handle_quick_reply_cancel(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         query = update.callback_query
-        await query.answer()
         
         user = query.from_user
         
-        if user.id in self.quick_reply_input:
-            del self.quick_reply_input[user.id]
+        self._clear_input_mode(user.id, 'quick_reply')
         
         await self.handle_quick_replies_menu(update, context)
     
     async def handle_quick_reply_input(self, telegram_id: int, text: str, message) -> bool:
-        if telegram_id not in self.quick_reply_input:
+        input_data = self._get_input_mode(telegram_id, 'quick_reply')
+        if input_data is None:
             return False
         
-        input_data = self.quick_reply_input[telegram_id]
         driver_id = input_data.get('driver_id')
         step = input_data.get('step')
         
-        keyboard = [[InlineKeyboardButton("❌ Отмена", callback_data="settings:qr_cancel")]]
-        
         if step == 'button_text':
             button_text = text.strip()[:20]
             
-            self.quick_reply_input[telegram_id]['button_text'] = button_text
-            self.quick_reply_input[telegram_id]['step'] = 'reply_text'
+            input_data['button_text'] = button_text
+            input_data['step'] = 'reply_text'
+            self._set_input_mode(telegram_id, 'quick_reply', input_data)
             
             await message.reply_text(
                 "<b>➕ Новая кнопка быстрого ответа</b>\n"
@@ -1978,7 +2163,7 @@ class DriverBot:
                 "Шаг 2/2: Введите <b>текст ответа</b>\n"
                 "(текст, который отправится в группу)\n\n"
                 "Примеры: \"я\", \"беру заказ\", \"еду от вокзала\"",
-                reply_markup=InlineKeyboardMarkup(keyboard),
+                reply_markup=self._qr_cancel_keyboard,
                 parse_mode='HTML'
             )
             return True
@@ -1987,15 +2172,14 @@ class DriverBot:
             button_text = input_data.get('button_text', 'Ответ')
             reply_text = text.strip()[:200]
             
-            del self.quick_reply_input[telegram_id]
+            self._clear_input_mode(telegram_id, 'quick_reply')
             
-            quick_replies = get_quick_replies(driver_id)
+            quick_replies = await _db(get_quick_replies, driver_id)
             sort_order = len(quick_replies)
             
-            add_quick_reply(driver_id, button_text, reply_text, sort_order)
+            await _db(add_quick_reply, driver_id, button_text, reply_text, sort_order)
             
-            driver = get_user_by_telegram_id(telegram_id)
-            settings = get_driver_settings(driver.id) if driver else None
+            driver, settings = await _get_driver_with_settings(telegram_id)
             keyboard = self._build_settings_keyboard(settings, driver.id if driver else None)
             
             await message.reply_text(
@@ -2010,28 +2194,28 @@ class DriverBot:
     
     async def stop_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         user = update.effective_user
-        driver = get_user_by_telegram_id(user.id)
+        driver = await _get_driver_cached(user.id)
         
         if not driver:
             await update.message.reply_text(
                 "Вы не зарегистрированы. Используйте /start",
-                reply_markup=self._get_menu_for_user(user.id)
+                reply_markup=await self._get_menu_for_user(user.id)
             )
             return
         
         new_active = not driver.active
-        create_or_update_user(telegram_id=user.id, active=new_active)
+        await _update_driver(telegram_id=user.id, active=new_active)
         
         if new_active:
             await update.message.reply_text(
                 "🔔 Уведомления возобновлены!",
-                reply_markup=self._get_menu_for_user(user.id)
+                reply_markup=await self._get_menu_for_user(user.id)
             )
         else:
             await update.message.reply_text(
                 "🔕 Уведомления приостановлены.\n"
                 "Нажмите 🔔 Уведомления для возобновления.",
-                reply_markup=self._get_menu_for_user(user.id)
+                reply_markup=await self._get_menu_for_user(user.id)
             )
     
     async def help_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -2043,12 +2227,12 @@ class DriverBot:
             "🔐 Авторизация — подключить аккаунт\n"
             "📍 Локация — изменить местоположение\n"
             "🔔 Уведомления — вкл/выкл",
-            reply_markup=self._get_menu_for_user(user.id)
+            reply_markup=await self._get_menu_for_user(user.id)
         )
     
     async def groups_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         user = update.effective_user
-        driver = get_user_by_telegram_id(user.id)
+        driver = await _get_driver_cached(user.id)
         
         if not driver:
             await update.message.reply_text(
@@ -2056,7 +2240,7 @@ class DriverBot:
             )
             return
         
-        user_session = get_user_session(driver.id)
+        user_session = await _db(get_user_session, driver.id)
         if not user_session or not user_session.is_authorized:
             await update.message.reply_text(
                 "Для выбора групп нужно подключить Telegram-аккаунт.\n\n"
@@ -2064,11 +2248,12 @@ class DriverBot:
             )
             return
         
-        await update.message.reply_text("Загружаю список ваших групп...")
-        
-        telegram_groups = await auth_manager.get_user_groups(driver.id)
+        _, picker = await asyncio.gather(
+            update.message.reply_text("Загружаю список ваших групп..."),
+            self._load_group_choices(user.id, driver.id)
+        )
         
-        if not telegram_groups:
+        if not picker:
             await update.message.reply_text(
                 "Не удалось получить список групп.\n"
                 "Возможно, сессия устарела.\n\n"
@@ -2076,50 +2261,53 @@ class DriverBot:
             )
             return
         
-        context.user_data['available_groups'] = telegram_groups
-        context.user_data['groups_page'] = 0
-        
-        saved_groups = get_user_groups(driver.id, active_only=False)
-        saved_groups_map = {g.group_id: g.is_active for g in saved_groups}
-        
-        keyboard = self._build_groups_keyboard(telegram_groups, saved_groups_map, page=0)
-        
-        selected_count = sum(1 for g in telegram_groups if saved_groups_map.get(g['id'], False))
-        total_pages = (len(telegram_groups) + 9) // 10
-        
-        await update.message.reply_text(
-            f"Выберите группы для парсинга заказов:\n\n"
-            f"Найдено групп: {len(telegram_groups)}\n"
-            f"Выбрано: {selected_count}\n"
-            f"Страница: 1/{total_pages}\n\n"
-            f"Нажмите на группу чтобы выбрать/убрать",
-            reply_markup=keyboard
-        )
+        text, keyboard = self._render_group_choices(picker)
+        await update.message.reply_text(text, reply_markup=keyboard)
     
-    def _build_groups_keyboard(self, groups: list, saved_map: dict, page: int = 0) -> InlineKeyboardMarkup:
-        keyboard = []
-        per_page = 10
-        start = page * per_page
-        end = start + per_page
-        page_groups = groups[start:end]
-        total_pages = (len(groups) + per_page - 1) // per_page
+    def _set_available_groups(self, telegram_id: int, groups: list) -> _GroupPicker:
+        pages = [
+            tuple(
+                (g['id'], g['title'] if len(g['title']) <= GROUP_TITLE_MAX else g['title'][:GROUP_TITLE_MAX - 3] + "...")
+                for g in groups[i:i + GROUPS_PER_PAGE]
+            )
+            for i in range(0, len(groups), GROUPS_PER_PAGE)
+        ]
+        picker = _GroupPicker(groups, {g['id']: g for g in groups}, pages)
+        self._group_pickers[telegram_id] = picker
+        return picker
+    
+    async def _load_group_choices(self, telegram_id: int, driver_id: int) -> Optional[_GroupPicker]:
+        telegram_groups, saved_groups = await asyncio.gather(
+            auth_manager.get_user_groups(driver_id),
+            _db(get_user_groups, driver_id, active_only=False)
+        )
+        if not telegram_groups:
+            return None
         
-        for group in page_groups:
-            group_id = group['id']
-            title = group['title']
-            is_selected = saved_map.get(group_id, False)
-            
-            if len(title) > 30:
-                title = title[:27] + "..."
-            
-            check = "✅" if is_selected else "⬜"
-            
-            keyboard.append([
-                InlineKeyboardButton(
-                    f"{check} {title}",
-                    callback_data=f"toggle_group:{group_id}"
-                )
-            ])
+        picker = self._set_available_groups(telegram_id, telegram_groups)
+        picker.set_saved_groups(saved_groups)
+        return picker
+    
+    @staticmethod
+    async def _get_saved_groups_map(picker: _GroupPicker, driver_id: int) -> dict:
+        if picker.saved_map is None:
+            picker.set_saved_groups(await _db(get_user_groups, driver_id, active_only=False))
+        return picker.saved_map
+    
+    def _render_group_choices(self, picker: _GroupPicker):
+        saved_map = picker.saved_map or {}
+        text = GROUPS_PICKER_TEMPLATE % (len(picker.groups), picker.selected_count, picker.page + 1, len(picker.pages))
+        return text, self._build_groups_keyboard(picker.pages, saved_map, picker.page)
+    
+    def _build_groups_keyboard(self, pages: list, saved_map: dict, page: int = 0) -> InlineKeyboardMarkup:
+        keyboard = [
+            [InlineKeyboardButton(
+                f"{'✅' if saved_map.get(group_id, False) else '⬜'} {title}",
+                callback_data=f"toggle_group:{group_id}"
+            )]
+            for group_id, title in (pages[page] if 0 <= page < len(pages) else ())
+        ]
+        total_pages = len(pages)
         
         nav_row = []
         if page > 0:
@@ -2141,113 +2329,119 @@ class DriverBot:
         await query.answer()
         
         user = update.effective_user
-        driver = get_user_by_telegram_id(user.id)
+        driver = await _get_driver_cached(user.id)
         
         if not driver:
             await query.edit_message_text("Ошибка. Используйте /start")
             return
         
-        callback_data = query.data
-        group_id = int(callback_data.split(":")[1])
+        group_id = _callback_id(query)
+        if group_id is None:
+            return
         
-        available_groups = context.user_data.get('available_groups', [])
+        picker = self._group_pickers.get(user.id)
         
-        if not available_groups:
+        if not picker:
             telegram_groups = await auth_manager.get_user_groups(driver.id)
             if telegram_groups:
-                context.user_data['available_groups'] = telegram_groups
-                available_groups = telegram_groups
+                picker = self._set_available_groups(user.id, telegram_groups)
             else:
                 await query.edit_message_text(
                     "Сессия устарела. Используйте /groups для обновления."
                 )
                 return
         
-        group_info = next((g for g in available_groups if g['id'] == group_id), None)
+        group_info = picker.by_id.get(group_id)
         
         if not group_info:
             await query.answer("Группа не найдена", show_alert=True)
             return
         
-        saved_groups = get_user_groups(driver.id, active_only=False)
-        existing = next((g for g in saved_groups if g.group_id == group_id), None)
+        await self._get_saved_groups_map(picker, driver.id)
         
-        if existing:
-            toggle_user_group(driver.id, group_id)
-        else:
-            add_user_group(
+        new_state = await _db(toggle_user_group, driver.id, group_id)
+        if new_state is None:
+            added = await _db(
+                add_user_group,
                 user_id=driver.id,
                 group_id=group_id,
                 group_title=group_info['title'],
                 group_username=group_info.get('username')
             )
+            new_state = True if added else None
         
-        saved_groups = get_user_groups(driver.id, active_only=False)
-        saved_groups_map = {g.group_id: g.is_active for g in saved_groups}
+        if new_state is None:
+            picker.saved_map = None
+            await self._get_saved_groups_map(picker, driver.id)
+        else:
+            picker.set_selected(group_id, new_state)
         
-        page = context.user_data.get('groups_page', 0)
-        keyboard = self._build_groups_keyboard(available_groups, saved_groups_map, page)
+        self._schedule_groups_edit(query, picker)
+    
+    def _schedule_groups_edit(self, query, picker: _GroupPicker):
+        key = (query.message.chat_id, query.message.message_id)
+        old_task = self._groups_edit_tasks.pop(key, None)
+        if old_task and not old_task.done():
+            old_task.cancel()
         
-        selected_count = sum(1 for g in available_groups if saved_groups_map.get(g['id'], False))
-        total_pages = (len(available_groups) + 9) // 10
+        task = asyncio.create_task(self._flush_groups_edit(query, picker))
+        self._groups_edit_tasks[key] = task
+        task.add_done_callback(lambda t: self._groups_edit_tasks.pop(key, None) if self._groups_edit_tasks.get(key) is t else None)
+    
+    async def _flush_groups_edit(self, query, picker: _GroupPicker):
+        await asyncio.sleep(GROUPS_EDIT_DEBOUNCE)
         
-        await query.edit_message_text(
-            f"Выберите группы для парсинга заказов:\n\n"
-            f"Найдено групп: {len(available_groups)}\n"
-            f"Выбрано: {selected_count}\n"
-            f"Страница: {page + 1}/{total_pages}\n\n"
-            f"Нажмите на группу чтобы выбрать/убрать",
-            reply_markup=keyboard
-        )
+        text, keyboard = self._render_group_choices(picker)
+        try:
+            await self._edit_if_changed(query, text, keyboard, parse_mode=None)
+        except Exception as e:
+            logger.warning(f"Failed to update groups picker: {e}")
+    
+    def _cancel_groups_edit(self, query):
+        task = self._groups_edit_tasks.pop((query.message.chat_id, query.message.message_id), None)
+        if task:
+            task.cancel()
     
     async def handle_groups_page(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         query = update.callback_query
         await query.answer()
+        self._cancel_groups_edit(query)
         
         user = update.effective_user
-        driver = get_user_by_telegram_id(user.id)
+        driver = await _get_driver_cached(user.id)
         
         if not driver:
             await query.edit_message_text("Ошибка. Используйте /start")
             return
         
-        page = int(query.data.split(":")[1])
-        context.user_data['groups_page'] = page
+        page = _callback_id(query)
+        if page is None:
+            return
         
-        available_groups = context.user_data.get('available_groups', [])
-        if not available_groups:
+        picker = self._group_pickers.get(user.id)
+        if not picker:
             await query.edit_message_text("Используйте /groups для обновления.")
             return
         
-        saved_groups = get_user_groups(driver.id, active_only=False)
-        saved_groups_map = {g.group_id: g.is_active for g in saved_groups}
+        picker.page = page
+        await self._get_saved_groups_map(picker, driver.id)
         
-        keyboard = self._build_groups_keyboard(available_groups, saved_groups_map, page)
-        
-        selected_count = sum(1 for g in available_groups if saved_groups_map.get(g['id'], False))
-        total_pages = (len(available_groups) + 9) // 10
-        
-        await query.edit_message_text(
-            f"Выберите группы для парсинга заказов:\n\n"
-            f"Найдено групп: {len(available_groups)}\n"
-            f"Выбрано: {selected_count}\n"
-            f"Страница: {page + 1}/{total_pages}\n\n"
-            f"Нажмите на группу чтобы выбрать/убрать",
-            reply_markup=keyboard
-        )
+        text, keyboard = self._render_group_choices(picker)
+        await query.edit_message_text(text, reply_markup=keyboard)
     
     async def handle_groups_done(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         query = update.callback_query
         await query.answer()
+        self._cancel_groups_edit(query)
         
         user = update.effective_user
-        driver = get_user_by_telegram_id(user.id)
+        driver = await _get_driver_cached(user.id)
         
         if not driver:
             await query.edit_message_text("Ошибка. Используйте /start")
             return
         
-        active_groups = get_user_groups(driver.id, active_only=True)
+        active_groups = await _db(get_user_groups, driver.id, active_only=True)
         
         if not active_groups:
             await query.edit_message_text(
@@ -2256,7 +2450,7 @@ class DriverBot:
             )
             return
         
-        context.user_data.pop('available_groups', None)
+        self._group_pickers.pop(user.id, None)
         context.user_data['selected_groups'] = [g.group_title for g in active_groups]
         context.user_data['selected_page'] = 0
         
@@ -2280,17 +2474,14 @@ class DriverBot:
         end = start + per_page
         page_groups = groups[start:end]
         
-        def make_group_link(g):
-            title = g.group_title if hasattr(g, 'group_title') else str(g)
-            if hasattr(g, 'group_username') and g.group_username:
-                return f'<a href="https://t.me/{g.group_username}">{title}</a>'
-            elif hasattr(g, 'group_id') and g.group_id:
-                chat_id = str(g.group_id).replace("-100", "")
-                return f'<a href="https://t.me/c/{chat_id}">{title}</a>'
-            else:
-                return title
-        
-        return "\n".join([f"• {make_group_link(g)}" for g in page_groups])
+        return _render_group_links(tuple(
+            (
+                g.group_title if hasattr(g, 'group_title') else str(g),
+                getattr(g, 'group_username', None),
+                getattr(g, 'group_id', None)
+            )
+            for g in page_groups
+        ))
     
     def _build_selected_keyboard(self, groups, page: int = 0) -> InlineKeyboardMarkup:
         keyboard = []
@@ -2314,15 +2505,17 @@ class DriverBot:
         await query.answer()
         
         user = update.effective_user
-        driver = get_user_by_telegram_id(user.id)
+        driver = await _get_driver_cached(user.id)
         
         if not driver:
             await query.edit_message_text("Ошибка. Используйте /start")
             return
         
-        page = int(query.data.split(":")[1])
+        page = _callback_id(query)
+        if page is None:
+            return
         
-        active_groups = get_user_groups(driver.id, active_only=True)
+        active_groups = await _db(get_user_groups, driver.id, active_only=True)
         if not active_groups:
             await query.edit_message_text("Нет выбранных групп.")
             return
@@ -2356,13 +2549,13 @@ class DriverBot:
     async def _start_groups_selection_callback(self, query, context: ContextTypes.DEFAULT_TYPE):
         """Общая логика запуска выбора групп через callback"""
         user = query.from_user
-        driver = get_user_by_telegram_id(user.id)
+        driver = await _get_driver_cached(user.id)
         
         if not driver:
             await query.edit_message_text("Ошибка. Используйте /start")
             return
         
-        user_session = get_user_session(driver.id)
+        user_session = await _db(get_user_session, driver.id)
         if not user_session or not user_session.is_authorized:
             await query.edit_message_text(
                 "Для выбора групп нужно подключить Telegram-аккаунт.\n\n"
@@ -2370,11 +2563,12 @@ class DriverBot:
             )
             return
         
-        await query.edit_message_text("Загружаю список ваших групп...")
-        
-        telegram_groups = await auth_manager.get_user_groups(driver.id)
+        _, picker = await asyncio.gather(
+            query.edit_message_text("Загружаю список ваших групп..."),
+            self._load_group_choices(user.id, driver.id)
+        )
         
-        if not telegram_groups:
+        if not picker:
             await query.edit_message_text(
                 "Не удалось получить список групп.\n"
                 "Возможно, сессия устарела.\n\n"
@@ -2382,30 +2576,13 @@ class DriverBot:
             )
             return
         
-        context.user_data['available_groups'] = telegram_groups
-        context.user_data['groups_page'] = 0
-        
-        saved_groups = get_user_groups(driver.id, active_only=False)
-        saved_groups_map = {g.group_id: g.is_active for g in saved_groups}
-        
-        keyboard = self._build_groups_keyboard(telegram_groups, saved_groups_map, page=0)
-        
-        selected_count = sum(1 for g in telegram_groups if saved_groups_map.get(g['id'], False))
-        total_pages = (len(telegram_groups) + 9) // 10
-        
-        await query.edit_message_text(
-            f"Выберите группы для парсинга заказов:\n\n"
-            f"Найдено групп: {len(telegram_groups)}\n"
-            f"Выбрано: {selected_count}\n"
-            f"Страница: 1/{total_pages}\n\n"
-            f"Нажмите на группу чтобы выбрать/убрать",
-            reply_markup=keyboard
-        )
+        text, keyboard = self._render_group_choices(picker)
+        await query.edit_message_text(text, reply_markup=keyboard)
     
     async def my_groups_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Показывает список выбранных групп с гиперссылками"""
         user = update.effective_user
-        driver = get_user_by_telegram_id(user.id)
+        driver = await _get_driver_cached(user.id)
         
         if not driver:
             await update.message.reply_text(
@@ -2413,7 +2590,7 @@ class DriverBot:
             )
             return
         
-        user_session = get_user_session(driver.id)
+        user_session = await _db(get_user_session, driver.id)
         if not user_session or not user_session.is_authorized:
             await update.message.reply_text(
                 "Для просмотра групп нужно подключить Telegram-аккаунт.\n\n"
@@ -2421,7 +2598,7 @@ class DriverBot:
             )
             return
         
-        active_groups = get_user_groups(driver.id, active_only=True)
+        active_groups = await _db(get_user_groups, driver.id, active_only=True)
         
         if not active_groups:
             keyboard = [[InlineKeyboardButton("Выбрать группы", callback_data="start_groups_selection")]]
@@ -2470,48 +2647,68 @@ class DriverBot:
         query = update.callback_query
         
         user = query.from_user
-        driver = get_user_by_telegram_id(user.id)
+        driver = await _get_driver_cached(user.id)
         
         if not driver:
             await query.answer("Вы не зарегистрированы", show_alert=True)
             return
         
-        user_session = get_user_session(driver.id)
+        user_session = await _db(get_user_session, driver.id)
         if not user_session or not user_session.is_authorized or not user_session.session_string:
             await query.answer("Подключите Telegram через /auth", show_alert=True)
             return
         
-        try:
-            parts = query.data.split(":")
-            group_id = int(parts[1])
-            message_id = int(parts[2])
-            reply_text = parts[3] if len(parts) > 3 else "я"
-        except (IndexError, ValueError):
+        match = ORDER_CALLBACK_RE.match(query.data or '')
+        if not match:
             await query.answer("Ошибка данных заказа", show_alert=True)
             return
+        group_id = int(match[1])
+        message_id = int(match[2])
+        reply_text = match[3] or "я"
         
-        await query.answer(f"Отправляю '{reply_text}' в группу...")
+        if query.data.startswith(f"{ORDER_CALLBACK_PREFIX}:") and reply_text[:1] == "#" and reply_text[1:].isdigit():
+            reply_text = await _db(get_quick_reply_text, int(reply_text[1:]), driver.id)
+            if not reply_text:
+                await query.answer("Эта кнопка быстрого ответа удалена", show_alert=True)
+                return
         
-        success, error_msg = await self._send_reply_via_telethon(
-            user_session.session_string, 
-            group_id, 
-            message_id, 
-            reply_text
-        )
+        preview = reply_text if len(reply_text) <= ORDER_ANSWER_PREVIEW_MAX else reply_text[:ORDER_ANSWER_PREVIEW_MAX] + "…"
         
-        if not success and "admin privileges" in error_msg.lower():
-            bot_message_id = query.message.message_id
-            notification = get_notification_by_message_id(driver.id, bot_message_id)
+        async with contextlib.AsyncExitStack() as stack:
+            # both awaited to completion, so the client is always released by the stack
+            answered, client = await asyncio.gather(
+                query.answer(f"Отправляю '{preview}' в группу..."),
+                stack.enter_async_context(auth_manager.user_client(driver.id)),
+                return_exceptions=True
+            )
+            if isinstance(answered, Exception):
+                logger.warning(f"Failed to answer take_order callback: {answered}")
+            if isinstance(client, Exception):
+                logger.error(f"Error getting user client: {client}")
+                client = None
             
-            if notification and notification.route_key:
-                group_links = get_order_group_links(notification.route_key, driver.id)
+            if not client:
+                success, error_msg = False, "Сессия устарела. Используйте /auth"
+            else:
+                success, error_msg = await self._send_reply_via_telethon(client, group_id, message_id, reply_text)
+            
+            if not success and "admin privileges" in error_msg.lower():
+                bot_message_id = query.message.message_id
+                notification = await _db(get_notification_by_message_id, driver.id, bot_message_id)
                 
-                for link in group_links:
-                    if link.group_id != group_id and link.message_id:
+                if notification and notification.route_key:
+                    group_links = await _db(get_order_group_links, notification.route_key, driver.id)
+                    candidates = [
+                        (link.group_id, link.message_id)
+                        for link in group_links
+                        if link.group_id != group_id and link.message_id
+                    ]
+                    
+                    for candidate_group_id, candidate_message_id in candidates:
                         success, error_msg = await self._send_reply_via_telethon(
-                            user_session.session_string,
-                            link.group_id,
-                            link.message_id,
+                            client,
+                            candidate_group_id,
+                            candidate_message_id,
                             reply_text
                         )
                         if success:
@@ -2524,7 +2721,7 @@ class DriverBot:
                 for row in keyboard.inline_keyboard:
                     new_row = []
                     for button in row:
-                        if not button.callback_data or not button.callback_data.startswith("take_order:"):
+                        if not button.callback_data or not ORDER_CALLBACK_RE.match(button.callback_data):
                             new_row.append(button)
                     if new_row:
                         new_keyboard.append(new_row)
@@ -2539,24 +2736,10 @@ class DriverBot:
         else:
             await query.message.reply_text(f"Не удалось отправить: {error_msg}")
     
-    async def _send_reply_via_telethon(self, session_string: str, group_id: int, message_id: int, text: str):
-        from telethon import TelegramClient
-        from telethon.sessions import StringSession
-        from src.config import TELEGRAM_API_ID, TELEGRAM_API_HASH
-        
-        client = None
+    async def _send_reply_via_telethon(self, client, group_id: int, message_id: int, text: str):
         try:
-            client = TelegramClient(
-                StringSession(session_string),
-                TELEGRAM_API_ID,
-                TELEGRAM_API_HASH
-            )
-            await client.connect()
-            
-            if not await client.is_user_authorized():
-                return False, "Сессия устарела. Используйте /auth"
-            
-            entity = await client.get_entity(group_id)
+            # served from the client's entity cache; the network is only hit for peers it has never seen
+            entity = await client.get_input_entity(group_id)
             
             await client.send_message(
                 entity,
@@ -2569,24 +2752,22 @@ class DriverBot:
         except Exception as e:
             logger.error(f"Telethon send error: {e}")
             return False, str(e)
-        finally:
-            if client:
-                await client.disconnect()
     
     async def handle_groups_refresh(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         query = update.callback_query
         await query.answer("Обновляю список...")
+        self._cancel_groups_edit(query)
         
         user = update.effective_user
-        driver = get_user_by_telegram_id(user.id)
+        driver = await _get_driver_cached(user.id)
         
         if not driver:
             await query.edit_message_text("Ошибка. Используйте /start")
             return
         
-        telegram_groups = await auth_manager.get_user_groups(driver.id)
+        picker = await self._load_group_choices(user.id, driver.id)
         
-        if not telegram_groups:
+        if not picker:
             await query.edit_message_text(
                 "Не удалось получить список групп.\n"
                 "Возможно, сессия устарела.\n\n"
@@ -2594,36 +2775,19 @@ class DriverBot:
             )
             return
         
-        context.user_data['available_groups'] = telegram_groups
-        context.user_data['groups_page'] = 0
-        
-        saved_groups = get_user_groups(driver.id, active_only=False)
-        saved_groups_map = {g.group_id: g.is_active for g in saved_groups}
-        
-        keyboard = self._build_groups_keyboard(telegram_groups, saved_groups_map, page=0)
-        
-        selected_count = sum(1 for g in telegram_groups if saved_groups_map.get(g['id'], False))
-        total_pages = (len(telegram_groups) + 9) // 10
-        
-        await query.edit_message_text(
-            f"Выберите группы для парсинга заказов:\n\n"
-            f"Найдено групп: {len(telegram_groups)}\n"
-            f"Выбрано: {selected_count}\n"
-            f"Страница: 1/{total_pages}\n\n"
-            f"Нажмите на группу чтобы выбрать/убрать",
-            reply_markup=keyboard
-        )
+        text, keyboard = self._render_group_choices(picker)
+        await query.edit_message_text(text, reply_markup=keyboard)
     
-    def _is_admin(self, telegram_id: int) -> bool:
+    async def _is_admin(self, telegram_id: int) -> bool:
         if ADMIN_TELEGRAM_ID and telegram_id == ADMIN_TELEGRAM_ID:
             return True
-        user = get_user_by_telegram_id(telegram_id)
+        user = await _get_driver_cached(telegram_id)
         return user and user.is_admin
     
     async def admin_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         user = update.effective_user
         
-        if not self._is_admin(user.id):
+        if not await self._is_admin(user.id):
             await update.message.reply_text("⛔ У вас нет доступа к этой команде.")
             return
         
@@ -2646,7 +2810,7 @@ class DriverBot:
         query = update.callback_query
         await query.answer()
         
-        if not self._is_admin(query.from_user.id):
+        if not await self._is_admin(query.from_user.id):
             await query.edit_message_text("⛔ У вас нет доступа.")
             return
         
@@ -2669,7 +2833,7 @@ class DriverBot:
         query = update.callback_query
         await query.answer()
         
-        if not self._is_admin(query.from_user.id):
+        if not await self._is_admin(query.from_user.id):
             await query.edit_message_text("У вас нет доступа.")
             return
         
@@ -2683,7 +2847,7 @@ class DriverBot:
         
         per_page = 10
         offset = page * per_page
-        users, total = get_all_users(limit=per_page, offset=offset)
+        users, total = await _db(get_all_users, limit=per_page, offset=offset)
         total_pages = (total + per_page - 1) // per_page
         
         keyboard = []
@@ -2726,7 +2890,7 @@ class DriverBot:
         query = update.callback_query
         await query.answer()
         
-        if not self._is_admin(query.from_user.id):
+        if not await self._is_admin(query.from_user.id):
             await query.edit_message_text("У вас нет доступа.")
             return
         
@@ -2741,25 +2905,23 @@ class DriverBot:
         
         action = parts[3] if len(parts) > 3 else "info"
         
-        user = get_user_by_id(user_id)
+        user = await _db(get_user_by_id, user_id)
         if not user:
             await query.edit_message_text("Пользователь не найден")
             return
         
         if action == "toggle_admin":
             new_admin_status = not user.is_admin
-            set_user_admin(user.telegram_id, new_admin_status)
-            user = get_user_by_id(user_id)
-        
-        user_groups = get_user_groups(user_id, active_only=False)
+            await _db(set_user_admin, user.telegram_id, new_admin_status)
+            invalidate(driver_cache, user.telegram_id)
+            _is_admin_cache.pop(user.telegram_id, None)
+            user = await _db(get_user_by_id, user_id)
         
         if action == "groups":
-            if not user_groups:
+            active_groups, inactive_groups = await _db(get_user_groups_partitioned, user_id)
+            if not active_groups and not inactive_groups:
                 text = f"У пользователя @{user.username or user.first_name} нет подключённых групп."
             else:
-                active_groups = [g for g in user_groups if g.is_active]
-                inactive_groups = [g for g in user_groups if not g.is_active]
-                
                 def make_group_link(g):
                     if g.group_username:
                         return f'<a href="https://t.me/{g.group_username}">{g.group_title}</a>'
@@ -2779,7 +2941,7 @@ class DriverBot:
                     for g in inactive_groups:
                         text += f"  • {make_group_link(g)}\n"
                 
-                text += f"\nВсего: {len(user_groups)}, активных: {len(active_groups)}"
+                text += f"\nВсего: {len(active_groups) + len(inactive_groups)}, активных: {len(active_groups)}"
             
             keyboard = [
                 [InlineKeyboardButton("« К профилю", callback_data=f"admin:user:{user_id}:info")],
@@ -2789,7 +2951,10 @@ class DriverBot:
             await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode='HTML', disable_web_page_preview=True)
             return
         
-        stats = get_user_stats(user_id)
+        (groups_total, groups_active), stats = await asyncio.gather(
+            _db(get_user_group_counts, user_id),
+            _db(get_user_stats, user_id)
+        )
         
         status_text = "🟢 Активен" if user.active else "🔴 Неактивен"
         auth_text = "🔑 Авторизован" if user.is_authorized else "❌ Не авторизован"
@@ -2797,10 +2962,7 @@ class DriverBot:
         
         location = user.city_name or (f"{user.latitude:.4f}, {user.longitude:.4f}" if user.latitude else "не указана")
         
-        groups_text = ""
-        if user_groups:
-            active_groups = [g for g in user_groups if g.is_active]
-            groups_text = f"\nГрупп подключено: {len(active_groups)}"
+        groups_text = f"\nГрупп подключено: {groups_active}" if groups_total else ""
         
         text = (
             f"Водитель: {user.first_name or 'без имени'}\n"
@@ -2825,7 +2987,7 @@ class DriverBot:
         admin_btn_text = "❌ Снять админа" if user.is_admin else "👑 Сделать админом"
         keyboard.append([InlineKeyboardButton(admin_btn_text, callback_data=f"admin:user:{user_id}:toggle_admin")])
         
-        if user_groups:
+        if groups_total:
             keyboard.append([InlineKeyboardButton("Группы пользователя", callback_data=f"admin:user:{user_id}:groups")])
         
         keyboard.append([InlineKeyboardButton("« К списку", callback_data="admin:users:page:0")])
@@ -2837,11 +2999,11 @@ class DriverBot:
         query = update.callback_query
         await query.answer()
         
-        if not self._is_admin(query.from_user.id):
+        if not await self._is_admin(query.from_user.id):
             await query.edit_message_text("У вас нет доступа.")
             return
         
-        stats = get_system_stats()
+        stats = await _db(get_system_stats)
         
         top_groups_text = ""
         if stats.get('top_groups'):
@@ -2877,7 +3039,7 @@ class DriverBot:
         query = update.callback_query
         await query.answer()
         
-        if not self._is_admin(query.from_user.id):
+        if not await self._is_admin(query.from_user.id):
             await query.edit_message_text("У вас нет доступа.")
             return
         
@@ -2889,14 +3051,9 @@ class DriverBot:
             except (ValueError, IndexError):
                 page = 0
         
-        all_groups = get_all_unique_groups()
-        
         per_page = 15
-        total = len(all_groups)
+        page_groups, total = await _db(get_unique_groups_page, per_page, page * per_page)
         total_pages = max(1, (total + per_page - 1) // per_page)
-        start = page * per_page
-        end = start + per_page
-        page_groups = all_groups[start:end]
         
         def make_group_link(group_id, group_title, group_username):
             if group_username:
@@ -2905,7 +3062,7 @@ class DriverBot:
                 chat_id = str(group_id).replace("-100", "")
                 return f'<a href="https://t.me/c/{chat_id}">{group_title}</a>'
         
-        if not all_groups:
+        if not total:
             text = "📢 <b>Группы</b>\n━━━━━━━━━━━━━━━━━━━━\n\n❌ Нет групп в системе."
         else:
             text = f"📢 <b>Все группы</b> ({total})\n━━━━━━━━━━━━━━━━━━━━\n📄 Страница {page+1}/{total_pages}\n\n"
@@ -2935,13 +3092,13 @@ class DriverBot:
         query = update.callback_query
         await query.answer("Синхронизация...")
         
-        if not self._is_admin(query.from_user.id):
+        if not await self._is_admin(query.from_user.id):
             await query.edit_message_text("У вас нет доступа.")
             return
         
-        user = get_user_by_telegram_id(query.from_user.id)
+        user = await _get_driver_cached(query.from_user.id)
         if user:
-            sync_all_groups_to_admin(user.id)
+            await _db(sync_all_groups_to_admin, user.id)
             await query.edit_message_text(
                 "✅ Все группы синхронизированы!\n\n"
                 "Теперь вы получаете заказы из всех групп, добавленных водителями.",
@@ -2957,11 +3114,11 @@ class DriverBot:
         query = update.callback_query
         await query.answer()
         
-        if not self._is_admin(query.from_user.id):
+        if not await self._is_admin(query.from_user.id):
             await query.edit_message_text("У вас нет доступа.")
             return
         
-        self.admin_search_mode[query.from_user.id] = True
+        self._set_input_mode(query.from_user.id, 'admin_search')
         
         await query.edit_message_text(
             "🔍 Поиск пользователей\n\n"
@@ -2976,8 +3133,7 @@ class DriverBot:
         await query.answer()
         
         user_id = query.from_user.id
-        if user_id in self.admin_search_mode:
-            del self.admin_search_mode[user_id]
+        self._clear_input_mode(user_id, 'admin_search')
         
         keyboard = [
             [InlineKeyboardButton("Водители", callback_data="admin:users:page:0")],
@@ -2992,7 +3148,7 @@ class DriverBot:
         )
     
     async def handle_admin_search_query(self, user_id: int, search_query: str, message):
-        users = search_users(search_query)
+        users = await _db(search_users, search_query)
         
         if not users:
             keyboard = [
@@ -3033,12 +3189,13 @@ class DriverBot:
             reply_markup=InlineKeyboardMarkup(keyboard)
         )
     
-    async def handle_admin_service_groups(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+    async def handle_admin_service_groups(self, update: Update, context: ContextTypes.DEFAULT_TYPE, answered: bool = False):
         """Handle service groups (our groups) list"""
         query = update.callback_query
-        await query.answer()
+        if not answered:
+            await query.answer()
         
-        if not self._is_admin(query.from_user.id):
+        if not await self._is_admin(query.from_user.id):
             await query.edit_message_text("⛔ У вас нет доступа.")
             return
         
@@ -3052,7 +3209,7 @@ class DriverBot:
         
         per_page = 10
         offset = page * per_page
-        groups, total = get_service_groups(active_only=False, limit=per_page, offset=offset)
+        groups, total = await _db(get_service_groups, active_only=False, limit=per_page, offset=offset)
         total_pages = max(1, (total + per_page - 1) // per_page)
         
         def make_group_link(group):
@@ -3116,59 +3273,55 @@ class DriverBot:
         """Toggle service group active status"""
         query = update.callback_query
         
-        if not self._is_admin(query.from_user.id):
+        if not await self._is_admin(query.from_user.id):
             await query.answer("⛔ У вас нет доступа.")
             return
         
-        try:
-            group_id = int(query.data.split(":")[2])
-        except (ValueError, IndexError):
+        group_id = _callback_id(query)
+        if group_id is None:
             await query.answer("Ошибка")
             return
         
-        result = toggle_service_group(group_id)
+        result = await _db(toggle_service_group, group_id)
         if result:
             status = "активирована" if result.is_active else "деактивирована"
             await query.answer(f"Группа {status}")
         else:
             await query.answer("Ошибка при изменении статуса")
         
-        query.data = "admin:service_groups:page:0"
-        await self.handle_admin_service_groups(update, context)
+        await self.handle_admin_service_groups(update, context, answered=True)
     
     async def handle_admin_service_group_remove(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Remove group from service groups"""
         query = update.callback_query
         
-        if not self._is_admin(query.from_user.id):
+        if not await self._is_admin(query.from_user.id):
             await query.answer("⛔ У вас нет доступа.")
             return
         
-        try:
-            group_id = int(query.data.split(":")[2])
-        except (ValueError, IndexError):
+        group_id = _callback_id(query)
+        if group_id is None:
             await query.answer("Ошибка")
             return
         
-        if remove_service_group(group_id):
+        if await _db(remove_service_group, group_id):
             await query.answer("✅ Группа удалена из списка")
         else:
             await query.answer("Ошибка при удалении")
         
-        query.data = "admin:service_groups:page:0"
-        await self.handle_admin_service_groups(update, context)
+        await self.handle_admin_service_groups(update, context, answered=True)
     
     async def handle_admin_service_group_add(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Show list of available groups to add"""
         query = update.callback_query
         await query.answer()
         
-        if not self._is_admin(query.from_user.id):
+        if not await self._is_admin(query.from_user.id):
             await query.edit_message_text("⛔ У вас нет доступа.")
             return
         
-        all_groups = get_all_unique_groups()
-        service_groups, _ = get_service_groups(active_only=False)
+        all_groups = await _db(get_all_unique_groups)
+        service_groups, _ = await _db(get_service_groups, active_only=False)
         service_group_ids = {g.group_id for g in service_groups}
         
         available_groups = [g for g in all_groups if g.group_id not in service_group_ids]
@@ -3213,24 +3366,23 @@ class DriverBot:
         """Confirm adding group to service groups"""
         query = update.callback_query
         
-        if not self._is_admin(query.from_user.id):
+        if not await self._is_admin(query.from_user.id):
             await query.answer("⛔ У вас нет доступа.")
             return
         
-        try:
-            group_id = int(query.data.split(":")[2])
-        except (ValueError, IndexError):
+        group_id = _callback_id(query)
+        if group_id is None:
             await query.answer("Ошибка")
             return
         
-        all_groups = get_all_unique_groups()
+        all_groups = await _db(get_all_unique_groups)
         group_info = next((g for g in all_groups if g.group_id == group_id), None)
         
         if not group_info:
             await query.answer("Группа не найдена")
             return
         
-        result = add_service_group(
+        result = await _db(add_service_group,
             group_id=group_id,
             group_title=group_info.group_title,
             group_username=group_info.group_username
@@ -3241,19 +3393,18 @@ class DriverBot:
         else:
             await query.answer("Ошибка при добавлении")
         
-        query.data = "admin:service_groups:page:0"
-        await self.handle_admin_service_groups(update, context)
+        await self.handle_admin_service_groups(update, context, answered=True)
     
     async def handle_admin_service_group_search(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Start group search mode"""
         query = update.callback_query
         await query.answer()
         
-        if not self._is_admin(query.from_user.id):
+        if not await self._is_admin(query.from_user.id):
             await query.edit_message_text("⛔ У вас нет доступа.")
             return
         
-        self.admin_group_search_mode[query.from_user.id] = True
+        self._set_input_mode(query.from_user.id, 'admin_group_search')
         
         await query.edit_message_text(
             "🔍 <b>Поиск группы</b>\n"
@@ -3267,8 +3418,8 @@ class DriverBot:
     
     async def handle_admin_group_search_query(self, user_id: int, search_query: str, message):
         """Handle group search query"""
-        all_groups = search_all_groups(search_query)
-        service_groups, _ = get_service_groups(active_only=False)
+        all_groups = await _db(search_all_groups, search_query)
+        service_groups, _ = await _db(get_service_groups, active_only=False)
         service_group_ids = {g.group_id for g in service_groups}
         
         if not all_groups:
@@ -3312,13 +3463,41 @@ class DriverBot:
         )
     
     def _location_keyboard(self) -> ReplyKeyboardMarkup:
-        return ReplyKeyboardMarkup(
-            [[KeyboardButton("Отправить геолокацию", request_location=True)]],
-            resize_keyboard=True,
-            one_time_keyboard=True
-        )
+        return self._loc_kb
     
     def _main_menu_keyboard(self, is_admin: bool = False) -> ReplyKeyboardMarkup:
+        return self._menu_kb_admin if is_admin else self._menu_kb_user
+    
+    @staticmethod
+    def _build_profile_keyboard(has_license: bool, has_sts: bool, has_child_seat: bool) -> InlineKeyboardMarkup:
+        license_status = "✅ Загружено" if has_license else "❌ Нет"
+        sts_status = "✅ Загружено" if has_sts else "❌ Нет"
+        child_seat = "Да" if has_child_seat else "Нет"
+        return StaticInlineKeyboardMarkup([
+            [InlineKeyboardButton("✏️ ФИО", callback_data="settings:profile_name")],
+            [InlineKeyboardButton("🚗 Авто", callback_data="settings:profile_car")],
+            [InlineKeyboardButton(f"🪪 Права: {license_status}", callback_data="settings:profile_license")],
+            [InlineKeyboardButton(f"📄 СТС: {sts_status}", callback_data="settings:profile_sts")],
+            [InlineKeyboardButton(f"👶 Детское кресло: {child_seat}", callback_data="settings:profile_child_seat")],
+            [InlineKeyboardButton("« Назад", callback_data="settings:main")]
+        ])
+    
+    @staticmethod
+    def _build_hour_keyboards(hours, callback_prefix: str) -> dict:
+        """One keyboard per selectable hour with that hour ticked, plus an unticked one under None"""
+        keyboards = {}
+        for current in (*hours, None):
+            buttons = [
+                InlineKeyboardButton(f"{'✓ ' if hour == current else ''}{hour}", callback_data=f"{callback_prefix}:{hour}")
+                for hour in hours
+            ]
+            keyboard = [buttons[i:i + 3] for i in range(0, len(buttons), 3)]
+            keyboard.append([InlineKeyboardButton("« Назад", callback_data="settings:quiet_hours")])
+            keyboards[current] = StaticInlineKeyboardMarkup(keyboard)
+        return keyboards
+    
+    @staticmethod
+    def _build_main_menu_keyboard(is_admin: bool) -> ReplyKeyboardMarkup:
         rows = [
             [KeyboardButton(MENU_STATUS), KeyboardButton(MENU_GROUPS)],
             [KeyboardButton(MENU_AUTH), KeyboardButton(MENU_LOCATION)],
@@ -3329,41 +3508,41 @@ class DriverBot:
             rows.append([KeyboardButton(MENU_ADMIN)])
         return ReplyKeyboardMarkup(rows, resize_keyboard=True, one_time_keyboard=False)
     
-    def _get_menu_for_user(self, telegram_id: int) -> ReplyKeyboardMarkup:
-        driver = get_user_by_telegram_id(telegram_id)
-        is_admin = driver.is_admin if driver else False
+    async def _get_menu_for_user(self, telegram_id: int) -> ReplyKeyboardMarkup:
+        is_admin = _is_admin_cache.get(telegram_id)
+        if is_admin is None:
+            driver = await _get_driver_cached(telegram_id)
+            is_admin = bool(driver and driver.is_admin)
+            _is_admin_cache[telegram_id] = is_admin
         return self._main_menu_keyboard(is_admin)
     
-    def _build_order_keyboard(self, order_link: str, group_id: int = None, message_id: int = None, driver_db_id: int = None):
+    async def _build_order_keyboard(self, order_link: str, group_id: int = None, message_id: int = None, driver_db_id: int = None):
         """Build keyboard for order notification with custom quick replies"""
         keyboard = []
         
         if group_id and message_id:
             quick_replies = []
             if driver_db_id:
-                quick_replies = get_quick_replies(driver_db_id, active_only=True)
+                quick_replies = await _db(get_quick_replies, driver_db_id, active_only=True)
             
             if quick_replies:
-                row = []
-                for qr in quick_replies[:4]:
-                    row.append(InlineKeyboardButton(
+                buttons = [
+                    InlineKeyboardButton(
                         qr.button_text,
-                        callback_data=f"take_order:{group_id}:{message_id}:{qr.reply_text}"
-                    ))
-                    if len(row) == 2:
-                        keyboard.append(row)
-                        row = []
-                if row:
-                    keyboard.append(row)
+                        callback_data=f"{ORDER_CALLBACK_PREFIX}:{group_id}:{message_id}:#{qr.id}"
+                    )
+                    for qr in quick_replies[:4]
+                ]
+                keyboard.extend(buttons[i:i + 2] for i in range(0, len(buttons), 2))
             else:
                 keyboard.append([
                     InlineKeyboardButton(
                         "Взять себе", 
-                        callback_data=f"take_order:{group_id}:{message_id}:я"
+                        callback_data=f"{ORDER_CALLBACK_PREFIX}:{group_id}:{message_id}:я"
                     ),
                     InlineKeyboardButton(
                         "Не себе", 
-                        callback_data=f"take_order:{group_id}:{message_id}:не себе"
+                        callback_data=f"{ORDER_CALLBACK_PREFIX}:{group_id}:{message_id}:не себе"
                     )
                 ])
         
@@ -3378,9 +3557,9 @@ class DriverBot:
                                        group_id: int = None, message_id: int = None) -> int:
         """Send order notification and return sent message_id"""
         try:
-            driver = get_user_by_telegram_id(driver_id)
+            driver = await _get_driver_cached(driver_id)
             driver_db_id = driver.id if driver else None
-            reply_markup = self._build_order_keyboard(order_link, group_id, message_id, driver_db_id)
+            reply_markup = await self._build_order_keyboard(order_link, group_id, message_id, driver_db_id)
             
             sent_message = await self.application.bot.send_message(
                 chat_id=driver_id,
@@ -3399,9 +3578,9 @@ class DriverBot:
                                        order_link: str, group_id: int = None, source_message_id: int = None):
         """Edit existing order notification with updated groups list"""
         try:
-            driver = get_user_by_telegram_id(driver_id)
+            driver = await _get_driver_cached(driver_id)
             driver_db_id = driver.id if driver else None
-            reply_markup = self._build_order_keyboard(order_link, group_id, source_message_id, driver_db_id)
+            reply_markup = await self._build_order_keyboard(order_link, group_id, source_message_id, driver_db_id)
             
             await self.application.bot.edit_message_text(
                 chat_id=driver_id,
@@ -3419,17 +3598,42 @@ class DriverBot:
     
     def run(self):
         logger.info("Starting driver bot...")
-        self.application.run_polling(allowed_updates=Update.ALL_TYPES)
+        if WEBHOOK_URL:
+            self.application.run_webhook(
+                listen="0.0.0.0",
+                port=WEBHOOK_PORT,
+                url_path=BOT_TOKEN,
+                webhook_url=f"{WEBHOOK_URL.rstrip('/')}/{BOT_TOKEN}",
+                allowed_updates=Update.ALL_TYPES
+            )
+        else:
+            self.application.run_polling(allowed_updates=Update.ALL_TYPES)
     
     async def _clear_commands_menu(self):
         await self.application.bot.delete_my_commands()
         logger.info("Bot commands menu cleared")
     
+    async def _sweep_state_caches(self):
+        while True:
+            await asyncio.sleep(STATE_SWEEP_INTERVAL)
+            for cache in self._state_caches:
+                cache.expire()
+    
     async def start_async(self):
         await self.application.initialize()
         await self.application.start()
         await self._clear_commands_menu()
-        await self.application.updater.start_polling(allowed_updates=Update.ALL_TYPES)
+        if WEBHOOK_URL:
+            await self.application.updater.start_webhook(
+                listen="0.0.0.0",
+                port=WEBHOOK_PORT,
+                url_path=BOT_TOKEN,
+                webhook_url=f"{WEBHOOK_URL.rstrip('/')}/{BOT_TOKEN}",
+                allowed_updates=Update.ALL_TYPES
+            )
+        else:
+            await self.application.updater.start_polling(allowed_updates=Update.ALL_TYPES)
+        self._state_sweep_task = asyncio.create_task(self._sweep_state_caches())
         logger.info("Driver bot started in async mode")
     
     async def start_without_polling(self):
@@ -3438,6 +3642,14 @@ class DriverBot:
         logger.info("Driver bot initialized without polling (parser only mode)")
     
     async def stop_async(self):
+        if self._state_sweep_task:
+            self._state_sweep_task.cancel()
+        for task in self._qr_tasks.values():
+            task.cancel()
+        self._qr_tasks.clear()
+        for task in self._groups_edit_tasks.values():
+            task.cancel()
+        self._groups_edit_tasks.clear()
         if self.application.updater and self.application.updater.running:
             await self.application.updater.stop()
         await self.application.stop()
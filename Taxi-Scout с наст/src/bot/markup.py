@@ -0,0 +1,17 @@
+from telegram import InlineKeyboardMarkup
+
+
+class StaticInlineKeyboardMarkup(InlineKeyboardMarkup):
+    """Inline keyboard that never changes after creation, serialized to a dict only once"""
+    
+    __slots__ = ('_cached',)
+    
+    def to_dict(self, recursive: bool = True) -> dict:
+        if not recursive:
+            return super().to_dict(recursive=False)
+        data = getattr(self, '_cached', None)
+        if data is None:
+            data = super().to_dict()
+            # the instance is frozen after __init__, so bypass TelegramObject.__setattr__
+            object.__setattr__(self, '_cached', data)
+        return data
@@ -7,6 +7,8 @@ TELEGRAM_API_ID = os.getenv('TELEGRAM_API_ID')
 TELEGRAM_API_HASH = os.getenv('TELEGRAM_API_HASH')
 TELEGRAM_PHONE = os.getenv('TELEGRAM_PHONE')
 BOT_TOKEN = os.getenv('BOT_TOKEN')
+WEBHOOK_URL = os.getenv('WEBHOOK_URL')
+WEBHOOK_PORT = int(os.getenv('PORT', '8443'))
 TARGET_GROUP_ID = os.getenv('TARGET_GROUP_ID')
 SOURCE_GROUPS = os.getenv('SOURCE_GROUPS', '').split(',') if os.getenv('SOURCE_GROUPS') else []
 
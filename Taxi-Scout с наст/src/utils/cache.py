@@ -0,0 +1,33 @@
+import threading
+from cachetools import TTLCache
+
+DRIVER_CACHE_TTL = 30
+DRIVER_CACHE_MAXSIZE = 50000
+
+SETTINGS_CACHE_TTL = 30
+SETTINGS_CACHE_MAXSIZE = 10000
+
+COUNT_CACHE_TTL = 60
+LIST_CACHE_TTL = 300
+USER_GROUPS_CACHE_TTL = 30
+
+USER_EXISTS_TTL = 60
+
+# DB getters run both on the event loop and in asyncio.to_thread workers
+cache_lock = threading.RLock()
+
+driver_cache = TTLCache(maxsize=DRIVER_CACHE_MAXSIZE, ttl=DRIVER_CACHE_TTL)
+settings_cache = TTLCache(maxsize=SETTINGS_CACHE_MAXSIZE, ttl=SETTINGS_CACHE_TTL)
+profile_cache = TTLCache(maxsize=SETTINGS_CACHE_MAXSIZE, ttl=SETTINGS_CACHE_TTL)
+favorite_count_cache = TTLCache(maxsize=SETTINGS_CACHE_MAXSIZE, ttl=COUNT_CACHE_TTL)
+blacklist_count_cache = TTLCache(maxsize=SETTINGS_CACHE_MAXSIZE, ttl=COUNT_CACHE_TTL)
+favorite_routes_cache = TTLCache(maxsize=SETTINGS_CACHE_MAXSIZE, ttl=LIST_CACHE_TTL)
+blacklist_cache = TTLCache(maxsize=SETTINGS_CACHE_MAXSIZE, ttl=LIST_CACHE_TTL)
+user_groups_cache = TTLCache(maxsize=SETTINGS_CACHE_MAXSIZE * 2, ttl=USER_GROUPS_CACHE_TTL)
+unique_groups_count_cache = TTLCache(maxsize=1, ttl=COUNT_CACHE_TTL)
+user_exists_cache = TTLCache(maxsize=DRIVER_CACHE_MAXSIZE, ttl=USER_EXISTS_TTL)
+
+
+def invalidate(cache: TTLCache, key):
+    with cache_lock:
+        cache.pop(key, None)
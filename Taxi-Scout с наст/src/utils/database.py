@@ -1,15 +1,45 @@
 import os
 import logging
+import time
+import functools
 from datetime import datetime
-from sqlalchemy import create_engine, Column, Integer, BigInteger, String, Float, Boolean, Text, DateTime, ForeignKey, LargeBinary
+from zoneinfo import ZoneInfo
+from sqlalchemy import create_engine, update, func, Index, Column, Integer, BigInteger, String, Float, Boolean, Text, DateTime, ForeignKey, LargeBinary
 from sqlalchemy.orm import declarative_base, sessionmaker, relationship
 from sqlalchemy.pool import QueuePool
+from cachetools import cached
+
+from src.utils.cache import (
+    settings_cache, profile_cache, favorite_count_cache, blacklist_count_cache, favorite_routes_cache, blacklist_cache,
+    user_exists_cache, user_groups_cache, unique_groups_count_cache, cache_lock, invalidate
+)
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 DATABASE_URL = os.environ.get('DATABASE_URL')
 
+
+class _DbUnavailable(Exception):
+    """Raised inside cached readers instead of returning a fallback, so the fallback is never cached"""
+
+
+def _cached_read(cache, key, fallback):
+    """cachetools.cached that stores only successful reads and returns fallback() on _DbUnavailable"""
+    def decorator(fn):
+        cached_fn = cached(cache, key=key, lock=cache_lock)(fn)
+        
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            try:
+                return cached_fn(*args, **kwargs)
+            except _DbUnavailable:
+                return fallback()
+        return wrapper
+    return decorator
+
+MSK = ZoneInfo('Europe/Moscow')
+
 if DATABASE_URL:
     engine = create_engine(
         DATABASE_URL,
@@ -80,6 +110,21 @@ class UserGroup(Base):
     user = relationship("User", back_populates="groups")
 
 
+# per-user group lists: WHERE user_id = ? [AND is_active] ORDER BY [is_active DESC,] group_title
+Index(
+    'idx_user_groups_active',
+    UserGroup.user_id, UserGroup.is_active.desc(), UserGroup.group_title,
+    postgresql_include=['group_id', 'group_username']
+)
+# admin unique-group listing: active rows grouped by group_id
+Index(
+    'idx_user_groups_active_group',
+    UserGroup.group_id,
+    postgresql_where=UserGroup.is_active == True,
+    postgresql_include=['user_id', 'group_title', 'group_username']
+)
+
+
 class Subscription(Base):
     __tablename__ = 'subscriptions'
     
@@ -284,6 +329,9 @@ class OrderReminder(Base):
 def init_db():
     if engine:
         Base.metadata.create_all(engine)
+        # create_all skips indexes of tables that already exist
+        for index in UserGroup.__table__.indexes:
+            index.create(engine, checkfirst=True)
         logger.info("Database tables created successfully")
     else:
         logger.error("Cannot init database: no engine")
@@ -296,7 +344,48 @@ def get_session():
     return None
 
 
+# telegram_ids of all registered users, loaded once; lets lookups for strangers skip the database
+_registered_telegram_ids = None
+# monotonic time of the last failed load; retries wait REGISTERED_IDS_RETRY_INTERVAL instead of rescanning per lookup
+_registered_ids_failed_at = None
+REGISTERED_IDS_RETRY_INTERVAL = 60
+
+
+def load_registered_telegram_ids():
+    global _registered_telegram_ids, _registered_ids_failed_at
+    session = get_session()
+    if not session:
+        _registered_ids_failed_at = time.monotonic()
+        return
+    try:
+        ids = {row[0] for row in session.query(User.telegram_id)}
+        with cache_lock:
+            if _registered_telegram_ids is None:
+                _registered_telegram_ids = ids
+        _registered_ids_failed_at = None
+        logger.info(f"Loaded {len(ids)} registered telegram ids")
+    except Exception as e:
+        _registered_ids_failed_at = time.monotonic()
+        logger.error(f"Error loading registered telegram ids: {e}")
+    finally:
+        session.close()
+
+
+def is_registered_telegram_id(telegram_id: int) -> bool:
+    """False only when the user is certainly unknown; True if the id set could not be loaded"""
+    if _registered_telegram_ids is None:
+        if (_registered_ids_failed_at is not None
+                and time.monotonic() - _registered_ids_failed_at < REGISTERED_IDS_RETRY_INTERVAL):
+            return True
+        load_registered_telegram_ids()
+        if _registered_telegram_ids is None:
+            return True
+    return telegram_id in _registered_telegram_ids
+
+
 def get_user_by_telegram_id(telegram_id: int):
+    if not is_registered_telegram_id(telegram_id):
+        return None
     session = get_session()
     if not session:
         return None
@@ -307,6 +396,19 @@ def get_user_by_telegram_id(telegram_id: int):
         session.close()
 
 
+@_cached_read(user_exists_cache, key=lambda telegram_id: telegram_id, fallback=lambda: False)
+def user_exists(telegram_id: int) -> bool:
+    if not is_registered_telegram_id(telegram_id):
+        return False
+    session = get_session()
+    if not session:
+        raise _DbUnavailable()
+    try:
+        return session.query(User.id).filter(User.telegram_id == telegram_id).scalar() is not None
+    finally:
+        session.close()
+
+
 def create_or_update_user(telegram_id: int, **kwargs):
     session = get_session()
     if not session:
@@ -323,6 +425,9 @@ def create_or_update_user(telegram_id: int, **kwargs):
             session.add(user)
         session.commit()
         session.refresh(user)
+        if _registered_telegram_ids is not None:
+            _registered_telegram_ids.add(telegram_id)
+        invalidate(user_exists_cache, telegram_id)
         return user
     except Exception as e:
         session.rollback()
@@ -384,6 +489,26 @@ def get_user_session(user_id: int):
         session.close()
 
 
+def get_status_bundle(telegram_id: int):
+    session = get_session()
+    if not session:
+        return None
+    try:
+        groups_count = session.query(func.count(UserGroup.id)).filter(
+            UserGroup.user_id == User.id,
+            UserGroup.is_active == True
+        ).scalar_subquery()
+        row = session.query(User, UserSession.is_authorized, groups_count).outerjoin(
+            UserSession, UserSession.user_id == User.id
+        ).filter(User.telegram_id == telegram_id).first()
+        if not row:
+            return None
+        user, is_authorized, count = row
+        return user, bool(is_authorized), count or 0
+    finally:
+        session.close()
+
+
 def delete_user_session(user_id: int) -> bool:
     session = get_session()
     if not session:
@@ -431,6 +556,7 @@ def add_user_group(user_id: int, group_id: int, group_title: str, group_username
             session.add(user_group)
             is_new_group = True
         session.commit()
+        _invalidate_user_groups(user_id)
         
         if sync_to_admins and is_new_group:
             sync_group_to_admins(group_id, group_title, group_username)
@@ -444,15 +570,55 @@ def add_user_group(user_id: int, group_id: int, group_title: str, group_username
         session.close()
 
 
+_UNIQUE_GROUPS_COUNT_KEY = 'total'
+
+
+def _invalidate_user_groups(user_id: int):
+    invalidate(user_groups_cache, (user_id, True))
+    invalidate(user_groups_cache, (user_id, False))
+    invalidate(unique_groups_count_cache, _UNIQUE_GROUPS_COUNT_KEY)
+
+
+@_cached_read(user_groups_cache, key=lambda user_id, active_only=True: (user_id, active_only), fallback=list)
 def get_user_groups(user_id: int, active_only: bool = True):
     session = get_session()
     if not session:
-        return []
+        raise _DbUnavailable()
     try:
         query = session.query(UserGroup).filter(UserGroup.user_id == user_id)
         if active_only:
             query = query.filter(UserGroup.is_active == True)
-        return query.all()
+        return query.order_by(UserGroup.group_title).all()
+    finally:
+        session.close()
+
+
+def get_user_groups_partitioned(user_id: int):
+    """(active, inactive) groups of the user, each sorted by title"""
+    session = get_session()
+    if not session:
+        return [], []
+    try:
+        groups = session.query(UserGroup).filter(
+            UserGroup.user_id == user_id
+        ).order_by(UserGroup.is_active.desc(), UserGroup.group_title).all()
+        split = next((i for i, g in enumerate(groups) if not g.is_active), len(groups))
+        return groups[:split], groups[split:]
+    finally:
+        session.close()
+
+
+def get_user_group_counts(user_id: int):
+    """(total, active) number of the user's groups"""
+    session = get_session()
+    if not session:
+        return 0, 0
+    try:
+        total, active = session.query(
+            func.count(UserGroup.id),
+            func.count(UserGroup.id).filter(UserGroup.is_active == True)
+        ).filter(UserGroup.user_id == user_id).one()
+        return total or 0, active or 0
     finally:
         session.close()
 
@@ -469,6 +635,7 @@ def toggle_user_group(user_id: int, group_id: int):
         if user_group:
             user_group.is_active = not user_group.is_active
             session.commit()
+            _invalidate_user_groups(user_id)
             return user_group.is_active
         return None
     except Exception as e:
@@ -589,32 +756,62 @@ def get_all_active_groups():
         session.close()
 
 
+def _unique_groups_query(session):
+    from sqlalchemy import case
+    
+    return session.query(
+        UserGroup.group_id,
+        func.max(UserGroup.group_title).label('group_title'),
+        func.max(UserGroup.group_username).label('group_username'),
+        func.count(UserGroup.user_id.distinct()).label('user_count'),
+        func.sum(case((User.is_admin == True, 1), else_=0)).label('admin_count'),
+        func.sum(case((User.is_admin == False, 1), else_=0)).label('driver_count')
+    ).join(
+        User, UserGroup.user_id == User.id
+    ).filter(
+        UserGroup.is_active == True
+    ).group_by(UserGroup.group_id)
+
+
 def get_all_unique_groups():
     """Get all unique groups from all user sessions with driver/admin counts"""
     session = get_session()
     if not session:
         return []
     try:
-        from sqlalchemy import func, case
-        
-        groups = session.query(
-            UserGroup.group_id,
-            func.max(UserGroup.group_title).label('group_title'),
-            func.max(UserGroup.group_username).label('group_username'),
-            func.count(UserGroup.user_id.distinct()).label('user_count'),
-            func.sum(case((User.is_admin == True, 1), else_=0)).label('admin_count'),
-            func.sum(case((User.is_admin == False, 1), else_=0)).label('driver_count')
-        ).join(
-            User, UserGroup.user_id == User.id
-        ).filter(
+        return _unique_groups_query(session).order_by(func.max(UserGroup.group_title)).all()
+    finally:
+        session.close()
+
+
+@_cached_read(unique_groups_count_cache, key=lambda: _UNIQUE_GROUPS_COUNT_KEY, fallback=lambda: 0)
+def count_unique_groups() -> int:
+    session = get_session()
+    if not session:
+        raise _DbUnavailable()
+    try:
+        return session.query(func.count(UserGroup.group_id.distinct())).filter(
             UserGroup.is_active == True
-        ).group_by(UserGroup.group_id).order_by(func.max(UserGroup.group_title)).all()
-        
-        return groups
+        ).scalar() or 0
     finally:
         session.close()
 
 
+def get_unique_groups_page(limit: int, offset: int = 0):
+    """One page of unique groups (same rows as get_all_unique_groups) and the total count"""
+    session = get_session()
+    if not session:
+        return [], 0
+    try:
+        groups = _unique_groups_query(session).order_by(
+            func.max(UserGroup.group_title), UserGroup.group_id
+        ).offset(offset).limit(limit).all()
+    finally:
+        session.close()
+    # the count is cached, so never report fewer groups than this page proves exist
+    return groups, max(count_unique_groups(), offset + len(groups))
+
+
 def sync_group_to_admins(group_id: int, group_title: str, group_username: str = None):
     """Add group to all admin users automatically"""
     session = get_session()
@@ -622,6 +819,7 @@ def sync_group_to_admins(group_id: int, group_title: str, group_username: str =
         return False
     try:
         admins = session.query(User).filter(User.is_admin == True).all()
+        added_to = []
         
         for admin in admins:
             existing = session.query(UserGroup).filter(
@@ -638,9 +836,12 @@ def sync_group_to_admins(group_id: int, group_title: str, group_username: str =
                     is_active=True
                 )
                 session.add(user_group)
+                added_to.append(admin.id)
                 logger.info(f"Added group {group_title} to admin {admin.telegram_id}")
         
         session.commit()
+        for admin_id in added_to:
+            _invalidate_user_groups(admin_id)
         return True
     except Exception as e:
         session.rollback()
@@ -679,6 +880,7 @@ def sync_all_groups_to_admin(admin_user_id: int):
                 session.add(user_group)
         
         session.commit()
+        _invalidate_user_groups(admin_user_id)
         logger.info(f"Synced {len(all_groups)} groups to admin user {admin_user_id}")
         return True
     except Exception as e:
@@ -1183,11 +1385,12 @@ def search_all_groups(query: str):
         session.close()
 
 
+@_cached_read(settings_cache, key=lambda user_id: user_id, fallback=lambda: None)
 def get_driver_settings(user_id: int):
-    """Get driver settings or create default"""
+    """Get driver settings or create default (cached per user for SETTINGS_CACHE_TTL)"""
     session = get_session()
     if not session:
-        return None
+        raise _DbUnavailable()
     try:
         settings = session.query(DriverSettings).filter(DriverSettings.user_id == user_id).first()
         if not settings:
@@ -1199,7 +1402,37 @@ def get_driver_settings(user_id: int):
     except Exception as e:
         session.rollback()
         logger.error(f"Error getting driver settings: {e}")
-        return None
+        raise _DbUnavailable() from e
+    finally:
+        session.close()
+
+
+def get_user_with_settings(telegram_id: int):
+    """Get (user, settings) in one query, creating default settings if missing"""
+    if not is_registered_telegram_id(telegram_id):
+        return None, None
+    session = get_session()
+    if not session:
+        return None, None
+    try:
+        row = session.query(User, DriverSettings).outerjoin(
+            DriverSettings, DriverSettings.user_id == User.id
+        ).filter(User.telegram_id == telegram_id).first()
+        if not row:
+            return None, None
+        user, settings = row
+        if not settings:
+            settings = DriverSettings(user_id=user.id)
+            session.add(settings)
+            session.commit()
+            session.refresh(settings)
+        with cache_lock:
+            settings_cache[user.id] = settings
+        return user, settings
+    except Exception as e:
+        session.rollback()
+        logger.error(f"Error getting user with settings: {e}")
+        return None, None
     finally:
         session.close()
 
@@ -1221,6 +1454,8 @@ def update_driver_settings(user_id: int, **kwargs):
             settings.updated_at = datetime.utcnow()
         session.commit()
         session.refresh(settings)
+        with cache_lock:
+            settings_cache[user_id] = settings
         return settings
     except Exception as e:
         session.rollback()
@@ -1240,10 +1475,7 @@ def is_user_in_quiet_hours(user_id: int) -> bool:
         if not settings or not settings.quiet_hours_enabled:
             return False
         
-        from datetime import datetime as dt
-        import pytz
-        
-        now = dt.now(pytz.timezone('Europe/Moscow'))
+        now = datetime.now(MSK)
         current_time = now.strftime('%H:%M')
         
         start = settings.quiet_hours_start
@@ -1272,6 +1504,7 @@ def is_user_busy(user_id: int) -> bool:
         else:
             settings.busy_until = None
             session.commit()
+            invalidate(settings_cache, user_id)
             return False
     finally:
         session.close()
@@ -1287,60 +1520,44 @@ def clear_user_busy(user_id: int):
     return update_driver_settings(user_id, busy_until=None)
 
 
-def get_driver_profile(user_id: int):
-    """Get driver profile"""
-    session = get_session()
-    if not session:
-        return None
-    try:
-        profile = session.query(DriverProfile).filter(DriverProfile.user_id == user_id).first()
-        return profile
-    finally:
-        session.close()
+def _invalidate_favorites(user_id: int):
+    invalidate(favorite_count_cache, user_id)
+    invalidate(favorite_routes_cache, (user_id, True))
+    invalidate(favorite_routes_cache, (user_id, False))
 
 
-def update_driver_profile(user_id: int, **kwargs):
-    """Update driver profile"""
+@_cached_read(favorite_routes_cache, key=lambda user_id, active_only=True: (user_id, active_only), fallback=list)
+def get_favorite_routes(user_id: int, active_only: bool = True):
+    """Get user's favorite routes (cached until changed or LIST_CACHE_TTL)"""
     session = get_session()
     if not session:
-        return None
+        raise _DbUnavailable()
     try:
-        profile = session.query(DriverProfile).filter(DriverProfile.user_id == user_id).first()
-        if not profile:
-            profile = DriverProfile(user_id=user_id, **kwargs)
-            session.add(profile)
-        else:
-            for key, value in kwargs.items():
-                if hasattr(profile, key):
-                    setattr(profile, key, value)
-            profile.updated_at = datetime.utcnow()
-        session.commit()
-        session.refresh(profile)
-        return profile
-    except Exception as e:
-        session.rollback()
-        logger.error(f"Error updating driver profile: {e}")
-        return None
+        query = session.query(FavoriteRoute).filter(FavoriteRoute.user_id == user_id)
+        if active_only:
+            query = query.filter(FavoriteRoute.is_active == True)
+        return query.all()
     finally:
         session.close()
 
 
-def get_favorite_routes(user_id: int, active_only: bool = True):
-    """Get user's favorite routes"""
+@_cached_read(favorite_count_cache, key=lambda user_id: user_id, fallback=lambda: 0)
+def get_favorite_routes_count(user_id: int) -> int:
+    """Count user's active favorite routes"""
     session = get_session()
     if not session:
-        return []
+        raise _DbUnavailable()
     try:
-        query = session.query(FavoriteRoute).filter(FavoriteRoute.user_id == user_id)
-        if active_only:
-            query = query.filter(FavoriteRoute.is_active == True)
-        return query.all()
+        return session.query(FavoriteRoute.id).filter(
+            FavoriteRoute.user_id == user_id,
+            FavoriteRoute.is_active == True
+        ).count()
     finally:
         session.close()
 
 
 def add_favorite_route(user_id: int, point_a: str, point_b: str, priority_notify: bool = True):
-    """Add favorite route"""
+    """Add favorite route, returns the user's updated active routes (None on error)"""
     session = get_session()
     if not session:
         return None
@@ -1354,19 +1571,19 @@ def add_favorite_route(user_id: int, point_a: str, point_b: str, priority_notify
         if existing:
             existing.is_active = True
             existing.priority_notify = priority_notify
-            session.commit()
-            return existing
-        
-        route = FavoriteRoute(
-            user_id=user_id,
-            point_a=point_a,
-            point_b=point_b,
-            priority_notify=priority_notify
-        )
-        session.add(route)
+        else:
+            session.add(FavoriteRoute(
+                user_id=user_id,
+                point_a=point_a,
+                point_b=point_b,
+                priority_notify=priority_notify
+            ))
         session.commit()
-        session.refresh(route)
-        return route
+        _invalidate_favorites(user_id)
+        return session.query(FavoriteRoute).filter(
+            FavoriteRoute.user_id == user_id,
+            FavoriteRoute.is_active == True
+        ).all()
     except Exception as e:
         session.rollback()
         logger.error(f"Error adding favorite route: {e}")
@@ -1388,6 +1605,7 @@ def remove_favorite_route(route_id: int, user_id: int):
         if route:
             session.delete(route)
             session.commit()
+            _invalidate_favorites(user_id)
             return True
         return False
     except Exception as e:
@@ -1398,6 +1616,30 @@ def remove_favorite_route(route_id: int, user_id: int):
         session.close()
 
 
+def toggle_favorite_route_priority(route_id: int, user_id: int):
+    """Flip priority_notify in a single UPDATE ... RETURNING, None if route not found"""
+    session = get_session()
+    if not session:
+        return None
+    try:
+        row = session.execute(
+            update(FavoriteRoute)
+            .where(FavoriteRoute.id == route_id, FavoriteRoute.user_id == user_id)
+            .values(priority_notify=~func.coalesce(FavoriteRoute.priority_notify, False))
+            .returning(FavoriteRoute.priority_notify)
+        ).first()
+        session.commit()
+        if row:
+            _invalidate_favorites(user_id)
+        return row[0] if row else None
+    except Exception as e:
+        session.rollback()
+        logger.error(f"Error toggling favorite route priority: {e}")
+        return None
+    finally:
+        session.close()
+
+
 def is_favorite_route(user_id: int, point_a: str, point_b: str) -> bool:
     """Check if route is in user's favorites"""
     session = get_session()
@@ -1415,45 +1657,79 @@ def is_favorite_route(user_id: int, point_a: str, point_b: str) -> bool:
         session.close()
 
 
+@_cached_read(blacklist_cache, key=lambda user_id: user_id, fallback=list)
 def get_blacklist(user_id: int):
-    """Get user's blacklist"""
+    """Get user's blacklist (cached until changed or LIST_CACHE_TTL)"""
     session = get_session()
     if not session:
-        return []
+        raise _DbUnavailable()
     try:
         return session.query(Blacklist).filter(Blacklist.user_id == user_id).all()
     finally:
         session.close()
 
 
+@_cached_read(blacklist_count_cache, key=lambda user_id: user_id, fallback=lambda: 0)
+def get_blacklist_count(user_id: int) -> int:
+    """Count user's blacklist entries"""
+    session = get_session()
+    if not session:
+        raise _DbUnavailable()
+    try:
+        return session.query(Blacklist.id).filter(Blacklist.user_id == user_id).count()
+    finally:
+        session.close()
+
+
+def find_blacklist_entry(blacklist, block_type: str, blocked_id: int = None,
+                         blocked_username: str = None, blocked_name: str = None):
+    """Find an entry for the same target in an already loaded blacklist"""
+    for entry in blacklist:
+        if entry.block_type != block_type:
+            continue
+        if blocked_id:
+            if entry.blocked_id == blocked_id:
+                return entry
+        elif blocked_username:
+            if entry.blocked_username and entry.blocked_username.lower() == blocked_username.lower():
+                return entry
+        elif entry.blocked_id is None and entry.blocked_name == blocked_name:
+            return entry
+    return None
+
+
 def add_to_blacklist(user_id: int, block_type: str, blocked_id: int = None, 
                      blocked_username: str = None, blocked_name: str = None, reason: str = None):
-    """Add to blacklist (type: 'author' or 'group')"""
+    """Add to blacklist (type: 'author' or 'group'), returns the user's updated blacklist (None on error)"""
     session = get_session()
     if not session:
         return None
     try:
-        existing = session.query(Blacklist).filter(
+        if blocked_id:
+            target = Blacklist.blocked_id == blocked_id
+        elif blocked_username:
+            target = func.lower(Blacklist.blocked_username) == blocked_username.lower()
+        else:
+            target = (Blacklist.blocked_id == None) & (Blacklist.blocked_name == blocked_name)
+        existing = session.query(Blacklist.id).filter(
             Blacklist.user_id == user_id,
             Blacklist.block_type == block_type,
-            ((Blacklist.blocked_id == blocked_id) if blocked_id else True)
+            target
         ).first()
         
-        if existing:
-            return existing
-        
-        entry = Blacklist(
-            user_id=user_id,
-            block_type=block_type,
-            blocked_id=blocked_id,
-            blocked_username=blocked_username,
-            blocked_name=blocked_name,
-            reason=reason
-        )
-        session.add(entry)
-        session.commit()
-        session.refresh(entry)
-        return entry
+        if not existing:
+            session.add(Blacklist(
+                user_id=user_id,
+                block_type=block_type,
+                blocked_id=blocked_id,
+                blocked_username=blocked_username,
+                blocked_name=blocked_name,
+                reason=reason
+            ))
+            session.commit()
+            invalidate(blacklist_count_cache, user_id)
+            invalidate(blacklist_cache, user_id)
+        return session.query(Blacklist).filter(Blacklist.user_id == user_id).all()
     except Exception as e:
         session.rollback()
         logger.error(f"Error adding to blacklist: {e}")
@@ -1475,6 +1751,8 @@ def remove_from_blacklist(entry_id: int, user_id: int):
         if entry:
             session.delete(entry)
             session.commit()
+            invalidate(blacklist_count_cache, user_id)
+            invalidate(blacklist_cache, user_id)
             return True
         return False
     except Exception as e:
@@ -1528,6 +1806,20 @@ def get_quick_replies(user_id: int, active_only: bool = True):
         session.close()
 
 
+def get_quick_reply_text(reply_id: int, user_id: int):
+    """Reply text of one of the user's quick replies, None if it no longer exists"""
+    session = get_session()
+    if not session:
+        return None
+    try:
+        return session.query(QuickReply.reply_text).filter(
+            QuickReply.id == reply_id,
+            QuickReply.user_id == user_id
+        ).scalar()
+    finally:
+        session.close()
+
+
 def add_quick_reply(user_id: int, button_text: str, reply_text: str, sort_order: int = 0):
     """Add quick reply"""
     session = get_session()
@@ -1781,11 +2073,12 @@ def update_reminder_status(reminder_id: int, status: str):
         session.close()
 
 
+@_cached_read(profile_cache, key=lambda user_id: user_id, fallback=lambda: None)
 def get_driver_profile(user_id: int):
-    """Get driver profile"""
+    """Get driver profile (cached per user for SETTINGS_CACHE_TTL)"""
     session = get_session()
     if not session:
-        return None
+        raise _DbUnavailable()
     try:
         return session.query(DriverProfile).filter(DriverProfile.user_id == user_id).first()
     finally:
@@ -1809,6 +2102,8 @@ def update_driver_profile(user_id: int, **kwargs):
             session.add(profile)
         session.commit()
         session.refresh(profile)
+        with cache_lock:
+            profile_cache[user_id] = profile
         return profile
     except Exception as e:
         session.rollback()
@@ -0,0 +1,11 @@
+import asyncio
+
+DB_CONCURRENCY = 30
+
+_db_semaphore = asyncio.Semaphore(DB_CONCURRENCY)
+
+
+async def run_db(fn, *args, **kwargs):
+    """Run a blocking database call in a worker thread, at most DB_CONCURRENCY at a time"""
+    async with _db_semaphore:
+        return await asyncio.to_thread(fn, *args, **kwargs)
@@ -1,5 +1,9 @@
 import asyncio
+import threading
 from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from cachetools import LRUCache
+from geopy.adapters import RequestsAdapter
 from geopy.geocoders import Nominatim
 from geopy.distance import geodesic
 from geopy.location import Location
@@ -7,10 +11,21 @@ from typing import Optional, Tuple, List, cast
 import re
 from difflib import SequenceMatcher
 
-geolocator = Nominatim(user_agent="taxi_order_bot")
-_executor = ThreadPoolExecutor(max_workers=3)
+GEOCODER_WORKERS = 3
+GEOCODE_CACHE_MAXSIZE = 10000
+REVERSE_GEOCODE_PRECISION = 3
 
-_geocode_cache: dict = {}
+# One keep-alive HTTP pool shared by every geocoding call instead of a new
+# connection (DNS + TLS handshake) per Nominatim request.
+geolocator = Nominatim(
+    user_agent="taxi_order_bot",
+    adapter_factory=partial(RequestsAdapter, pool_connections=1, pool_maxsize=GEOCODER_WORKERS),
+)
+_executor = ThreadPoolExecutor(max_workers=GEOCODER_WORKERS)
+
+_geocode_cache: LRUCache = LRUCache(maxsize=GEOCODE_CACHE_MAXSIZE)
+_reverse_geocode_cache: LRUCache = LRUCache(maxsize=GEOCODE_CACHE_MAXSIZE)
+_cache_lock = threading.Lock()
 
 KNOWN_COORDINATES = {
     'солнечная долина': (55.0344, 60.0878),
@@ -89,27 +104,27 @@ KNOWN_COORDINATES = {
 }
 
 def get_coordinates(location_name: str) -> Optional[Tuple[float, float]]:
-    if location_name in _geocode_cache:
-        return _geocode_cache[location_name]
-    
     location_lower = location_name.lower().strip()
     if location_lower in KNOWN_COORDINATES:
-        coords = KNOWN_COORDINATES[location_lower]
-        _geocode_cache[location_name] = coords
-        return coords
+        return KNOWN_COORDINATES[location_lower]
+    
+    with _cache_lock:
+        if location_lower in _geocode_cache:
+            return _geocode_cache[location_lower]
     
     try:
         search_query = f"{location_name}, Россия"
         result = geolocator.geocode(search_query)
-        if result:
-            location = cast(Location, result)
-            coords = (location.latitude, location.longitude)
-            _geocode_cache[location_name] = coords
-            return coords
-        _geocode_cache[location_name] = None
-        return None
     except Exception:
         return None
+    
+    coords = None
+    if result:
+        location = cast(Location, result)
+        coords = (location.latitude, location.longitude)
+    with _cache_lock:
+        _geocode_cache[location_lower] = coords
+    return coords
 
 async def get_coordinates_async(location_name: str) -> Optional[Tuple[float, float]]:
     loop = asyncio.get_event_loop()
@@ -117,20 +132,24 @@ async def get_coordinates_async(location_name: str) -> Optional[Tuple[float, flo
 
 
 def get_city_by_coordinates(latitude: float, longitude: float) -> Optional[str]:
-    """Reverse geocoding - get city name from coordinates"""
+    """Reverse geocoding - get city name from coordinates (cached per ~100 m cell)"""
+    key = (round(latitude, REVERSE_GEOCODE_PRECISION), round(longitude, REVERSE_GEOCODE_PRECISION))
+    with _cache_lock:
+        if key in _reverse_geocode_cache:
+            return _reverse_geocode_cache[key]
+    
     try:
         location = geolocator.reverse((latitude, longitude), language='ru', exactly_one=True)
-        if location and location.raw:
-            address = location.raw.get('address', {})
-            city = address.get('city') or address.get('town') or address.get('village') or address.get('municipality')
-            if city:
-                return city
-            state = address.get('state')
-            if state:
-                return state
-        return None
     except Exception:
         return None
+    
+    city = None
+    if location and location.raw:
+        address = location.raw.get('address', {})
+        city = address.get('city') or address.get('town') or address.get('village') or address.get('municipality') or address.get('state')
+    with _cache_lock:
+        _reverse_geocode_cache[key] = city
+    return city
 
 
 async def get_city_by_coordinates_async(latitude: float, longitude: float) -> Optional[str]: